@@ -0,0 +1,37 @@
+import random
+from collections.abc import Iterator
+
+
+def generate_diff(
+    files: int,
+    hunks_per_file: int = 1,
+    lines_per_hunk: int = 5,
+    seed: int = 0,
+) -> Iterator[str]:
+    """
+    Generates the lines of a synthetic `git diff --staged` output of modified Python files.
+
+    Lines are generated lazily, so even huge diffs are never held in memory at once.
+
+    :param files: The number of files.
+    :param hunks_per_file: The number of hunks of every file.
+    :param lines_per_hunk: The number of added lines of every hunk, each one replacing a removed line.
+    :param seed: The seed of the random names and values.
+    :return: An iterator of the lines of the diff.
+    """
+    generator = random.Random(seed)
+    for file_index in range(files):
+        path = f"src/package_{file_index // 100}/module_{file_index}.py"
+        yield f"diff --git a/{path} b/{path}"
+        yield f"index {generator.getrandbits(28):07x}..{generator.getrandbits(28):07x} 100644"
+        yield f"--- a/{path}"
+        yield f"+++ b/{path}"
+        for hunk_index in range(hunks_per_file):
+            start = hunk_index * (lines_per_hunk + 20) + 1
+            yield f"@@ -{start},{lines_per_hunk + 2} +{start},{lines_per_hunk + 2} @@ def function_{hunk_index}():"
+            yield f"     # Hunk {hunk_index} of {path}"
+            for line_index in range(lines_per_hunk):
+                name = f"value_{hunk_index}_{line_index}"
+                yield f"-    {name} = {generator.randint(0, 1000)}"
+                yield f"+    {name} = compute({name!r}, {generator.randint(0, 1000)})"
+            yield "     return None"
@@ -0,0 +1,321 @@
+import email.parser
+import email.policy
+import json
+import random
+import threading
+import time
+from email.message import EmailMessage
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+from utils.protocols import AIConsumerProtocol
+from utils.tokens import estimate_tokens
+
+
+class FakeBackend:
+    """
+    Latency, error and response size model shared by the fake consumer and the fake server.
+
+    Every call sleeps for `latency` plus or minus a random `jitter`, fails with probability `error_rate`,
+    and otherwise answers with `response_lines` lines of feedback of `line_length` characters, or OK.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        response_lines: int = 0,
+        line_length: int = 80,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.response_lines = response_lines
+        self.line_length = line_length
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def call(self) -> str | None:
+        """
+        Simulates a call.
+
+        :return: The generated text, or None if the call failed.
+        """
+        with self.lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        time.sleep(delay)
+        if failed:
+            return None
+        if not self.response_lines:
+            return "OK"
+        line = ("Consider renaming this variable " * (self.line_length // 32 + 1))[: self.line_length]
+        return "\n".join(f"{index + 1}. {line}" for index in range(self.response_lines))
+
+
+class FakeAIConsumer(AIConsumerProtocol):
+    """In-process AIConsumerProtocol implementation backed by a FakeBackend."""
+
+    def __init__(self, backend: FakeBackend | None = None):
+        self.backend = backend or FakeBackend()
+
+    def generate_text(self, instructions: str, input: str, model: str) -> str:
+        text = self.backend.call()
+        if text is None:
+            raise RuntimeError("Error generating text: fake backend error")
+        return text
+
+
+class FakeResponsesServer:
+    """
+    Local HTTP stand-in for the OpenAI Responses endpoint, backed by a FakeBackend.
+
+    Use it as a context manager and point an `OpenAIConsumer` at `base_url`. Failed calls answer with
+    alternating 429 and 500 errors, like a throttled or overloaded API.
+
+    It also stands in for the Files and Batch endpoints: a batch of Responses requests stays in progress
+    for `batch_polls` retrievals, then runs every request through the backend at once. Failed requests
+    go to the error file of the batch.
+    """
+
+    def __init__(self, backend: FakeBackend | None = None, batch_polls: int = 1):
+        self.backend = backend or FakeBackend()
+        self.batch_polls = batch_polls
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.requests: list[dict[str, Any]] = []
+        # The uploaded and generated files, and the batches, by id
+        self.files: dict[str, bytes] = {}
+        self.batches: dict[str, dict[str, Any]] = {}
+        self._polls: dict[str, int] = {}
+
+    def __enter__(self) -> "FakeResponsesServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host!s}:{port}/v1"
+
+    def response_body(self, request: dict[str, Any], text: str) -> dict[str, Any]:
+        """
+        Builds a Responses API body answering the request with the given text.
+        """
+        input_tokens = estimate_tokens(f"{request.get('instructions') or ''}\n{request.get('input') or ''}")
+        output_tokens = estimate_tokens(text)
+        return {
+            "id": f"resp_{len(self.requests)}",
+            "object": "response",
+            "created_at": int(time.time()),
+            "model": request.get("model"),
+            "status": "completed",
+            "output": [
+                {
+                    "id": f"msg_{len(self.requests)}",
+                    "type": "message",
+                    "role": "assistant",
+                    "status": "completed",
+                    "content": [{"type": "output_text", "text": text, "annotations": []}],
+                }
+            ],
+            "parallel_tool_calls": True,
+            "tool_choice": "auto",
+            "tools": [],
+            "usage": {
+                "input_tokens": input_tokens,
+                "input_tokens_details": {"cached_tokens": 0},
+                "output_tokens": output_tokens,
+                "output_tokens_details": {"reasoning_tokens": 0},
+                "total_tokens": input_tokens + output_tokens,
+            },
+        }
+
+    def handle(self, method: str, path: str, body: bytes, content_type: str = "") -> tuple[int, dict[str, str], bytes]:
+        """
+        Handles a request.
+
+        :return: The status code, the headers and the body of the response.
+        """
+        path = path.rstrip("/")
+        if method == "POST" and path == "/v1/files":
+            return self._upload(body, content_type)
+        if method == "GET" and path.startswith("/v1/files/") and path.endswith("/content"):
+            file_id = path.removeprefix("/v1/files/").removesuffix("/content")
+            if file_id in self.files:
+                return 200, {"Content-Type": "application/octet-stream"}, self.files[file_id]
+        if method == "POST" and path == "/v1/batches":
+            return self._create_batch(json.loads(body or b"{}"))
+        if method == "GET" and path.removeprefix("/v1/batches/") in self.batches:
+            return self._retrieve_batch(path.removeprefix("/v1/batches/"))
+        if method != "POST" or path != "/v1/responses":
+            return self._json(404, {"error": {"message": f"Unknown endpoint {method} {path}", "type": "not_found"}})
+        request = json.loads(body or b"{}")
+        with self.backend.lock:
+            self.requests.append(request)
+        text = self.backend.call()
+        if text is None:
+            if self.backend.errors % 2:
+                return self._json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit"}}, "0.05")
+            return self._json(500, {"error": {"message": "Internal server error", "type": "server_error"}})
+        if request.get("stream"):
+            return self._event_stream(request, text)
+        return self._json(200, self.response_body(request, text))
+
+    def _upload(self, body: bytes, content_type: str) -> tuple[int, dict[str, str], bytes]:
+        """
+        Stores the file of a multipart upload.
+        """
+        message = email.parser.BytesParser(EmailMessage, policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+        content = fields["file"].get_payload(decode=True)
+        assert isinstance(content, bytes)
+        with self.backend.lock:
+            file_id = f"file_{len(self.files)}"
+            self.files[file_id] = content
+        file = self._file(file_id, fields["file"].get_filename() or "", fields["purpose"].get_content())
+        return self._json(200, file)
+
+    def _file(self, file_id: str, filename: str, purpose: str) -> dict[str, Any]:
+        return {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(self.files[file_id]),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+
+    def _create_batch(self, request: dict[str, Any]) -> tuple[int, dict[str, str], bytes]:
+        if request.get("input_file_id") not in self.files:
+            return self._json(404, {"error": {"message": "Unknown input file", "type": "not_found"}})
+        with self.backend.lock:
+            batch_id = f"batch_{len(self.batches)}"
+            self.batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": request["endpoint"],
+                "input_file_id": request["input_file_id"],
+                "completion_window": request["completion_window"],
+                "status": "validating",
+                "created_at": int(time.time()),
+                "output_file_id": None,
+                "error_file_id": None,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            }
+            self._polls[batch_id] = self.batch_polls
+        return self._json(200, self.batches[batch_id])
+
+    def _retrieve_batch(self, batch_id: str) -> tuple[int, dict[str, str], bytes]:
+        """
+        Gets a batch, running its requests once it has been polled `batch_polls` times.
+        """
+        batch = self.batches[batch_id]
+        with self.backend.lock:
+            self._polls[batch_id] -= 1
+            run = self._polls[batch_id] < 0 and batch["status"] != "completed"
+            if not run and batch["status"] != "completed":
+                batch["status"] = "in_progress"
+        if run:
+            outputs: list[dict[str, Any]] = []
+            errors: list[dict[str, Any]] = []
+            for line in self.files[batch["input_file_id"]].decode("utf-8").splitlines():
+                request = json.loads(line)
+                with self.backend.lock:
+                    self.requests.append(request["body"])
+                text = self.backend.call()
+                result: dict[str, Any] = {
+                    "id": f"batch_req_{len(outputs) + len(errors)}",
+                    "custom_id": request["custom_id"],
+                }
+                if text is None:
+                    error = {"error": {"message": "Internal server error", "type": "server_error"}}
+                    errors.append({**result, "response": {"status_code": 500, "body": error}, "error": None})
+                else:
+                    body = self.response_body(request["body"], text)
+                    outputs.append({**result, "response": {"status_code": 200, "body": body}, "error": None})
+            with self.backend.lock:
+                for key, results in (("output_file_id", outputs), ("error_file_id", errors)):
+                    if results:
+                        file_id = f"file_{len(self.files)}"
+                        self.files[file_id] = "".join(json.dumps(result) + "\n" for result in results).encode()
+                        batch[key] = file_id
+                batch["request_counts"] = {
+                    "total": len(outputs) + len(errors),
+                    "completed": len(outputs),
+                    "failed": len(errors),
+                }
+                batch["status"] = "completed"
+        return self._json(200, batch)
+
+    def _event_stream(self, request: dict[str, Any], text: str) -> tuple[int, dict[str, str], bytes]:
+        """
+        Answers a streaming request with server-sent events: a text delta per line, then the completed response.
+        """
+        response = self.response_body(request, text)
+        events: list[dict[str, Any]] = [
+            {
+                "type": "response.output_text.delta",
+                "item_id": response["output"][0]["id"],
+                "output_index": 0,
+                "content_index": 0,
+                "delta": delta,
+            }
+            for delta in text.splitlines(keepends=True)
+        ]
+        events.append({"type": "response.completed", "response": response})
+        body = "".join(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n" for event in events)
+        return 200, {"Content-Type": "text/event-stream"}, body.encode("utf-8")
+
+    def _json(
+        self, status: int, body: dict[str, Any], retry_after: str | None = None
+    ) -> tuple[int, dict[str, str], bytes]:
+        headers = {"Content-Type": "application/json"}
+        if retry_after is not None:
+            headers["Retry-After"] = retry_after
+        return status, headers, json.dumps(body).encode("utf-8")
+
+    def _handler_class(self) -> type[BaseHTTPRequestHandler]:
+        fake_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self, method: str) -> None:
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                status, headers, payload = fake_server.handle(
+                    method, self.path, body, self.headers.get("Content-Type", "")
+                )
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self) -> None:
+                self._respond("GET")
+
+            def do_POST(self) -> None:
+                self._respond("POST")
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        return Handler
@@ -0,0 +1,194 @@
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import ExitStack, redirect_stdout
+from dataclasses import asdict, dataclass, field
+from unittest.mock import patch
+
+from benchmarks.diffs import generate_diff
+from benchmarks.fakes import FakeAIConsumer, FakeBackend, FakeResponsesServer
+from hooks.main import EXIT_CODE_FAIL, EXIT_CODE_SUCCESS, main
+from utils.diff_parser import parse_diff
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    files: int
+    hunks_per_file: int = 1
+    lines_per_hunk: int = 5
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    response_lines: int = 0
+    # Send the requests to the local HTTP stand-in through OpenAIConsumer instead of the in-process fake
+    http: bool = False
+    args: tuple[str, ...] = ()
+    # Regression thresholds checked with --check
+    max_wall: float = 60.0
+    expected_exit_code: int | None = EXIT_CODE_SUCCESS
+    quick: bool = False
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    files: int
+    calls: int
+    errors: int
+    wall: float
+    peak_memory_mb: float | None
+    exit_code: int
+    problems: list[str] = field(default_factory=list)
+
+
+SCENARIOS = [
+    Scenario("small", files=10, latency=0.05, jitter=0.02, max_wall=5, quick=True),
+    Scenario(
+        "feedback-all-types",
+        files=20,
+        latency=0.05,
+        jitter=0.02,
+        response_lines=5,
+        args=("--security", "--format"),
+        max_wall=5,
+        expected_exit_code=EXIT_CODE_FAIL,
+        quick=True,
+    ),
+    Scenario("http", files=20, latency=0.02, jitter=0.01, http=True, max_wall=10, quick=True),
+    Scenario("http-errors", files=20, latency=0.02, error_rate=0.2, http=True, max_wall=20),
+    Scenario(
+        "fail-fast",
+        files=200,
+        latency=0.05,
+        response_lines=5,
+        http=True,
+        args=("--stream", "--fail-fast"),
+        max_wall=5,
+        expected_exit_code=EXIT_CODE_FAIL,
+    ),
+    Scenario("packed", files=1_000, args=("--pack-tokens", "4000"), max_wall=30),
+    Scenario("many-files", files=10_000, max_wall=120),
+    Scenario("huge-hunks", files=3, lines_per_hunk=50_000, max_wall=60),
+]
+
+
+def run_main(scenario: Scenario, backend: FakeBackend) -> int:
+    """
+    Runs the hook on the synthetic diff of a scenario, with its output discarded.
+
+    :return: The exit code of the hook.
+    """
+    diff = parse_diff(
+        generate_diff(scenario.files, scenario.hunks_per_file, scenario.lines_per_hunk),
+    )
+    with ExitStack() as stack:
+        stack.enter_context(patch("hooks.main.staged_diff", return_value=diff))
+        if scenario.http:
+            server = stack.enter_context(FakeResponsesServer(backend))
+            environment = {"OPENAI_BASE_URL": server.base_url, "OPENAI_API_KEY": "benchmark"}
+            stack.enter_context(patch.dict(os.environ, environment))
+        else:
+            stack.enter_context(patch("hooks.main.OpenAIConsumer", return_value=FakeAIConsumer(backend)))
+        stack.enter_context(redirect_stdout(io.StringIO()))
+        return main(["--no-cache", "--no-history", "--no-daemon", "--review-whitespace-only", *scenario.args])
+
+
+def run_scenario(scenario: Scenario, measure_memory: bool = True) -> ScenarioResult:
+    """
+    Runs a scenario, measuring its wall time and, in a second run, its memory peak.
+
+    :param scenario: The scenario to run.
+    :param measure_memory: Whether to measure the memory peak, which takes a second run.
+    :return: The result of the scenario.
+    """
+
+    def make_backend() -> FakeBackend:
+        return FakeBackend(
+            latency=scenario.latency,
+            jitter=scenario.jitter,
+            error_rate=scenario.error_rate,
+            response_lines=scenario.response_lines,
+        )
+
+    backend = make_backend()
+    start = time.perf_counter()
+    exit_code = run_main(scenario, backend)
+    wall = time.perf_counter() - start
+
+    peak_memory_mb = None
+    if measure_memory:
+        # tracemalloc slows everything down, so it gets a run of its own
+        tracemalloc.start()
+        try:
+            run_main(scenario, make_backend())
+            peak_memory_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        finally:
+            tracemalloc.stop()
+
+    result = ScenarioResult(
+        scenario.name, scenario.files, backend.calls, backend.errors, wall, peak_memory_mb, exit_code
+    )
+    if wall > scenario.max_wall:
+        result.problems.append(f"wall time {wall:.2f}s over {scenario.max_wall:.2f}s")
+    if scenario.expected_exit_code is not None and exit_code != scenario.expected_exit_code:
+        result.problems.append(f"exit code {exit_code}, expected {scenario.expected_exit_code}")
+    return result
+
+
+RESULT_HEADER = f"{'scenario':<20} {'files':>7} {'calls':>7} {'errors':>7} {'wall (s)':>9} {'peak (MB)':>10}  exit"
+
+
+def format_result(result: ScenarioResult) -> str:
+    """
+    Formats a result as a row of the RESULT_HEADER table.
+    """
+    memory = f"{result.peak_memory_mb:.1f}" if result.peak_memory_mb is not None else "-"
+    row = (
+        f"{result.name:<20} {result.files:>7} {result.calls:>7} {result.errors:>7} "
+        f"{result.wall:>9.2f} {memory:>10}  {result.exit_code}"
+    )
+    return row + "".join(f"  ! {problem}" for problem in result.problems)
+
+
+def main_benchmarks(argv: list[str] | None = None) -> int:
+    """
+    Runs the benchmark scenarios against the fake backends and reports their results.
+
+    Returns:
+        int: 1 if `--check` is set and a scenario regressed, 0 otherwise.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the ai-review hook offline with fake AI backends.")
+    parser.add_argument("--quick", action="store_true", help="Only run the quick scenarios, as CI does.")
+    parser.add_argument("--scenario", action="append", default=[], help="Only run this scenario. Can be repeated.")
+    parser.add_argument("--no-memory", action="store_true", help="Do not measure the memory peak.")
+    parser.add_argument("--json", metavar="PATH", help="Also write the results as JSON to this file.")
+    parser.add_argument("--check", action="store_true", help="Fail if a scenario exceeds its thresholds.")
+    args = parser.parse_args(argv)
+
+    scenarios = [
+        scenario
+        for scenario in SCENARIOS
+        if (not args.quick or scenario.quick) and (not args.scenario or scenario.name in args.scenario)
+    ]
+    results = []
+    print(RESULT_HEADER)
+    for scenario in scenarios:
+        results.append(run_scenario(scenario, measure_memory=not args.no_memory))
+        print(format_result(results[-1]), flush=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump([asdict(result) for result in results], file, indent=2)
+
+    if args.check and any(result.problems for result in results):
+        return EXIT_CODE_FAIL
+    return EXIT_CODE_SUCCESS
+
+
+if __name__ == "__main__":
+    sys.exit(main_benchmarks())
@@ -0,0 +1,94 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from hooks.main import EXIT_CODE_FAIL, EXIT_CODE_SUCCESS
+
+ROOT = Path(__file__).resolve().parent.parent
+# The modules that the no-op path must not import: the OpenAI SDK, and the slow imports of the optional stages
+LAZY_MODULES = ("openai", "ast", "socketserver", "utils.triage", "utils.clustering", "utils.commit_range")
+# Runs the hook like its entry point does, and checks that the no-op path did not import the lazy modules
+HOOK_CODE = (
+    "import sys\n"
+    "from hooks.main import main\n"
+    "exit_code = main(sys.argv[1:])\n"
+    f"for module in {LAZY_MODULES!r}:\n"
+    "    if module in sys.modules:\n"
+    "        sys.exit(f'The {module} module was imported without any file to review')\n"
+    "sys.exit(exit_code)\n"
+)
+DEFAULT_RUNS = 10
+DEFAULT_MAX_OVERHEAD = 0.05
+
+
+def time_command(command: list[str], cwd: str, runs: int, pycache: str) -> list[float]:
+    """
+    Runs a command several times, after a first run that is not timed.
+
+    Bytecode is written to `pycache` and read back by the timed runs, like an installed hook does, so that
+    compiling the sources does not count.
+
+    :return: The wall time of every timed run, in seconds.
+    :raises RuntimeError: If the command fails.
+    """
+    environment = {**os.environ, "PYTHONPATH": str(ROOT), "PYTHONPYCACHEPREFIX": pycache}
+    environment.pop("PYTHONDONTWRITEBYTECODE", None)
+    times = []
+    for _ in range(runs + 1):
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=cwd, env=environment, capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(f"{' '.join(command[:2])} failed: {result.stdout}{result.stderr}")
+    return times[1:]
+
+
+def measure_startup(runs: int = DEFAULT_RUNS) -> tuple[float, float]:
+    """
+    Measures the hook in a repository without staged changes, against a bare interpreter start.
+
+    :param runs: The number of runs of each command.
+    :return: The median wall time of the interpreter alone and of the hook, in seconds.
+    """
+    with tempfile.TemporaryDirectory() as repository, tempfile.TemporaryDirectory() as pycache:
+        subprocess.run(["git", "init", "-q", repository], check=True)
+        interpreter = time_command([sys.executable, "-c", "pass"], repository, runs, pycache)
+        hook = time_command([sys.executable, "-c", HOOK_CODE, "--no-cache"], repository, runs, pycache)
+    return statistics.median(interpreter), statistics.median(hook)
+
+
+def main_startup(argv: list[str] | None = None) -> int:
+    """
+    Measures how long the hook takes to start and find there is nothing to review.
+
+    Returns:
+        int: 1 if `--check` is set and the hook overhead is over its threshold, 0 otherwise.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the startup of the ai-review hook with no changes.")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="Runs of every command (default: 10).")
+    parser.add_argument(
+        "--max-overhead",
+        type=float,
+        default=DEFAULT_MAX_OVERHEAD,
+        help=f"Maximum seconds the hook may take over a bare interpreter start, with --check "
+        f"(default: {DEFAULT_MAX_OVERHEAD:g}).",
+    )
+    parser.add_argument("--check", action="store_true", help="Fail if the hook overhead is over its threshold.")
+    args = parser.parse_args(argv)
+
+    interpreter, hook = measure_startup(args.runs)
+    overhead = hook - interpreter
+    print(f"interpreter {interpreter * 1000:.1f}ms, hook {hook * 1000:.1f}ms, overhead {overhead * 1000:.1f}ms")
+    if args.check and overhead > args.max_overhead:
+        print(f"! overhead over {args.max_overhead * 1000:.0f}ms")
+        return EXIT_CODE_FAIL
+    return EXIT_CODE_SUCCESS
+
+
+if __name__ == "__main__":
+    sys.exit(main_startup())
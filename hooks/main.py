@@ -1,90 +1,804 @@
 import argparse
-import re
-import subprocess
+import functools
+import itertools
+import os
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import AbstractContextManager, ExitStack, nullcontext
+from pathlib import Path
+from typing import TYPE_CHECKING
 
 from utils.ai_feedback_filter import AIConsumerFeedbackResponse, FeedbackType
-from utils.openai_consumer import OpenAIConsumer
+from utils.batch import DEFAULT_POLL_INTERVAL, BatchReviewer
+from utils.budget import ESTIMATED_OUTPUT_TOKENS, PRIORITY_CRITERIA, BudgetGovernor, parse_priority
+from utils.chunking import DEFAULT_CHUNK_TOKENS, chunk_diff_file
+from utils.config import ConfigError, apply_config, load_config
+from utils.context import DEFAULT_CONTEXT_LINES, RemovedLines, trim_context
+from utils.daemon import ENV_SOCKET, SOCKET_FILE, DaemonReviewer, connect
+from utils.diff_parser import DiffFile
+from utils.dispatcher import DEFAULT_MAX_WORKERS, ReviewDispatcher
+from utils.git import BlobReader, GitError, git_toplevel, range_diff, range_numstat, staged_diff, staged_numstat
+from utils.locking import serialized_output
+from utils.openai_consumer import DEFAULT_MAX_RETRIES, DEFAULT_RETRY_DEADLINE, OpenAIConsumer
+from utils.rate_limit import ENV_RPM, ENV_TPM, STATE_FILE, RateLimiter
+from utils.review_cache import ReviewCache, default_cache_dir
+from utils.routing import DEFAULT_MODEL, ModelRouter, Route
+from utils.skip_rules import DEFAULT_EXCLUDE, SkipRules
+from utils.stats import RunStats
+from utils.tokens import estimate_tokens
+
+if TYPE_CHECKING:
+    from utils.clustering import ChangeClusters
+    from utils.commit_range import CommitDiff
+    from utils.triage import Triage
 
 EXIT_CODE_SUCCESS = 0
 EXIT_CODE_FAIL = 1
-DIFF_PATTERN = r"^@@ -\d+(?:,\d+)? \+\d+(?:,\d+)? @@.*$"
+# Set by `pre-commit run --from-ref REF --to-ref REF`
+ENV_FROM_REF = "PRE_COMMIT_FROM_REF"
+ENV_TO_REF = "PRE_COMMIT_TO_REF"
+# What a review cut short by --deadline returns
+ON_TIMEOUT_FAIL = "fail"
+ON_TIMEOUT_PASS = "pass"
+# Held by the hooks pre-commit runs in parallel while they print their output
+OUTPUT_LOCK_FILE = "output.lock"
+
+
+def positive_int(value: str) -> int:
+    """Argparse type for integer options that must be greater than zero."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return number
+
+
+def non_negative_int(value: str) -> int:
+    """Argparse type for integer options that can be disabled with zero."""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a non-negative integer")
+    return number
+
+
+def positive_float(value: str) -> float:
+    """Argparse type for options in seconds or dollars that must be greater than zero."""
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+
+def priority(value: str) -> tuple[str, ...]:
+    """Argparse type for the priority of the files reviewed within a budget."""
+    try:
+        return parse_priority(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from e
+
+
+def route(value: str) -> Route:
+    """Argparse type for model routes."""
+    try:
+        return Route.parse(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from e
+
+
+def text_file(path: str) -> str:
+    """Argparse type for options that read a text file."""
+    try:
+        with open(path, encoding="utf-8") as file:
+            return file.read()
+    except (OSError, UnicodeDecodeError) as e:
+        raise argparse.ArgumentTypeError(f"Unable to read {path}: {e}") from e
+
+
+def parse_arguments(parser: argparse.ArgumentParser, argv: list[str] | None) -> argparse.Namespace:
+    """Parses the command-line arguments, with the defaults set in the [tool.ai-review] table of pyproject.toml."""
+    try:
+        apply_config(parser, load_config())
+    except ConfigError as e:
+        parser.error(str(e))
+    return parser.parse_args(argv)
+
+
+def build_skip_rules(
+    args: argparse.Namespace,
+    numstat: Callable[..., dict[str, tuple[int | None, int | None]]] | None = staged_numstat,
+) -> SkipRules:
+    """Builds the rules that drop the files not worth reviewing before any request is made.
+    `numstat` gets the line counts of the reviewed changes, staged by default; None leaves the whitespace
+    check to the caller."""
+    return SkipRules(
+        include=args.include,
+        exclude=(() if args.no_default_excludes else DEFAULT_EXCLUDE) + tuple(args.exclude),
+        max_diff_lines=args.max_diff_lines,
+        skip_deleted=not args.review_deleted,
+        whitespace_changes=None
+        if args.review_whitespace_only or numstat is None
+        else set(numstat(ignore_whitespace=True)),
+    )
+
+
+def add_review_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the options that decide what is reviewed and how, shared by the hook and `ai-review watch`."""
+    parser.add_argument("--format", action="store_true", help="Enable format feedback.")
+    parser.add_argument("--security", action="store_true", help="Enable security feedback.")
+    parser.add_argument(
+        "--concurrency",
+        type=positive_int,
+        default=DEFAULT_MAX_WORKERS,
+        help=f"Maximum number of review requests sent in parallel (default: {DEFAULT_MAX_WORKERS}).",
+    )
+    parser.add_argument(
+        "--combined",
+        action="store_true",
+        help="Request all the enabled feedback types of a file with a single call.",
+    )
+    parser.add_argument(
+        "--pack-tokens",
+        type=non_negative_int,
+        default=0,
+        help="Pack several small files into a single request of up to this many estimated tokens (default: disabled).",
+    )
+    parser.add_argument(
+        "--max-chunk-tokens",
+        type=non_negative_int,
+        default=DEFAULT_CHUNK_TOKENS,
+        help="Split larger file diffs on hunk boundaries into chunks of up to this many estimated tokens, "
+        f"reviewed in parallel; 0 disables it (default: {DEFAULT_CHUNK_TOKENS}).",
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="Only review the files matching this pattern. Can be repeated.",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="Never review the files matching this pattern, besides lockfiles, minified and generated files. "
+        "Can be repeated.",
+    )
+    parser.add_argument(
+        "--no-default-excludes",
+        action="store_true",
+        help="Review lockfiles, minified and generated files too.",
+    )
+    parser.add_argument(
+        "--max-diff-lines",
+        type=non_negative_int,
+        default=0,
+        help="Skip the files with more added and deleted lines than this (default: no limit).",
+    )
+    parser.add_argument("--review-deleted", action="store_true", help="Review deleted files too.")
+    parser.add_argument(
+        "--review-whitespace-only",
+        action="store_true",
+        help="Review the files whose only changes are whitespace too.",
+    )
+    parser.add_argument(
+        "--trim-context",
+        action="store_true",
+        help="Replace the unchanged lines around each change with its enclosing function or class, read from "
+        "the staged file, for the supported languages (Python).",
+    )
+    parser.add_argument(
+        "--context-lines",
+        type=non_negative_int,
+        default=DEFAULT_CONTEXT_LINES,
+        help="With --trim-context, unchanged lines kept around the changes outside of any function or class "
+        f"(default: {DEFAULT_CONTEXT_LINES}).",
+    )
+    parser.add_argument(
+        "--removed-lines",
+        choices=[removed_lines.value for removed_lines in RemovedLines],
+        default=RemovedLines.KEEP.value,
+        help="With --trim-context, send the removed lines, only their count, or nothing (default: keep).",
+    )
+    parser.add_argument(
+        "--model",
+        default=DEFAULT_MODEL,
+        help=f"Model of the requests no --route applies to (default: {DEFAULT_MODEL}).",
+    )
+    parser.add_argument(
+        "--route",
+        type=route,
+        action="append",
+        default=[],
+        metavar="SPEC",
+        help="Send the requests matching a route to its model, like "
+        "`model=gpt-4.1,types=SECURITY,files=*.py|*.js,min-tokens=2000,max-tokens=8000`, where every condition "
+        "is optional and sizes are estimated input tokens. The first matching route wins. Can be repeated.",
+    )
+    parser.add_argument(
+        "--context-file",
+        dest="context",
+        type=text_file,
+        metavar="PATH",
+        help="Send this file, like a style guide, with every request, at the start of the instructions shared by "
+        "every call, so that the API can serve it from its prompt cache.",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Always request fresh feedback from the API.")
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory where feedback is cached between runs (default: $XDG_CACHE_HOME/ai-review).",
+    )
+
+
+def build_feedback_response(
+    args: argparse.Namespace,
+    consumer: OpenAIConsumer,
+    cache: ReviewCache | None = None,
+) -> AIConsumerFeedbackResponse:
+    """Builds the feedback response configured by `add_review_arguments`."""
+    return AIConsumerFeedbackResponse(
+        consumer=consumer, cache=cache, router=build_router(args), context=args.context or ""
+    )
+
+
+def build_router(args: argparse.Namespace) -> ModelRouter:
+    """Builds the router that chooses the model of every request, configured by `add_review_arguments`."""
+    return ModelRouter(args.route, default_model=args.model)
+
+
+def review_files(
+    args: argparse.Namespace,
+    diff_files: Iterable[DiffFile],
+    stats: RunStats | None = None,
+    revision: str = "",
+    prefix: str = "",
+    triage: "Triage | None" = None,
+) -> Iterator[tuple[str, list[str]]]:
+    """
+    Prepares the file diffs configured by `add_review_arguments` for review: trims their context if asked
+    to, with the content of the files at `revision` (staged by default), then splits them in chunks.
+    Files are named by their path, after `prefix`, and triaged first if a triage is given.
+    """
+    if not args.trim_context and triage is None:
+        for diff_file in diff_files:
+            yield prefix + diff_file.path, chunk_diff_file(diff_file, args.max_chunk_tokens)
+        return
+    from utils.triage import PYTHON_SUFFIXES
+
+    removed_lines = RemovedLines(args.removed_lines)
+    with BlobReader() as blobs:
+        for diff_file in diff_files:
+            # Triage only needs the content of the files it can parse
+            needs_source = args.trim_context or diff_file.path.endswith(PYTHON_SUFFIXES)
+            source = None
+            if needs_source and diff_file.hunks and not diff_file.is_binary:
+                source = blobs.read(diff_file.path, revision)
+            if triage is not None:
+                triage.triage(prefix + diff_file.path, diff_file, source)
+            if not args.trim_context:
+                yield prefix + diff_file.path, chunk_diff_file(diff_file, args.max_chunk_tokens)
+                continue
+            trimmed = trim_context(diff_file, source, args.context_lines, removed_lines)
+            if stats is not None and trimmed is not diff_file:
+                stats.record_context(
+                    prefix + diff_file.path,
+                    estimate_tokens(diff_file.review_input()),
+                    estimate_tokens(trimmed.review_input()),
+                )
+            yield prefix + trimmed.path, chunk_diff_file(trimmed, args.max_chunk_tokens)
+
+
+def commit_files(
+    args: argparse.Namespace,
+    commits: Iterable["CommitDiff"],
+    skip_rules: SkipRules,
+    stats: RunStats | None = None,
+    clusters: "ChangeClusters | None" = None,
+    triage: "Triage | None" = None,
+) -> Iterator[tuple[str, list[str]]]:
+    """Prepares the file diffs of every commit for review, like `review_files`, labelled `<commit>:<path>`."""
+    for commit in commits:
+        if commit.whitespace_changes is not None:
+            skip_rules.whitespace_changes = commit.whitespace_changes
+        prefix = f"{commit.commit[:12]}:"
+        diff_files: Iterable[DiffFile] = commit.diff_files
+        if args.filenames:
+            shard = set(args.filenames)
+            diff_files = (diff_file for diff_file in diff_files if diff_file.path in shard)
+        diff_files = skip_rules.filter(diff_files)
+        if clusters is not None:
+            diff_files = clusters.filter(diff_files, prefix)
+        yield from review_files(args, diff_files, stats, commit.commit, prefix=prefix, triage=triage)
+
+
+def get_feedback_types(args: argparse.Namespace) -> list[FeedbackType]:
+    """Gets the feedback types enabled by `add_review_arguments`."""
+    feedback_types = [FeedbackType.REVIEW]
+    if args.format:
+        feedback_types.append(FeedbackType.FORMAT)
+    if args.security:
+        feedback_types.append(FeedbackType.SECURITY)
+    return feedback_types
+
+
+def add_consumer_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the options of the OpenAI consumer, shared by the hook and the review daemon."""
+    parser.add_argument(
+        "--base-url",
+        help="URL of an OpenAI compatible API, like a local model server (default: $OPENAI_BASE_URL or the OpenAI "
+        "API).",
+    )
+    parser.add_argument(
+        "--rpm",
+        type=non_negative_int,
+        default=os.environ.get(ENV_RPM, "0"),
+        help="Maximum requests sent per minute, shared by every parallel review and every hook process using the "
+        f"same cache directory (default: ${ENV_RPM} or no limit).",
+    )
+    parser.add_argument(
+        "--tpm",
+        type=non_negative_int,
+        default=os.environ.get(ENV_TPM, "0"),
+        help=f"Maximum estimated input tokens sent per minute (default: ${ENV_TPM} or no limit).",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=non_negative_int,
+        default=DEFAULT_MAX_RETRIES,
+        help="Maximum retries of a request failing with a rate limit, server or connection error "
+        f"(default: {DEFAULT_MAX_RETRIES}).",
+    )
+    parser.add_argument(
+        "--retry-deadline",
+        type=float,
+        default=DEFAULT_RETRY_DEADLINE,
+        help=f"Maximum seconds spent retrying a request (default: {DEFAULT_RETRY_DEADLINE:g}).",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream the responses, so that cancelled requests stop generating tokens right away.",
+    )
+
+
+def build_consumer(
+    args: argparse.Namespace,
+    stats: RunStats | None = None,
+    cancel_event: threading.Event | None = None,
+) -> OpenAIConsumer:
+    """Builds the OpenAI consumer configured by `add_consumer_arguments`."""
+    return OpenAIConsumer(
+        base_url=args.base_url,
+        stats=stats,
+        rate_limiter=RateLimiter(args.rpm, args.tpm, cache_path(args, STATE_FILE)) if args.rpm or args.tpm else None,
+        max_retries=args.max_retries,
+        retry_deadline=args.retry_deadline,
+        stream=args.stream,
+        cancel_event=cancel_event,
+    )
+
+
+def cache_path(args: argparse.Namespace, name: str) -> Path:
+    """Gets the path of a file in the cache directory, shared by every process of the user."""
+    return (Path(args.cache_dir) if args.cache_dir else default_cache_dir()) / name
 
 
-def main() -> int:
+def daemon_socket(args: argparse.Namespace) -> Path:
+    """Gets the socket of the review daemon: --socket, $AI_REVIEW_SOCKET, or a socket in the cache directory."""
+    return Path(args.socket or os.environ.get(ENV_SOCKET) or cache_path(args, SOCKET_FILE))
+
+
+def print_file_list(title: str, file_names: list[str]) -> None:
+    """Prints a titled list of files, if there are any."""
+    if file_names:
+        print(f"{title}:")
+        for file_name in file_names:
+            print(f"  {file_name}")
+
+
+def main(argv: list[str] | None = None) -> int:
     """Gets the changes added to a git repository and sends it to the OpenAI API for processing.
+    `ai-review serve` starts the review daemon, `ai-review watch` reviews staged changes ahead of time,
+    and `ai-review stats` lists the slowest and most expensive paths of the review history.
+    Args:
+        argv: The command-line arguments (default: sys.argv).
     Returns:
         int: 0 if successful, 1 if failed.
     """
+    argv = sys.argv[1:] if argv is None else argv
+    # Subcommands are only read from the first argument, so that the files after `--` are never taken for one
+    if argv[:1] == ["serve"]:
+        from hooks.serve import serve
+
+        return serve(argv[1:])
+    if argv[:1] == ["watch"]:
+        from hooks.watch import watch
+
+        return watch(argv[1:])
+    if argv[:1] == ["stats"]:
+        from hooks.stats import show_stats
+
+        return show_stats(argv[1:])
+
     exit_code = EXIT_CODE_SUCCESS
-    feedback_types = [FeedbackType.REVIEW]
     ignore_fail = False
 
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Process git diffs and send them to OpenAI API for feedback.")
-    parser.add_argument("--format", action="store_true", help="Enable format feedback.")
-    parser.add_argument("--security", action="store_true", help="Enable security feedback.")
+    add_review_arguments(parser)
     parser.add_argument("--no-fail", action="store_true", help="Gets the feedback but does not fail the hook.")
-    args = parser.parse_args()
+    parser.add_argument(
+        "filenames",
+        nargs="*",
+        help="Only review the changes of these files, like the shard of the staged files pre-commit passes to each "
+        "of its parallel processes (default: every changed file).",
+    )
+    add_consumer_arguments(parser)
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="Cancel the outstanding requests once a file gets feedback, since the commit fails anyway.",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print the latency, token usage and estimated cost of the review, by feedback type and file.",
+    )
+    parser.add_argument("--stats-json", metavar="PATH", help="Write the stats of every call to this JSON file.")
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Review in this process even if a review daemon (`ai-review serve`) is running.",
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help=f"Socket of the review daemon (default: ${ENV_SOCKET} or a socket in the cache directory).",
+    )
+    parser.add_argument(
+        "--from-ref",
+        default=os.environ.get(ENV_FROM_REF),
+        metavar="REF",
+        help="Review the changes of the commits after this ref, like the target branch of a merge request, "
+        f"instead of the staged changes (default: ${ENV_FROM_REF}).",
+    )
+    parser.add_argument(
+        "--to-ref",
+        default=os.environ.get(ENV_TO_REF) or "HEAD",
+        metavar="REF",
+        help=f"With --from-ref, the last commit of the reviewed range (default: ${ENV_TO_REF} or HEAD).",
+    )
+    parser.add_argument(
+        "--per-commit",
+        action="store_true",
+        help="With --from-ref, review every commit of the range on its own instead of their combined changes, "
+        "skipping the changes already made by an earlier commit.",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=positive_float,
+        metavar="SECONDS",
+        help="Stop the review after this many seconds, cancelling the requests in progress, and report the files "
+        "reviewed so far. Every request times out when the deadline is reached.",
+    )
+    parser.add_argument(
+        "--on-timeout",
+        choices=[ON_TIMEOUT_FAIL, ON_TIMEOUT_PASS],
+        default=ON_TIMEOUT_FAIL,
+        help="Whether the hook fails or passes when the deadline is reached before every file is reviewed, "
+        "unless it got feedback anyway (default: fail). --no-fail always passes.",
+    )
+    parser.add_argument(
+        "--triage",
+        action="store_true",
+        help="Only request the SECURITY and FORMAT passes of the files that need them, as decided by a local check "
+        "of their changed lines for security relevant code and formatting issues. REVIEW is always requested.",
+    )
+    parser.add_argument(
+        "--cluster",
+        action="store_true",
+        help="Review a single file of every group of files with the same change once whitespace is normalized, "
+        "like the files of a mechanical refactor, and report its feedback for all of them.",
+    )
+    parser.add_argument(
+        "--cluster-identifiers",
+        action="store_true",
+        help="Like --cluster, but also group the changes that only differ by the names of their identifiers.",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Submit every request as a single Batch API job and wait for its results, for bulk reviews where cost "
+        "and rate limits matter more than latency. An interrupted run resumes the same batch when re-run on the "
+        "same changes.",
+    )
+    parser.add_argument(
+        "--batch-poll-interval",
+        type=positive_float,
+        default=DEFAULT_POLL_INTERVAL,
+        metavar="SECONDS",
+        help=f"With --batch, seconds between two checks of the batch status (default: {DEFAULT_POLL_INTERVAL:g}).",
+    )
+    parser.add_argument(
+        "--no-history",
+        action="store_true",
+        help="Do not record the latency and cost of the calls in the review history of the cache directory. "
+        "--no-cache disables it too.",
+    )
+    parser.add_argument(
+        "--longest-first",
+        action="store_true",
+        help="Read every file before sending any request, and start the requests the review history predicts to "
+        "take longest first, so that a slow file does not start last.",
+    )
+    parser.add_argument(
+        "--max-input-tokens",
+        type=positive_int,
+        metavar="TOKENS",
+        help="Only review the files that fit in this many estimated input tokens, ranked by --priority, and report "
+        "the others as unreviewed (default: no limit).",
+    )
+    parser.add_argument(
+        "--max-cost",
+        type=positive_float,
+        metavar="USD",
+        help="Only review the files that fit in this estimated cost, ranked by --priority, and report the others as "
+        f"unreviewed. Every call is assumed to generate {ESTIMATED_OUTPUT_TOKENS} tokens (default: no limit).",
+    )
+    parser.add_argument(
+        "--priority",
+        type=priority,
+        default=PRIORITY_CRITERIA,
+        metavar="CRITERIA",
+        help="Comma-separated criteria ranking the files when the budget cannot review them all, most important "
+        "first: risky (security relevant paths), source (before tests) and small (smaller diffs) "
+        f"(default: {','.join(PRIORITY_CRITERIA)}).",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the estimated calls, input tokens and cost of the review of every file, without making any "
+        "request.",
+    )
+    args = parse_arguments(parser, argv)
+    if args.per_commit and not args.from_ref:
+        parser.error("--per-commit needs --from-ref")
+    if args.batch and args.deadline is not None:
+        parser.error("--batch cannot be bounded by --deadline")
+    if args.longest_first and (args.no_history or args.no_cache):
+        parser.error("--longest-first needs the review history, disabled by --no-history and --no-cache")
 
     # Determine feedback types based on arguments
-
-    if args.format:
-        feedback_types.append(FeedbackType.FORMAT)
-    if args.security:
-        feedback_types.append(FeedbackType.SECURITY)
+    feedback_types = get_feedback_types(args)
 
     # if no fail is set, always return success
     if args.no_fail:
         ignore_fail = True
         exit_code = EXIT_CODE_SUCCESS
 
+    # The calls are recorded for the review history unless nothing is kept between runs, but only reported on request
+    record_history = not args.no_history and not args.no_cache
+    stats = RunStats() if args.stats or args.stats_json or record_history else None
+
+    def phase(name: str) -> AbstractContextManager[None]:
+        return stats.phase(name) if stats is not None else nullcontext()
+
+    output = ExitStack()
+    if args.filenames:
+        # Several hooks may review their own shard of the files at once: print the output of each one in one piece
+        output.enter_context(serialized_output(cache_path(args, OUTPUT_LOCK_FILE)))
+    cancel_event = threading.Event()
+    deadline = deadline_timer = None
+    if args.deadline is not None:
+        # Cancel the review once the deadline is reached, and make the calls in progress time out by then
+        deadline = time.monotonic() + args.deadline
+        deadline_timer = threading.Timer(args.deadline, cancel_event.set)
+        deadline_timer.daemon = True
+        deadline_timer.start()
     try:
-        consumer = OpenAIConsumer()
-        # Get the changes that have been staged but not yet committed
-        result = subprocess.run(
-            ["git", "diff", "--staged"],
-            capture_output=True,
-            text=True,
-        )
-        if result.returncode != 0:
-            print(f"Error running git diff: {result.stderr}")
-            exit_code = EXIT_CODE_FAIL
-            return exit_code
-        # Get the diff output
-        diff = result.stdout
-        if not diff:
-            print("No changes to commit.")
-            return EXIT_CODE_SUCCESS
-        # Get the diff separated by each file
-        diff_files = diff.split("diff --git")
-
-        for file in diff_files:
-            if not file:
-                continue
-            file_lines = file.split("\n")
-            # Get the file name
-            try:
-                file_name = file_lines[0].split(" ")[2].replace("b/", "", 1)
-            except IndexError:
-                file_name = "unknown_file"
-            file_content = "\n".join(file_line for file_line in file_lines if not re.match(DIFF_PATTERN, file_line))
-
-            # Send the diff to OpenAI API for processing
-            feedback_result = AIConsumerFeedbackResponse(consumer=consumer).get_all_feedback(
-                input=file_content,
-                feedback_types=feedback_types,
+        consumer = build_consumer(args, stats, cancel_event)
+        consumer.deadline = deadline
+        commit_reader = None
+        # The optional stages are imported here, as most commits need none of them
+        clusters = triage = None
+        if args.cluster or args.cluster_identifiers:
+            from utils.clustering import ChangeClusters
+
+            clusters = ChangeClusters(args.cluster_identifiers)
+        if args.triage:
+            from utils.triage import Triage
+
+            triage = Triage(feedback_types)
+        files: Iterator[tuple[str, list[str]]]
+        if args.per_commit:
+            from utils.commit_range import CommitRangeReader
+
+            # Read the commits in parallel, without the changes an earlier commit of the range already made
+            commit_reader = CommitRangeReader(
+                args.from_ref,
+                args.to_ref,
+                max_workers=args.concurrency,
+                whitespace_check=not args.review_whitespace_only,
+            )
+            commits = commit_reader.read()
+            first_commit = next(commits, None)
+            if first_commit is None:
+                print(f"No commits to review in {args.from_ref}..{args.to_ref}.")
+                return EXIT_CODE_SUCCESS
+            skip_rules = build_skip_rules(args, numstat=None)
+            files = commit_files(args, itertools.chain([first_commit], commits), skip_rules, stats, clusters, triage)
+        else:
+            numstat: Callable[..., dict[str, tuple[int | None, int | None]]]
+            if args.from_ref:
+                diff_files = range_diff(args.from_ref, args.to_ref, stats, args.filenames)
+                numstat = functools.partial(range_numstat, args.from_ref, args.to_ref, paths=args.filenames)
+            else:
+                # Get the changes that have been staged but not yet committed, parsed while git writes them
+                diff_files = staged_diff(stats, args.filenames)
+                numstat = functools.partial(staged_numstat, paths=args.filenames)
+            first_file = next(diff_files, None)
+            if first_file is None:
+                print("No changes to commit." if not args.from_ref else "No changes to review in the range.")
+                return EXIT_CODE_SUCCESS
+            # Drop lockfiles, binaries, deletions, renames and the like before making any request
+            skip_rules = build_skip_rules(args, numstat)
+            revision = args.to_ref if args.from_ref else ""
+            diff_files = skip_rules.filter(itertools.chain([first_file], diff_files))
+            if clusters is not None:
+                diff_files = clusters.filter(diff_files)
+            files = review_files(args, diff_files, stats, revision, triage=triage)
+        if clusters is not None:
+            # Every cluster must be complete before the feedback of its first file is reported
+            files = iter(list(files))
+        cache = None if args.no_cache else ReviewCache(args.cache_dir)
+        file_feedback_types = triage.file_feedback_types if triage is not None else None
+        governor = None
+        if args.dry_run or args.max_input_tokens or args.max_cost:
+            # Every file must be estimated before the ones that fit in the budget are known
+            governor = BudgetGovernor(
+                build_feedback_response(args, consumer, cache),
+                max_input_tokens=args.max_input_tokens or 0,
+                max_cost=args.max_cost or 0.0,
+                priority=args.priority,
+                combined=args.combined,
+            )
+            files = iter(governor.select(files, feedback_types, file_feedback_types))
+            if args.dry_run:
+                print(governor.report())
+                budget_summary = governor.summary()
+                if budget_summary:
+                    print(budget_summary)
+                    print_file_list("Over budget", governor.unreviewed)
+                return EXIT_CODE_SUCCESS
+        # Failing fast makes no sense when the hook never fails
+        fail_fast = args.fail_fast and not ignore_fail
+        # Hand the review over to the daemon when one is running. Stats and deadlines only apply in this process
+        in_process = args.no_daemon or args.stats or args.stats_json or args.deadline is not None or args.batch
+        connection = None if in_process else connect(daemon_socket(args))
+        history = None
+        reviewer: ReviewDispatcher | DaemonReviewer | BatchReviewer
+        if args.batch:
+            # Submit every request at once, then print the feedback like a synchronous review
+            reviewer = BatchReviewer(
+                build_feedback_response(args, consumer, cache),
+                consumer,
+                args.cache_dir,
+                max_workers=args.concurrency,
+                combined=args.combined,
+                pack_tokens=args.pack_tokens,
+                poll_interval=args.batch_poll_interval,
+            )
+        elif connection is not None:
+            reviewer = DaemonReviewer(
+                connection,
+                max_workers=args.concurrency,
+                combined=args.combined,
+                pack_tokens=args.pack_tokens,
+                fail_fast=fail_fast,
+                cache=cache is not None,
+                router=build_router(args),
+                context=args.context or "",
+            )
+            cache = None
+        else:
+            if record_history:
+                # Imported here, as sqlite3 is only needed once there is something to review
+                from utils.history import ReviewHistory
+
+                history = ReviewHistory(git_toplevel(), args.cache_dir)
+            # Send every (file, feedback type) pair to OpenAI API in parallel, printing in file order,
+            # optionally starting the requests that took longest in the past first
+            reviewer = ReviewDispatcher(
+                build_feedback_response(args, consumer, cache),
+                max_workers=args.concurrency,
+                combined=args.combined,
+                pack_tokens=args.pack_tokens,
+                fail_fast=fail_fast,
+                cancel_event=cancel_event,
+                predict_duration=history.predict if history is not None and args.longest_first else None,
+            )
+        reviewed = []
+        with phase("review"):
+            for file_name, feedback_result in reviewer.review(files, feedback_types, file_feedback_types):
+                members = clusters.members(file_name) if clusters is not None else [file_name]
+                reviewed.extend(members)
+                with phase("output"):
+                    for key, value in feedback_result.items():
+                        # If feedback is found, print it
+                        if len(value) > 0:
+                            print(f"{key} Feedback for: {', '.join(members)}")
+                            for line in value:
+                                print(line)
+                            exit_code = EXIT_CODE_FAIL
+        unreviewed = [
+            member
+            for file_name in reviewer.unreviewed
+            for member in (clusters.members(file_name) if clusters is not None else [file_name])
+        ]
+        if deadline is not None and time.monotonic() >= deadline and unreviewed:
+            print(
+                f"Deadline of {args.deadline:g}s reached: {len(reviewed)} file(s) reviewed, "
+                f"{len(unreviewed)} timed out."
+            )
+            print_file_list("Reviewed", reviewed)
+            print_file_list("Timed out", unreviewed)
+            if args.on_timeout == ON_TIMEOUT_FAIL:
+                exit_code = EXIT_CODE_FAIL
+        elif unreviewed:
+            print(f"Stopped at the first feedback: {len(unreviewed)} file(s) were not reviewed.")
+        budget_summary = governor.summary() if governor is not None else None
+        if governor is not None and budget_summary:
+            print(budget_summary)
+            print_file_list(
+                "Over budget",
+                [
+                    member
+                    for file_name in governor.unreviewed
+                    for member in (clusters.members(file_name) if clusters is not None else [file_name])
+                ],
+            )
+        if commit_reader is not None and commit_reader.duplicates:
+            print(
+                f"Skipped {len(commit_reader.duplicates)} file change(s) already made by an earlier commit "
+                "of the range."
             )
-            for key, value in feedback_result.items():
-                # If feedback is found, print it
-                if len(value) > 0:
-                    print(f"{key} Feedback for: {file_name}")
-                    for line in value:
-                        print(line)
-                    exit_code = EXIT_CODE_FAIL
+        skip_summary = skip_rules.summary(1 if args.combined and len(feedback_types) > 1 else len(feedback_types))
+        if skip_summary:
+            print(skip_summary)
+        triage_summary = triage.summary() if triage is not None else None
+        if triage_summary:
+            print(triage_summary)
+        cluster_summary = clusters.summary() if clusters is not None else None
+        if cluster_summary:
+            print(cluster_summary)
+        batch_summary = reviewer.summary() if isinstance(reviewer, BatchReviewer) else None
+        if batch_summary:
+            print(batch_summary)
+        if cache is not None:
+            cache.prune()
+        if history is not None and stats is not None:
+            history.record(stats.calls)
+        if stats is not None:
+            if cache is not None:
+                stats.cache_hits, stats.cache_misses = cache.hits, cache.misses
+            if triage is not None:
+                stats.triage = triage.to_dict()
+            if args.stats:
+                print(stats.summary())
+            if args.stats_json:
+                stats.write_json(args.stats_json)
 
+    except GitError as e:
+        print(f"Error running git diff: {e}")
+        return EXIT_CODE_FAIL
     except Exception as e:
         print(f"Unexpected error: {e}")
         exit_code = EXIT_CODE_FAIL
+    finally:
+        if deadline_timer is not None:
+            deadline_timer.cancel()
+        output.close()
 
     return exit_code if not ignore_fail else EXIT_CODE_SUCCESS
 
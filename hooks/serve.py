@@ -0,0 +1,69 @@
+import argparse
+import signal
+from types import FrameType
+
+from hooks.main import (
+    EXIT_CODE_FAIL,
+    EXIT_CODE_SUCCESS,
+    add_consumer_arguments,
+    build_consumer,
+    daemon_socket,
+    parse_arguments,
+    positive_int,
+)
+from utils.daemon import ENV_SOCKET, ReviewServer
+from utils.review_cache import ReviewCache
+
+DEFAULT_MEMORY_ENTRIES = 10_000
+
+
+def serve(argv: list[str] | None = None) -> int:
+    """Runs the review daemon until it is interrupted.
+    Args:
+        argv: The command-line arguments of `ai-review serve`.
+    Returns:
+        int: 0 once stopped, 1 if the daemon could not start.
+    """
+    parser = argparse.ArgumentParser(
+        prog="ai-review serve",
+        description="Keep a warm OpenAI client and feedback cache for the ai-review hooks of this user.",
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help=f"Socket to listen on (default: ${ENV_SOCKET} or a socket in the cache directory).",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Always request fresh feedback from the API.")
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory where feedback is cached between runs (default: $XDG_CACHE_HOME/ai-review).",
+    )
+    parser.add_argument(
+        "--memory-cache-entries",
+        type=positive_int,
+        default=DEFAULT_MEMORY_ENTRIES,
+        help=f"Cached feedback entries also kept in memory (default: {DEFAULT_MEMORY_ENTRIES}).",
+    )
+    add_consumer_arguments(parser)
+    args = parse_arguments(parser, argv)
+
+    cache = None if args.no_cache else ReviewCache(args.cache_dir, memory_entries=args.memory_cache_entries)
+    socket_path = daemon_socket(args)
+    try:
+        server = ReviewServer(socket_path, build_consumer(args), cache)
+    except (OSError, RuntimeError) as e:
+        print(f"Unable to start the review daemon: {e}")
+        return EXIT_CODE_FAIL
+
+    def stop(signum: int, frame: FrameType | None) -> None:
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    print(f"Review daemon listening on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return EXIT_CODE_SUCCESS
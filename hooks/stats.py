@@ -0,0 +1,57 @@
+import argparse
+from typing import Any
+
+from hooks.main import EXIT_CODE_FAIL, EXIT_CODE_SUCCESS, parse_arguments, positive_int
+from utils.git import GitError, git_toplevel
+from utils.history import ReviewHistory
+
+DEFAULT_LIMIT = 10
+
+
+def print_paths(title: str, paths: list[dict[str, Any]]) -> None:
+    """Prints the calls, latency, tokens and cost of every path of the review history."""
+    print(f"{title}:")
+    for path in paths:
+        print(
+            f"  {path['path']}: {path['calls']} call(s), {path['average_latency']:.2f}s average, "
+            f"{path['max_latency']:.2f}s max, {path['input_tokens']:,} input / {path['output_tokens']:,} output "
+            f"tokens, ${path['cost']:.4f}"
+        )
+
+
+def show_stats(argv: list[str] | None = None) -> int:
+    """Lists the slowest and most expensive paths of the review history of the current repository.
+    Args:
+        argv: The command-line arguments of `ai-review stats`.
+    Returns:
+        int: 0 if successful, 1 if the current directory is not in a git repository.
+    """
+    parser = argparse.ArgumentParser(
+        prog="ai-review stats",
+        description="List the paths of this repository that were the slowest and most expensive to review, "
+        "from the latency and cost of the calls the hook recorded.",
+    )
+    parser.add_argument(
+        "--limit",
+        type=positive_int,
+        default=DEFAULT_LIMIT,
+        help=f"Number of paths listed in each table (default: {DEFAULT_LIMIT}).",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory of the review history (default: $XDG_CACHE_HOME/ai-review).",
+    )
+    args = parse_arguments(parser, argv)
+
+    try:
+        history = ReviewHistory(git_toplevel(), args.cache_dir)
+    except GitError as e:
+        print(f"Not in a git repository: {e}")
+        return EXIT_CODE_FAIL
+    slowest = history.paths("latency", args.limit)
+    if not slowest:
+        print(f"No review history for {history.repo}.")
+        return EXIT_CODE_SUCCESS
+    print_paths("Slowest paths", slowest)
+    print_paths("Most expensive paths", history.paths("cost", args.limit))
+    return EXIT_CODE_SUCCESS
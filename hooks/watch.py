@@ -0,0 +1,116 @@
+import argparse
+import threading
+import time
+
+from hooks.main import (
+    EXIT_CODE_FAIL,
+    EXIT_CODE_SUCCESS,
+    add_consumer_arguments,
+    add_review_arguments,
+    build_consumer,
+    build_feedback_response,
+    build_skip_rules,
+    get_feedback_types,
+    parse_arguments,
+    review_files,
+)
+from utils.git import GitError, git_path, staged_diff
+from utils.review_cache import ReviewCache
+from utils.watch import DEFAULT_DEBOUNCE, DEFAULT_POLL_INTERVAL, IndexWatcher, SpeculativeReviewer
+
+
+def staged_files(args: argparse.Namespace) -> list[tuple[str, list[str]]]:
+    """Gets the staged files the hook would review, split in chunks like the hook does."""
+    skip_rules = build_skip_rules(args)
+    return list(review_files(args, skip_rules.filter(staged_diff())))
+
+
+def review_round(args: argparse.Namespace, reviewer: SpeculativeReviewer, cancel_event: threading.Event) -> None:
+    """Reviews the staged files once, then drops the feedback of the diffs changed in the meantime."""
+    start = time.perf_counter()
+    try:
+        files = staged_files(args)
+        if not files:
+            return
+        reviewed, with_feedback = reviewer.review(files, cancel_event)
+        reviewed_names = set(reviewed)
+        reviewed_files = [(file_name, chunks) for file_name, chunks in files if file_name in reviewed_names]
+        discarded = reviewer.discard_stale(reviewed_files, staged_files(args))
+    except GitError as e:
+        print(f"Error running git diff: {e}")
+        return
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        return
+    print(
+        f"Reviewed {len(reviewed) - len(discarded)} staged file(s) ahead of the commit in "
+        f"{time.perf_counter() - start:.2f}s, {len(set(with_feedback) - set(discarded))} with feedback."
+    )
+    if discarded:
+        print(f"Discarded the feedback of {len(discarded)} file(s) changed during the review.")
+
+
+def watch(argv: list[str] | None = None) -> int:
+    """Reviews the staged changes in the background whenever the git index changes, until interrupted.
+    Args:
+        argv: The command-line arguments of `ai-review watch`.
+    Returns:
+        int: 0 once stopped, 1 if the current directory is not in a git repository.
+    """
+    parser = argparse.ArgumentParser(
+        prog="ai-review watch",
+        description="Review staged changes as soon as they are staged, so that the commit hook finds their "
+        "feedback in the cache. Use the same review options as the hook.",
+    )
+    add_review_arguments(parser)
+    add_consumer_arguments(parser)
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=DEFAULT_DEBOUNCE,
+        help=f"Seconds the index must stay unchanged before a review starts (default: {DEFAULT_DEBOUNCE:g}).",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=DEFAULT_POLL_INTERVAL,
+        help=f"Seconds between two checks of the index (default: {DEFAULT_POLL_INTERVAL:g}).",
+    )
+    args = parse_arguments(parser, argv)
+    if args.no_cache:
+        parser.error("ai-review watch needs the cache to share its feedback with the hook")
+
+    try:
+        watcher = IndexWatcher(git_path("index"), args.debounce)
+    except GitError as e:
+        print(f"Error running git: {e}")
+        return EXIT_CODE_FAIL
+    consumer = build_consumer(args)
+    reviewer = SpeculativeReviewer(
+        build_feedback_response(args, consumer, ReviewCache(args.cache_dir)),
+        get_feedback_types(args),
+        max_workers=args.concurrency,
+        combined=args.combined,
+        pack_tokens=args.pack_tokens,
+    )
+    print(f"Watching {watcher.index_path} for staged changes.")
+    review_thread: threading.Thread | None = None
+    cancel_event = threading.Event()
+    ready = False
+    try:
+        while True:
+            ready = watcher.poll() or ready
+            running = review_thread is not None and review_thread.is_alive()
+            if running and watcher.pending:
+                # The index changed under the review, whose remaining results would be stale
+                cancel_event.set()
+            elif ready and not running:
+                ready = False
+                cancel_event = threading.Event()
+                consumer.cancel_event = cancel_event
+                review_thread = threading.Thread(target=review_round, args=(args, reviewer, cancel_event), daemon=True)
+                review_thread.start()
+            time.sleep(args.poll_interval)
+    except KeyboardInterrupt:
+        cancel_event.set()
+    return EXIT_CODE_SUCCESS
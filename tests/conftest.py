@@ -0,0 +1,13 @@
+import subprocess
+
+import pytest
+
+
+@pytest.fixture
+def git_repository(tmp_path, monkeypatch):
+    """An empty git repository with a committer identity, as the working directory."""
+    monkeypatch.chdir(tmp_path)
+    subprocess.run(["git", "init", "-q", "-b", "main"], check=True)
+    subprocess.run(["git", "config", "user.email", "test@example.com"], check=True)
+    subprocess.run(["git", "config", "user.name", "Test"], check=True)
+    return tmp_path
@@ -2,10 +2,16 @@ import pytest
 
 from utils.ai_feedback_filter import AIConsumerFeedbackResponse, FeedbackType
 from utils.protocols import AIConsumerProtocol
+from utils.review_cache import ReviewCache
+from utils.routing import ModelRouter, Route
 
 
 class MockAIConsumer(AIConsumerProtocol):
+    def __init__(self):
+        self.calls = 0
+
     def generate_text(self, instructions: str, input: str, model: str) -> str:
+        self.calls += 1
         if AIConsumerFeedbackResponse.TYPES_OF_FEEDBACK[FeedbackType.REVIEW] in instructions:
             return "Feedback 1\nFeedback 2\nOK"
         elif AIConsumerFeedbackResponse.TYPES_OF_FEEDBACK[FeedbackType.SECURITY] in instructions:
@@ -15,6 +21,18 @@ class MockAIConsumer(AIConsumerProtocol):
         return "OK"
 
 
+class CombinedMockAIConsumer(AIConsumerProtocol):
+    def __init__(self, combined_response: str):
+        self.combined_response = combined_response
+        self.instructions: list[str] = []
+
+    def generate_text(self, instructions: str, input: str, model: str) -> str:
+        self.instructions.append(instructions)
+        if "Review this code once for each" in instructions:
+            return self.combined_response
+        return MockAIConsumer().generate_text(instructions, input, model)
+
+
 @pytest.fixture
 def ai_consumer_feedback_response():
     mock_consumer = MockAIConsumer()
@@ -122,3 +140,224 @@ def test_generate_instructions_invalid_feedback_type(ai_consumer_feedback_respon
     """
     with pytest.raises(ValueError, match="Invalid feedback type"):
         ai_consumer_feedback_response._generate_instructions("INVALID_TYPE")
+
+
+def test_get_feedback_uses_cache(tmp_path):
+    """
+    Test that the `get_feedback` method only calls the AI consumer once for the same request,
+    and that a different model is not served from the cache.
+    """
+    mock_consumer = MockAIConsumer()
+    feedback_response = AIConsumerFeedbackResponse(consumer=mock_consumer, cache=ReviewCache(tmp_path))
+
+    first = feedback_response.get_feedback("sample input", FeedbackType.REVIEW)
+    second = feedback_response.get_feedback("sample input\n", FeedbackType.REVIEW)
+    feedback_response.get_feedback("sample input", FeedbackType.REVIEW, model="gpt-4o")
+
+    assert first == second == ["Feedback 1", "Feedback 2"]
+    assert mock_consumer.calls == 2
+
+
+def test_get_combined_feedback():
+    """
+    Test that the `get_combined_feedback` method sends a single request and splits its sections.
+    """
+    mock_consumer = CombinedMockAIConsumer(
+        "### REVIEW\nFeedback 1\n\n### SECURITY\nOK\n### FORMAT\n- Format Feedback 1"
+    )
+    feedback_response = AIConsumerFeedbackResponse(consumer=mock_consumer)
+
+    feedback = feedback_response.get_all_feedback("sample input", feedback_types=list(FeedbackType), combined=True)
+
+    assert feedback == {"review": ["Feedback 1"], "security": [], "format": ["- Format Feedback 1"]}
+    assert len(mock_consumer.instructions) == 1
+
+
+def test_get_combined_feedback_falls_back_for_missing_sections():
+    """
+    Test that a section missing from the combined response is requested on its own.
+    """
+    mock_consumer = CombinedMockAIConsumer("Here is my review:\n**REVIEW**\nFeedback 3")
+    feedback_response = AIConsumerFeedbackResponse(consumer=mock_consumer)
+
+    feedback = feedback_response.get_combined_feedback(
+        "sample input", feedback_types=[FeedbackType.SECURITY, FeedbackType.REVIEW]
+    )
+
+    assert feedback == {"review": ["Feedback 3"], "security": ["Security Feedback 1"], "format": []}
+    assert len(mock_consumer.instructions) == 2
+    assert mock_consumer.instructions[1] == feedback_response._generate_instructions(FeedbackType.SECURITY)
+
+
+def test_get_combined_feedback_uses_cache(tmp_path):
+    """
+    Test that cached sections are not requested again by the combined request.
+    """
+    cache = ReviewCache(tmp_path)
+    mock_consumer = CombinedMockAIConsumer("### REVIEW\nFeedback 1\n### SECURITY\nSecurity Feedback 2")
+    feedback_response = AIConsumerFeedbackResponse(consumer=mock_consumer, cache=cache)
+    feedback_response.get_combined_feedback("sample input", [FeedbackType.REVIEW, FeedbackType.SECURITY])
+
+    feedback = feedback_response.get_combined_feedback("sample input", list(FeedbackType))
+
+    assert feedback == {
+        "review": ["Feedback 1"],
+        "security": ["Security Feedback 2"],
+        "format": ["Format Feedback 1", "Format Feedback 2"],
+    }
+    assert len(mock_consumer.instructions) == 2
+
+
+def test_combined_feedback_is_cached_apart(tmp_path):
+    """
+    Test that the sections of a combined response are not answered to requests of a single feedback type,
+    whose instructions were never sent.
+    """
+    cache = ReviewCache(tmp_path)
+    mock_consumer = CombinedMockAIConsumer("### REVIEW\nCombined Feedback\n### SECURITY\nOK")
+    feedback_response = AIConsumerFeedbackResponse(consumer=mock_consumer, cache=cache)
+    feedback_response.get_combined_feedback("sample input", [FeedbackType.REVIEW, FeedbackType.SECURITY])
+
+    assert feedback_response.get_review_feedback("sample input") == ["Feedback 1", "Feedback 2"]
+    assert feedback_response.get_combined_feedback("sample input", [FeedbackType.REVIEW, FeedbackType.SECURITY]) == {
+        "review": ["Combined Feedback"],
+        "security": [],
+        "format": [],
+    }
+    assert len(mock_consumer.instructions) == 2
+
+
+class PackedMockAIConsumer(AIConsumerProtocol):
+    def __init__(self, packed_response: str):
+        self.packed_response = packed_response
+        self.inputs: list[str] = []
+
+    def generate_text(self, instructions: str, input: str, model: str) -> str:
+        self.inputs.append(input)
+        if "several files" in instructions:
+            return self.packed_response
+        return f"Feedback for {input}"
+
+
+def test_get_packed_feedback():
+    """
+    Test that the `get_packed_feedback` method sends a single request with every file delimited,
+    and attributes each section of the response to its file.
+    """
+    mock_consumer = PackedMockAIConsumer("===== FILE 0: a.py =====\nOK\n===== FILE 1: b.py =====\nFeedback 1")
+    feedback_response = AIConsumerFeedbackResponse(consumer=mock_consumer)
+
+    feedback = feedback_response.get_packed_feedback([("a.py", "+a"), ("b.py", "+b")], FeedbackType.REVIEW)
+
+    assert feedback == [[], ["Feedback 1"]]
+    assert mock_consumer.inputs == ["===== FILE 0: a.py =====\n+a\n===== FILE 1: b.py =====\n+b"]
+
+
+def test_get_packed_feedback_falls_back_for_missing_files(tmp_path):
+    """
+    Test that files missing from the packed response are requested on their own, and that
+    cached files are not requested again.
+    """
+    mock_consumer = PackedMockAIConsumer("FILE 1: b.py =====\nFeedback 1")
+    feedback_response = AIConsumerFeedbackResponse(consumer=mock_consumer, cache=ReviewCache(tmp_path))
+    feedback_response.get_feedback("+a", FeedbackType.REVIEW)
+
+    feedback = feedback_response.get_packed_feedback(
+        [("a.py", "+a"), ("b.py", "+b"), ("c.py", "+c")], FeedbackType.REVIEW
+    )
+
+    assert feedback == [["Feedback for +a"], ["Feedback 1"], ["Feedback for +c"]]
+    assert mock_consumer.inputs[1:] == ["===== FILE 1: b.py =====\n+b\n===== FILE 2: c.py =====\n+c", "+c"]
+
+
+def test_bare_ok_answers_every_section():
+    """
+    Test that a bare OK answer to a combined or packed request is not requested again.
+    """
+    mock_consumer = CombinedMockAIConsumer("OK")
+    feedback_response = AIConsumerFeedbackResponse(consumer=mock_consumer)
+
+    combined = feedback_response.get_combined_feedback("sample input", [FeedbackType.REVIEW, FeedbackType.FORMAT])
+    packed_consumer = PackedMockAIConsumer("OK\n")
+    packed = AIConsumerFeedbackResponse(consumer=packed_consumer).get_packed_feedback(
+        [("a.py", "+a"), ("b.py", "+b")], FeedbackType.REVIEW
+    )
+
+    assert combined == {"review": [], "security": [], "format": []}
+    assert packed == [[], []]
+    assert len(mock_consumer.instructions) == 1
+    assert len(packed_consumer.inputs) == 1
+
+
+class ModelRecordingAIConsumer(AIConsumerProtocol):
+    def __init__(self):
+        self.models: list[str] = []
+
+    def generate_text(self, instructions: str, input: str, model: str) -> str:
+        self.models.append(model)
+        return "OK"
+
+
+def test_router_chooses_the_model(tmp_path):
+    """
+    Test that requests made without a model use the model of their route, which is part of the cache key.
+    """
+    mock_consumer = ModelRecordingAIConsumer()
+    router = ModelRouter([Route.parse("model=large,types=SECURITY")], default_model="small")
+    feedback_response = AIConsumerFeedbackResponse(consumer=mock_consumer, cache=ReviewCache(tmp_path), router=router)
+
+    feedback_response.get_all_feedback("+x", feedback_types=[FeedbackType.REVIEW, FeedbackType.SECURITY])
+
+    assert mock_consumer.models == ["small", "large"]
+    assert feedback_response.cache_key("+x", FeedbackType.SECURITY) == feedback_response.cache_key(
+        "+x", FeedbackType.SECURITY, "large"
+    )
+
+
+def test_combined_feedback_splits_by_model():
+    """
+    Test that combined requests send the feedback types routed to different models with one call per model.
+    """
+    mock_consumer = CombinedMockAIConsumer("### REVIEW\nOK\n### FORMAT\nOK")
+    router = ModelRouter([Route.parse("model=large,types=SECURITY")], default_model="small")
+    feedback_response = AIConsumerFeedbackResponse(consumer=mock_consumer, router=router)
+
+    feedback = feedback_response.get_combined_feedback("+x", list(FeedbackType))
+
+    assert feedback == {"review": [], "security": ["Security Feedback 1"], "format": []}
+    assert len(mock_consumer.instructions) == 2
+
+
+def test_packed_feedback_splits_by_model():
+    """
+    Test that packed requests send the files routed to different models with one call per model.
+    """
+    mock_consumer = PackedMockAIConsumer("OK")
+    router = ModelRouter([Route.parse("model=docs,files=*.md")], default_model="small")
+    feedback_response = AIConsumerFeedbackResponse(consumer=mock_consumer, router=router)
+    files = [(path, f"diff --git a/{path} b/{path}\n+x") for path in ("a.py", "b.md", "c.py")]
+
+    feedback = feedback_response.get_packed_feedback(files, FeedbackType.REVIEW)
+
+    assert feedback == [[], ["Feedback for diff --git a/b.md b/b.md", "+x"], []]
+    assert len(mock_consumer.inputs) == 2
+
+
+def test_instructions_share_a_stable_prefix():
+    """
+    Test that the instructions of every kind of request start with the same prefix, holding the repository
+    context, and that it does not change between runs.
+    """
+    feedback_response = AIConsumerFeedbackResponse(consumer=MockAIConsumer(), context="Use 4 spaces.\n")
+    instructions = [
+        feedback_response._generate_instructions(FeedbackType.REVIEW),
+        feedback_response._generate_instructions(FeedbackType.SECURITY),
+        feedback_response._generate_combined_instructions([FeedbackType.REVIEW, FeedbackType.FORMAT]),
+        feedback_response._generate_packed_instructions(FeedbackType.FORMAT),
+    ]
+
+    assert feedback_response.prefix.endswith("Use 4 spaces.\n\n")
+    assert all(text.startswith(feedback_response.prefix) for text in instructions)
+    assert AIConsumerFeedbackResponse(consumer=MockAIConsumer(), context="Use 4 spaces.").prefix == (
+        feedback_response.prefix
+    )
@@ -0,0 +1,156 @@
+import json
+
+import pytest
+
+from benchmarks.fakes import FakeBackend, FakeResponsesServer
+from utils.ai_feedback_filter import AIConsumerFeedbackResponse, FeedbackType
+from utils.batch import BATCH_DIR, BatchConsumer, BatchError, BatchReviewer, request_id
+from utils.openai_consumer import OpenAIConsumer
+from utils.review_cache import ReviewCache
+from utils.stats import RunStats
+
+FILES = [("app.py", "+import os"), ("lib.py", "+x = 1")]
+
+
+@pytest.fixture
+def server():
+    with FakeResponsesServer(FakeBackend(response_lines=1, line_length=12), batch_polls=2) as server:
+        yield server
+
+
+def batch_reviewer(server: FakeResponsesServer, tmp_path, cache: ReviewCache | None = None, **kwargs) -> BatchReviewer:
+    consumer = OpenAIConsumer(base_url=server.base_url, api_key="test", stats=RunStats())
+    return BatchReviewer(
+        AIConsumerFeedbackResponse(consumer=consumer, cache=cache), consumer, tmp_path, poll_interval=0.01, **kwargs
+    )
+
+
+def test_review_with_a_batch(server, tmp_path):
+    """
+    Test that every request is submitted in a single batch, and its results mapped back to every file.
+    """
+    reviewer = batch_reviewer(server, tmp_path)
+
+    results = list(reviewer.review(FILES, [FeedbackType.REVIEW, FeedbackType.SECURITY]))
+
+    assert results == [
+        ("app.py", {"review": ["1. Consider ren"], "security": ["1. Consider ren"], "format": []}),
+        ("lib.py", {"review": ["1. Consider ren"], "security": ["1. Consider ren"], "format": []}),
+    ]
+    [batch] = server.batches.values()
+    assert batch["endpoint"] == "/v1/responses"
+    assert batch["request_counts"]["completed"] == 4
+    assert len(server.requests) == 4
+    assert reviewer.summary() == f"Batch {batch['id']} completed: 4 request(s) answered."
+    assert reviewer.unreviewed == []
+    assert [call.file for call in reviewer.consumer.stats.calls] == ["app.py", "app.py", "lib.py", "lib.py"]
+    # The batch is over, so there is nothing left to resume
+    assert list((tmp_path / BATCH_DIR).iterdir()) == []
+
+
+def test_interrupted_batch_is_resumed(server, tmp_path, monkeypatch):
+    """
+    Test that a run interrupted while polling leaves the batch state on disk, and the next run reviewing
+    the same changes resumes the same batch instead of submitting another one.
+    """
+
+    def interrupt(seconds: float) -> None:
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr("utils.batch.time.sleep", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        list(batch_reviewer(server, tmp_path).review(FILES, [FeedbackType.REVIEW]))
+    assert len(list((tmp_path / BATCH_DIR).glob("*.json"))) == 1
+    monkeypatch.undo()
+
+    results = list(batch_reviewer(server, tmp_path).review(FILES, [FeedbackType.REVIEW]))
+
+    assert [file_name for file_name, _ in results] == ["app.py", "lib.py"]
+    assert list(server.batches) == ["batch_0"]
+    assert len(server.requests) == 2
+
+
+def test_cached_feedback_is_not_batched(server, tmp_path):
+    """
+    Test that the feedback of a batch is cached, and cached requests are not submitted again.
+    """
+    list(batch_reviewer(server, tmp_path, ReviewCache(tmp_path / "cache")).review(FILES, [FeedbackType.REVIEW]))
+    cache = ReviewCache(tmp_path / "cache")
+    reviewer = batch_reviewer(server, tmp_path, cache)
+
+    results = list(reviewer.review(FILES, [FeedbackType.REVIEW]))
+
+    assert results[0] == ("app.py", {"review": ["1. Consider ren"], "security": [], "format": []})
+    assert len(server.batches) == 1
+    assert reviewer.summary() is None
+    assert (cache.hits, cache.misses) == (2, 0)
+
+
+def test_packed_batch(server, tmp_path):
+    """
+    Test that packed files are submitted as a single request of the batch, and the files missing from its
+    response are requested again on their own, synchronously.
+    """
+    reviewer = batch_reviewer(server, tmp_path, pack_tokens=1_000)
+
+    list(reviewer.review(FILES, [FeedbackType.REVIEW]))
+
+    [batch] = server.batches.values()
+    assert batch["request_counts"]["total"] == 1
+    assert "===== FILE 0: app.py =====" in server.requests[0]["input"]
+    assert reviewer.requested == 2
+    assert reviewer.summary() == f"Batch {batch['id']} completed: 1 request(s) answered, 2 made without the batch."
+
+
+def test_failed_batch(server, tmp_path):
+    """
+    Test that a batch failing as a whole fails the review.
+    """
+    reviewer = batch_reviewer(server, tmp_path)
+    reviewer._submit = lambda content, state_path: {"id": "batch_x", "status": "failed", "errors": None}
+
+    with pytest.raises(BatchError, match="Batch batch_x failed"):
+        list(reviewer.review(FILES, [FeedbackType.REVIEW]))
+
+
+class RecordingConsumer:
+    stats = None
+
+    def __init__(self):
+        self.calls = []
+
+    def generate_text(self, instructions: str, input: str, model: str) -> str:
+        self.calls.append(input)
+        return "Synchronous"
+
+
+def test_batch_consumer_falls_back_to_synchronous_requests():
+    """
+    Test that the requests the batch did not answer, like its failed ones, are made synchronously.
+    """
+    fallback = RecordingConsumer()
+    consumer = BatchConsumer({request_id("instructions", "answered", "model"): ("From the batch", None)}, fallback)
+
+    assert consumer.generate_text("instructions", "answered", "model") == "From the batch"
+    assert consumer.generate_text("instructions", "failed", "model") == "Synchronous"
+    assert fallback.calls == ["failed"]
+    assert (consumer.answered, consumer.requested) == (1, 1)
+
+
+def test_fake_server_error_file(tmp_path):
+    """
+    Test that the failed requests of a batch are written to its error file, and left without a result.
+    """
+    with FakeResponsesServer(FakeBackend(error_rate=1), batch_polls=0) as server:
+        reviewer = batch_reviewer(server, tmp_path)
+        body = {"model": "gpt-4o-mini", "instructions": "instructions", "input": "input"}
+
+        results = reviewer.run({"request": body})
+
+        [batch] = server.batches.values()
+        [error] = server.files[batch["error_file_id"]].decode().splitlines()
+
+    assert results == {}
+    assert batch["output_file_id"] is None
+    assert json.loads(error)["custom_id"] == "request"
+    assert json.loads(error)["response"]["status_code"] == 500
@@ -0,0 +1,87 @@
+import pytest
+
+from benchmarks.diffs import generate_diff
+from benchmarks.fakes import FakeAIConsumer, FakeBackend, FakeResponsesServer
+from benchmarks.run import Scenario, run_scenario
+from benchmarks.startup import measure_startup
+from utils.diff_parser import parse_diff
+from utils.openai_consumer import OpenAIConsumer
+
+
+def test_generate_diff_is_parseable():
+    """
+    Test that the synthetic diff parses into the requested files, hunks and lines.
+    """
+    diff_files = list(parse_diff(generate_diff(files=3, hunks_per_file=2, lines_per_hunk=4)))
+
+    assert len(diff_files) == 3
+    assert diff_files[1].path == "src/package_0/module_1.py"
+    assert [len(hunk.lines) for hunk in diff_files[1].hunks] == [10, 10]
+
+
+def test_fake_consumer():
+    """
+    Test that the fake consumer answers with the configured feedback and counts its calls.
+    """
+    consumer = FakeAIConsumer(FakeBackend(response_lines=2, line_length=10))
+
+    assert consumer.generate_text("instructions", "input", "model") == ("1. Consider r\n2. Consider r")
+    assert consumer.backend.calls == 1
+
+
+def test_fake_consumer_errors():
+    """
+    Test that the fake consumer fails with the configured error rate.
+    """
+    consumer = FakeAIConsumer(FakeBackend(error_rate=1))
+
+    with pytest.raises(RuntimeError, match="fake backend error"):
+        consumer.generate_text("instructions", "input", "model")
+
+
+def test_fake_responses_server():
+    """
+    Test that OpenAIConsumer can be pointed at the fake Responses server.
+    """
+    with FakeResponsesServer(FakeBackend(response_lines=1, line_length=12)) as server:
+        consumer = OpenAIConsumer(base_url=server.base_url, api_key="test")
+
+        text = consumer.generate_text("instructions", "input", "gpt-4o-mini")
+
+    assert text == "1. Consider ren"
+    assert server.requests == [{"model": "gpt-4o-mini", "instructions": "instructions", "input": "input"}]
+
+
+def test_run_scenario(tmp_path, monkeypatch):
+    """
+    Test that a scenario runs the hook end to end and reports its calls, wall time and memory peak.
+    """
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+
+    result = run_scenario(Scenario("test", files=3, response_lines=1, args=("--security",), expected_exit_code=1))
+
+    assert (result.calls, result.errors, result.exit_code, result.problems) == (6, 0, 1, [])
+    assert result.peak_memory_mb is not None
+
+
+def test_fake_responses_server_stream():
+    """
+    Test that the fake Responses server can stream its responses.
+    """
+    with FakeResponsesServer(FakeBackend(response_lines=2, line_length=12)) as server:
+        consumer = OpenAIConsumer(base_url=server.base_url, api_key="test", stream=True)
+
+        text = consumer.generate_text("instructions", "input", "gpt-4o-mini")
+
+    assert text == "1. Consider ren\n2. Consider ren"
+
+
+def test_startup_does_not_import_lazy_modules():
+    """
+    Test that the hook finds there is nothing to review without importing the OpenAI SDK or the optional stages.
+    """
+    # Fails if the hook imports one of them; a single run is too noisy to compare the timings
+    interpreter, hook = measure_startup(runs=1)
+
+    assert interpreter > 0
+    assert hook > 0
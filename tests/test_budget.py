@@ -0,0 +1,190 @@
+import pytest
+
+from utils.ai_feedback_filter import AIConsumerFeedbackResponse, FeedbackType
+from utils.budget import ESTIMATED_OUTPUT_TOKENS, BudgetGovernor, Estimate, parse_priority
+from utils.pricing import estimate_cost
+from utils.review_cache import ReviewCache
+from utils.routing import ModelRouter, Route
+
+FILES = [
+    ("tests/test_app.py", ["+assert app()\n" * 5]),
+    ("app.py", ["+x = 1\n" * 20]),
+    ("auth.py", ["+password = hash(password)\n" * 40]),
+    ("lib.py", ["+y = 2\n"]),
+]
+
+
+class FailingConsumer:
+    def generate_text(self, instructions: str, input: str, model: str) -> str:
+        raise AssertionError("No request should be made")
+
+
+@pytest.fixture
+def feedback_response():
+    return AIConsumerFeedbackResponse(consumer=FailingConsumer())
+
+
+def tokens(governor: BudgetGovernor, *file_names: str) -> int:
+    return sum(governor.estimates[file_name].input_tokens for file_name in file_names)
+
+
+def test_estimate(feedback_response):
+    """
+    Test that every request of a file is estimated without being made: one per chunk and feedback type.
+    """
+    governor = BudgetGovernor(feedback_response)
+
+    estimate = governor.estimate("app.py", ["+x = 1", "+y = 2"], [FeedbackType.REVIEW, FeedbackType.SECURITY])
+
+    assert estimate.calls == 4
+    assert estimate.input_tokens > 4 * 3
+    assert estimate.cost == pytest.approx(
+        estimate_cost("gpt-4o-mini", estimate.input_tokens, 4 * ESTIMATED_OUTPUT_TOKENS)
+    )
+
+
+def test_estimate_combined(feedback_response):
+    """
+    Test that combined requests are estimated as a single call per chunk.
+    """
+    governor = BudgetGovernor(feedback_response, combined=True)
+
+    estimate = governor.estimate("app.py", ["+x = 1"], [FeedbackType.REVIEW, FeedbackType.SECURITY])
+
+    assert estimate.calls == 1
+
+
+def test_estimate_without_cached_requests(tmp_path):
+    """
+    Test that the requests answered from the cache cost nothing, and the estimate caches nothing.
+    """
+    cache = ReviewCache(tmp_path)
+    feedback_response = AIConsumerFeedbackResponse(consumer=FailingConsumer(), cache=cache)
+    cache.set(feedback_response.cache_key("+x = 1", FeedbackType.REVIEW), ["Cached"])
+    governor = BudgetGovernor(feedback_response)
+
+    estimate = governor.estimate("app.py", ["+x = 1"], [FeedbackType.REVIEW, FeedbackType.SECURITY])
+
+    assert estimate.calls == 1
+    assert len(list(tmp_path.glob("*/*.json"))) == 1
+
+
+def test_estimate_of_unpriced_models():
+    """
+    Test that the calls to models of unknown prices are counted, but left out of the cost.
+    """
+    router = ModelRouter([Route("local-model")])
+    governor = BudgetGovernor(AIConsumerFeedbackResponse(consumer=FailingConsumer(), router=router))
+
+    estimate = governor.estimate("app.py", ["+x = 1"], [FeedbackType.REVIEW])
+
+    assert (estimate.calls, estimate.cost, estimate.unpriced) == (1, 0.0, 1)
+    assert estimate.describe().endswith("(without 1 call(s) to models of unknown prices)")
+
+
+def test_select_within_budget(feedback_response):
+    """
+    Test that every file is selected when they all fit in the budget.
+    """
+    governor = BudgetGovernor(feedback_response, max_input_tokens=100_000)
+
+    assert governor.select(FILES, [FeedbackType.REVIEW]) == FILES
+    assert governor.unreviewed == []
+    assert governor.summary() is None
+
+
+def test_select_by_priority(feedback_response):
+    """
+    Test that risky paths are selected first, then source files before tests, smaller ones first, and the
+    files that no longer fit are left unreviewed, in file order.
+    """
+    governor = BudgetGovernor(feedback_response)
+    governor.select(FILES, [FeedbackType.REVIEW])
+    governor.max_input_tokens = tokens(governor, "auth.py", "lib.py") + 1
+
+    selected = governor.select(FILES, [FeedbackType.REVIEW])
+
+    assert [file_name for file_name, _ in selected] == ["auth.py", "lib.py"]
+    assert governor.unreviewed == ["tests/test_app.py", "app.py"]
+    assert governor.summary().startswith(f"Budget of {governor.max_input_tokens:,} input tokens exceeded: 2 file(s)")
+
+
+def test_select_by_size(feedback_response):
+    """
+    Test that the priority decides which files are selected first.
+    """
+    governor = BudgetGovernor(feedback_response, priority=("small",))
+    governor.select(FILES, [FeedbackType.REVIEW])
+    governor.max_input_tokens = tokens(governor, "lib.py", "tests/test_app.py")
+
+    selected = governor.select(FILES, [FeedbackType.REVIEW])
+
+    assert [file_name for file_name, _ in selected] == ["tests/test_app.py", "lib.py"]
+
+
+def test_select_by_cost(feedback_response):
+    """
+    Test that the estimated cost bounds the review too.
+    """
+    governor = BudgetGovernor(feedback_response, max_cost=1e-9)
+
+    assert governor.select(FILES, [FeedbackType.REVIEW]) == []
+    assert governor.selected.calls == 0
+    assert governor.summary().startswith("Budget of $1e-09 exceeded: 0 file(s) selected")
+
+
+def test_select_by_priority_of_commit_files(feedback_response):
+    """
+    Test that the files of a commit range are ranked by their path, without the commit they are labelled with.
+    """
+    files = [(f"0123456789ab:{file_name}", ["+x = 1\n"]) for file_name in ("conftest.py", "app.py", "settings.py")]
+    governor = BudgetGovernor(feedback_response, priority=("risky", "source"))
+    governor.select(files, [FeedbackType.REVIEW])
+    governor.max_input_tokens = tokens(governor, "0123456789ab:app.py", "0123456789ab:settings.py")
+
+    selected = governor.select(files, [FeedbackType.REVIEW])
+
+    assert [file_name for file_name, _ in selected] == ["0123456789ab:app.py", "0123456789ab:settings.py"]
+
+
+def test_estimate_without_threads(feedback_response, monkeypatch):
+    """
+    Test that the requests are recorded in the calling thread, without a pool of workers.
+    """
+    monkeypatch.setattr("threading.Thread.start", lambda thread: pytest.fail("No thread should be started"))
+    governor = BudgetGovernor(feedback_response)
+
+    assert governor.estimate("app.py", ["+x = 1", "+x = 1"], [FeedbackType.REVIEW]).calls == 1
+
+
+def test_select_with_file_feedback_types(feedback_response):
+    """
+    Test that the feedback types of a file, like the ones decided by triage, are the ones estimated.
+    """
+    governor = BudgetGovernor(feedback_response)
+
+    governor.select(FILES[:2], [FeedbackType.REVIEW, FeedbackType.SECURITY], {"app.py": [FeedbackType.REVIEW]})
+
+    assert [estimate.calls for estimate in governor.estimates.values()] == [2, 1]
+    assert governor.total().calls == 3
+    assert governor.report().startswith("Dry run: 2 file(s), 3 call(s)")
+
+
+def test_estimate_sum():
+    """
+    Test that estimates add up.
+    """
+    total = Estimate(1, 10, 0.5) + Estimate(2, 20, 0.25, unpriced=1)
+
+    assert (total.calls, total.input_tokens, total.cost, total.unpriced) == (3, 30, 0.75, 1)
+
+
+def test_parse_priority():
+    """
+    Test that priorities are parsed, and unknown or repeated criteria rejected.
+    """
+    assert parse_priority("small, source") == ("small", "source")
+    with pytest.raises(ValueError, match="Unknown priority criteria: big"):
+        parse_priority("risky,big")
+    with pytest.raises(ValueError, match="Repeated"):
+        parse_priority("small,small")
@@ -0,0 +1,47 @@
+from utils.chunking import chunk_diff_file
+from utils.diff_parser import parse_diff
+
+
+def make_diff_file(hunks: int, lines_per_hunk: int):
+    lines = ["diff --git a/big.py b/big.py", "--- a/big.py", "+++ b/big.py"]
+    for hunk in range(hunks):
+        lines.append(f"@@ -{hunk * 100 + 1},0 +{hunk * 100 + 1},{lines_per_hunk} @@")
+        lines.extend(f"+value_{hunk}_{line} = {line}" for line in range(lines_per_hunk))
+    [diff_file] = parse_diff(lines)
+    return diff_file
+
+
+def test_small_file_is_a_single_chunk():
+    """
+    Test that a file under the limit gets a single chunk equal to its review input.
+    """
+    diff_file = make_diff_file(hunks=2, lines_per_hunk=3)
+
+    assert chunk_diff_file(diff_file, max_tokens=1000) == [diff_file.review_input()]
+    assert chunk_diff_file(diff_file, max_tokens=0) == [diff_file.review_input()]
+
+
+def test_chunks_split_on_hunk_boundaries():
+    """
+    Test that large files are split between hunks, and that every chunk repeats the file headers.
+    """
+    diff_file = make_diff_file(hunks=4, lines_per_hunk=5)
+
+    chunks = chunk_diff_file(diff_file, max_tokens=80)
+
+    assert len(chunks) == 4
+    for hunk, chunk in enumerate(chunks):
+        assert chunk.startswith("diff --git a/big.py b/big.py\n--- a/big.py\n+++ b/big.py\n")
+        assert chunk.endswith(f"+value_{hunk}_4 = 4")
+
+
+def test_oversized_hunk_is_split_between_lines():
+    """
+    Test that a single hunk larger than the limit is split between its lines, without losing any.
+    """
+    diff_file = make_diff_file(hunks=1, lines_per_hunk=50)
+
+    chunks = chunk_diff_file(diff_file, max_tokens=100)
+
+    assert len(chunks) > 1
+    assert [line for chunk in chunks for line in chunk.split("\n")[3:]] == diff_file.hunks[0].lines
@@ -0,0 +1,87 @@
+from utils.clustering import ChangeClusters, fingerprint, normalize_lines
+from utils.diff_parser import parse_diff
+
+DIFF = """diff --git a/src/a.py b/src/a.py
+@@ -1,3 +1,3 @@
+ import os
+-from utils.old import helper
++from utils.new import helper
+
+diff --git a/src/b.py b/src/b.py
+@@ -10,3 +10,3 @@ def main():
+ import sys
+-from  utils.old  import helper
++from utils.new import helper
+
+diff --git a/src/c.py b/src/c.py
+@@ -1 +1 @@
+-from utils.old import other
++from utils.new import other
+diff --git a/web/a.js b/web/a.js
+@@ -1 +1 @@
+-from utils.old import helper
++from utils.new import helper
+diff --git a/logo.png b/logo.png
+Binary files a/logo.png and b/logo.png differ
+diff --git a/icon.png b/icon.png
+Binary files a/icon.png and b/icon.png differ
+"""
+
+
+def test_normalize_lines():
+    """
+    Test that whitespace is collapsed and blank lines are dropped.
+    """
+    assert normalize_lines(["+  x  =\t1 ", "+", "-   "]) == ["+x = 1"]
+
+
+def test_normalize_identifiers():
+    """
+    Test that identifiers are numbered by first appearance, keeping keywords and the shape of the change.
+    """
+    assert normalize_lines(["-return foo(bar)", "+return foo(baz)"], identifiers=True) == [
+        "-return v0(v1)",
+        "+return v0(v2)",
+    ]
+    assert normalize_lines(["-if x: pass", "+if x: return"], identifiers=True) == ["-if v0: pass", "+if v0: return"]
+
+
+def test_fingerprint():
+    """
+    Test that files with the same change share a fingerprint, whatever their context and layout,
+    unless the changed names or the language differ.
+    """
+    a, b, c, js, binary, _ = parse_diff(DIFF.splitlines())
+
+    assert fingerprint(a) == fingerprint(b)
+    assert fingerprint(a) != fingerprint(c)
+    assert fingerprint(a, identifiers=True) == fingerprint(c, identifiers=True)
+    assert fingerprint(a) != fingerprint(js)
+    assert fingerprint(binary) is None
+
+
+def test_change_clusters():
+    """
+    Test that only the first file of every cluster is reviewed, and that the others are its members.
+    """
+    clusters = ChangeClusters()
+
+    reviewed = [diff_file.path for diff_file in clusters.filter(parse_diff(DIFF.splitlines()), prefix="abc:")]
+
+    assert reviewed == ["src/a.py", "src/c.py", "web/a.js", "logo.png", "icon.png"]
+    assert clusters.members("abc:src/a.py") == ["abc:src/a.py", "abc:src/b.py"]
+    assert clusters.members("abc:logo.png") == ["abc:logo.png"]
+    assert clusters.summary() == (
+        "Clustered 2 file(s) with the same change into 1 cluster(s), saving the review of 1 file(s):\n"
+        "  2 files like abc:src/a.py"
+    )
+
+
+def test_change_clusters_without_duplicates():
+    """
+    Test that there is nothing to report when every change is unique.
+    """
+    clusters = ChangeClusters()
+    list(clusters.filter(parse_diff(DIFF.splitlines()[:5])))
+
+    assert clusters.summary() is None
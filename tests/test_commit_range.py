@@ -0,0 +1,89 @@
+import subprocess
+
+import pytest
+
+from utils.commit_range import CommitRangeReader
+from utils.git import GitError
+
+
+def commit(message: str) -> str:
+    subprocess.run(["git", "add", "-A"], check=True)
+    subprocess.run(["git", "commit", "-qm", message], check=True)
+    return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+
+
+@pytest.fixture
+def git_repository(git_repository):
+    (git_repository / "app.py").write_text("".join(f"line{index}\n" for index in range(20)))
+    commit("Initial commit")
+    return git_repository
+
+
+def test_read_commit_range(git_repository):
+    """
+    Test that every commit of the range is read in order, with the files it changed.
+    """
+    (git_repository / "app.py").write_text("changed\n")
+    first = commit("First")
+    (git_repository / "other.py").write_text("x = 1\n")
+    second = commit("Second")
+
+    reader = CommitRangeReader("HEAD~2", "HEAD")
+    commits = list(reader.read())
+
+    assert [(diff.commit, [file.path for file in diff.diff_files]) for diff in commits] == [
+        (first, ["app.py"]),
+        (second, ["other.py"]),
+    ]
+    assert reader.duplicates == []
+
+
+def test_read_commit_range_skips_duplicates(git_repository):
+    """
+    Test that a change reverted then reapplied elsewhere in the file is only read once.
+    """
+    app = git_repository / "app.py"
+    original = app.read_text()
+    app.write_text(original.replace("line2\n", "line2\nadded = 1\n"))
+    first = commit("Add")
+    app.write_text(original)
+    revert = commit("Revert")
+    app.write_text("header\n" + original)
+    shift = commit("Shift")
+    # The same change, at other line numbers
+    app.write_text("header\n" + original.replace("line2\n", "line2\nadded = 1\n"))
+    reapply = commit("Reapply")
+
+    reader = CommitRangeReader("main~4", "main", max_workers=3)
+    commits = list(reader.read())
+
+    assert [(diff.commit, len(diff.diff_files)) for diff in commits] == [
+        (first, 1),
+        (revert, 1),
+        (shift, 1),
+        (reapply, 0),
+    ]
+    assert reader.duplicates == [(reapply, "app.py")]
+
+
+def test_read_commit_range_whitespace_changes(git_repository):
+    """
+    Test that the files of every commit changed when ignoring whitespace are listed, if asked to.
+    """
+    (git_repository / "app.py").write_text("".join(f"line{index} \n" for index in range(20)))
+    (git_repository / "other.py").write_text("x = 1\n")
+    commit("Whitespace")
+
+    [commit_diff] = CommitRangeReader("HEAD~1", "HEAD").read()
+    [unchecked] = CommitRangeReader("HEAD~1", "HEAD", whitespace_check=False).read()
+
+    assert commit_diff.whitespace_changes == {"other.py"}
+    assert unchecked.whitespace_changes is None
+
+
+def test_read_commit_range_unknown_ref(git_repository):
+    """
+    Test that an unknown ref raises a GitError.
+    """
+    with pytest.raises(GitError):
+        list(CommitRangeReader("unknown-ref", "HEAD").read())
@@ -0,0 +1,96 @@
+import argparse
+
+import pytest
+
+from hooks.main import add_review_arguments, route
+from utils.config import ConfigError, apply_config, load_config
+
+
+def review_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    add_review_arguments(parser)
+    return parser
+
+
+def test_load_config(tmp_path):
+    """
+    Test that the [tool.ai-review] table of pyproject.toml is read, and that a missing file or table is empty.
+    """
+    path = tmp_path / "pyproject.toml"
+    path.write_text('[project]\nname = "app"\n\n[tool.ai-review]\nsecurity = true\nmodel = "gpt-4.1-mini"\n')
+
+    assert load_config(path) == {"security": True, "model": "gpt-4.1-mini"}
+    assert load_config(tmp_path / "missing.toml") == {}
+    path.write_text('[project]\nname = "app"\n')
+    assert load_config(path) == {}
+
+
+def test_load_invalid_config(tmp_path):
+    """
+    Test that invalid TOML raises a ConfigError.
+    """
+    path = tmp_path / "pyproject.toml"
+    path.write_text("[tool.ai-review\n")
+
+    with pytest.raises(ConfigError, match="Invalid"):
+        load_config(path)
+
+
+def test_apply_config():
+    """
+    Test that the configuration sets the defaults of the options, converted like command-line values,
+    and that command-line options still override it.
+    """
+    parser = review_parser()
+    apply_config(
+        parser,
+        {
+            "security": True,
+            "max-chunk-tokens": 4000,
+            "route": ["model=gpt-4.1,types=SECURITY"],
+            "exclude": ["docs/*"],
+            "debounce": 5,
+        },
+    )
+
+    args = parser.parse_args(["--max-chunk-tokens", "2000", "--exclude", "*.md"])
+
+    assert args.security is True
+    assert args.max_chunk_tokens == 2000
+    assert [item.to_spec() for item in args.route] == [route("model=gpt-4.1,types=SECURITY").to_spec()]
+    assert args.exclude == ["docs/*", "*.md"]
+    assert not hasattr(args, "debounce")
+
+
+@pytest.mark.parametrize(
+    "config",
+    [{"security": "yes"}, {"concurrency": 0}, {"route": ["types=SECURITY"]}, {"removed-lines": "all"}],
+)
+def test_apply_invalid_config(config):
+    """
+    Test that values the command line would reject raise a ConfigError.
+    """
+    with pytest.raises(ConfigError, match="Invalid value"):
+        apply_config(review_parser(), config)
+
+
+def test_apply_config_single_value_of_repeatable_option():
+    """
+    Test that a single value sets a repeatable option like a list of one, so that it is neither split in
+    characters nor broken by the same option on the command line.
+    """
+    parser = review_parser()
+    apply_config(parser, {"exclude": "*.lock", "route": "model=gpt-4.1,types=SECURITY"})
+
+    args = parser.parse_args(["--exclude", "*.md"])
+
+    assert args.exclude == ["*.lock", "*.md"]
+    assert [item.to_spec() for item in args.route] == [route("model=gpt-4.1,types=SECURITY").to_spec()]
+
+
+def test_apply_config_list_of_single_option():
+    """
+    Test that a list for an option that cannot be repeated raises a ConfigError.
+    """
+    with pytest.raises(ConfigError, match="is not a single value"):
+        apply_config(review_parser(), {"model": ["gpt-4.1", "gpt-4o"]})
@@ -0,0 +1,157 @@
+from utils.context import (
+    MAX_SCOPE_LINES,
+    RemovedLines,
+    changed_lines,
+    context_ranges,
+    python_scopes,
+    trim_context,
+)
+from utils.diff_parser import parse_diff
+
+SOURCE = """import sys
+
+
+@decorator
+def first(x):
+    y = x * 10
+    return y
+
+
+class Second:
+    def method(self):
+        return 2
+"""
+
+DIFF = """diff --git a/module.py b/module.py
+index 3db6084..6978e3d 100644
+--- a/module.py
++++ b/module.py
+@@ -1,3 +1,3 @@
+-import os
++import sys
+ 
+ 
+@@ -5,4 +5,4 @@ def first(x):
+ def first(x):
+-    y = x + 10
++    y = x * 10
+     return y
+ 
+"""
+
+
+def parsed_diff(diff: str = DIFF):
+    return next(parse_diff(diff.splitlines()))
+
+
+def test_python_scopes():
+    """
+    Test that functions, methods and classes are found, decorators included.
+    """
+    assert sorted(python_scopes(SOURCE)) == [(4, 7), (10, 12), (11, 12)]
+
+
+def test_python_scopes_syntax_error():
+    """
+    Test that sources that do not parse have no known scopes.
+    """
+    assert python_scopes("def broken(:\n") is None
+
+
+def test_changed_lines():
+    """
+    Test that added lines are numbered in the new file, and removed lines anchored to the line after them.
+    """
+    added, removed = changed_lines(parsed_diff())
+
+    assert added == {1, 6}
+    assert removed == {1: ["-import os"], 6: ["-    y = x + 10"]}
+
+
+def test_context_ranges_merges_ranges():
+    """
+    Test that changes use their innermost scope, or a unified context outside of any, merged when they touch.
+    """
+    scopes = [(4, 7), (10, 12), (11, 12)]
+
+    assert context_ranges([1, 6], scopes, 12, context_lines=1) == [(1, 2), (4, 7)]
+    assert context_ranges([12], scopes, 12) == [(11, 12)]
+    assert context_ranges([1, 5], scopes, 12, context_lines=2) == [(1, 7)]
+
+
+def test_context_ranges_ignores_long_scopes():
+    """
+    Test that scopes too long to be worth sending fall back to the unified context.
+    """
+    assert context_ranges([50], [(1, MAX_SCOPE_LINES + 1)], 300, context_lines=3) == [(47, 53)]
+
+
+def test_trim_context():
+    """
+    Test that the raw context is replaced by the enclosing function, and the useless headers are dropped.
+    """
+    trimmed = trim_context(parsed_diff(), SOURCE, context_lines=1)
+
+    assert trimmed.review_input().splitlines() == [
+        "diff --git a/module.py b/module.py",
+        "-import os",
+        "+import sys",
+        " ",
+        " @decorator",
+        " def first(x):",
+        "-    y = x + 10",
+        "+    y = x * 10",
+        "     return y",
+    ]
+
+
+def test_trim_context_removed_lines():
+    """
+    Test that removed lines can be replaced by their count or dropped.
+    """
+    counted = trim_context(parsed_diff(), SOURCE, context_lines=0, removed_lines=RemovedLines.COUNT)
+    dropped = trim_context(parsed_diff(), SOURCE, context_lines=0, removed_lines=RemovedLines.DROP)
+
+    assert counted.hunks[0].lines == ["- [1 line(s) removed]", "+import sys"]
+    assert "-    y = x + 10" not in dropped.review_input()
+    assert "+    y = x * 10" in dropped.review_input()
+
+
+def test_trim_context_unsupported_language():
+    """
+    Test that files without scope support keep a unified context of the configured width.
+    """
+    diff = DIFF.replace("module.py", "module.txt")
+
+    trimmed = trim_context(parsed_diff(diff), SOURCE, context_lines=1)
+
+    assert [hunk.lines for hunk in trimmed.hunks][1] == [
+        " def first(x):",
+        "-    y = x + 10",
+        "+    y = x * 10",
+        "     return y",
+    ]
+
+
+def test_trim_context_with_other_line_breaks():
+    """
+    Test that only newlines split the source, so that form feeds and other line breaks keep the lines aligned.
+    """
+    source = SOURCE.replace("import sys\n", "import sys  # \x0c\x85\n")
+    diff = DIFF.replace("+import sys\n", "+import sys  # \x0c\x85\n")
+
+    trimmed = trim_context(parsed_diff(diff), source, context_lines=0)
+
+    assert [hunk.lines for hunk in trimmed.hunks] == [
+        ["-import os", "+import sys  # \x0c\x85"],
+        [" @decorator", " def first(x):", "-    y = x + 10", "+    y = x * 10", "     return y"],
+    ]
+
+
+def test_trim_context_without_source():
+    """
+    Test that files without staged content, like deleted files, are left as they are.
+    """
+    diff_file = parsed_diff()
+
+    assert trim_context(diff_file, None) is diff_file
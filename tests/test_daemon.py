@@ -0,0 +1,174 @@
+import threading
+
+import pytest
+
+from tests.test_ai_consumer_feedback_response import MockAIConsumer, ModelRecordingAIConsumer
+from utils.ai_feedback_filter import FeedbackType
+from utils.daemon import DaemonReviewer, ReviewServer, connect, default_socket_path
+from utils.protocols import AIConsumerProtocol
+from utils.review_cache import ReviewCache
+from utils.routing import ModelRouter, Route
+
+
+class FailingAIConsumer(AIConsumerProtocol):
+    def generate_text(self, instructions: str, input: str, model: str) -> str:
+        raise RuntimeError("Error generating text: API error")
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return tmp_path / "daemon.sock"
+
+
+@pytest.fixture
+def start_server(socket_path):
+    servers = []
+
+    def start(consumer: AIConsumerProtocol, cache: ReviewCache | None = None) -> ReviewServer:
+        server = ReviewServer(socket_path, consumer, cache)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.close()
+
+
+def test_default_socket_path(monkeypatch, tmp_path):
+    """
+    Test that the socket lives in the cache directory unless AI_REVIEW_SOCKET is set.
+    """
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.delenv("AI_REVIEW_SOCKET", raising=False)
+    assert default_socket_path() == tmp_path / "ai-review" / "daemon.sock"
+
+    monkeypatch.setenv("AI_REVIEW_SOCKET", "/run/ai-review.sock")
+    assert str(default_socket_path()) == "/run/ai-review.sock"
+
+
+def test_daemon_uses_client_routes(socket_path, start_server):
+    """
+    Test that the daemon sends every request to the model chosen by the routes of the client.
+    """
+    consumer = ModelRecordingAIConsumer()
+    start_server(consumer)
+    router = ModelRouter([Route.parse("model=large,types=SECURITY")], default_model="small")
+
+    reviewer = DaemonReviewer(connect(socket_path), max_workers=1, router=router)
+    list(reviewer.review([("file1.py", "+x")], [FeedbackType.REVIEW, FeedbackType.SECURITY]))
+
+    assert sorted(consumer.models) == ["large", "small"]
+
+
+def test_daemon_file_feedback_types(socket_path, start_server):
+    """
+    Test that the daemon only requests the feedback types of a file sent with its own.
+    """
+    consumer = ModelRecordingAIConsumer()
+    start_server(consumer)
+    router = ModelRouter([Route.parse("model=large,types=SECURITY")], default_model="small")
+
+    reviewer = DaemonReviewer(connect(socket_path), max_workers=1, router=router)
+    feedback_types = [FeedbackType.REVIEW, FeedbackType.SECURITY]
+    list(reviewer.review([("file1.py", "+x")], feedback_types, {"file1.py": [FeedbackType.REVIEW]}))
+
+    assert consumer.models == ["small"]
+
+
+def test_connect_without_daemon(socket_path):
+    """
+    Test that connecting fails quietly when no daemon is listening.
+    """
+    assert connect(socket_path) is None
+
+
+def test_review_through_daemon(socket_path, start_server, tmp_path):
+    """
+    Test that the daemon reviews the files sent by the client, in order, and caches the feedback in memory.
+    """
+    consumer = MockAIConsumer()
+    start_server(consumer, ReviewCache(tmp_path / "cache", memory_entries=10))
+    files = [("file1.py", "print('Hello')"), ("file2.py", ["chunk 1", "chunk 2"])]
+
+    for _ in range(2):
+        reviewer = DaemonReviewer(connect(socket_path), max_workers=2)
+        results = list(reviewer.review(iter(files), [FeedbackType.REVIEW, FeedbackType.SECURITY]))
+
+        assert [file_name for file_name, _ in results] == ["file1.py", "file2.py"]
+        assert results[0][1] == {
+            "review": ["Feedback 1", "Feedback 2"],
+            "security": ["Security Feedback 1"],
+            "format": [],
+        }
+        assert reviewer.unreviewed == []
+
+    # The second review only used the cache
+    assert consumer.calls == 6
+
+
+def test_review_without_cache(socket_path, start_server, tmp_path):
+    """
+    Test that the client can opt out of the daemon cache.
+    """
+    consumer = MockAIConsumer()
+    start_server(consumer, ReviewCache(tmp_path / "cache", memory_entries=10))
+
+    for _ in range(2):
+        reviewer = DaemonReviewer(connect(socket_path), cache=False)
+        list(reviewer.review([("file1.py", "print('Hello')")], [FeedbackType.REVIEW]))
+
+    assert consumer.calls == 2
+
+
+def test_daemon_error(socket_path, start_server):
+    """
+    Test that an error in the daemon is raised by the client.
+    """
+    start_server(FailingAIConsumer())
+    reviewer = DaemonReviewer(connect(socket_path))
+
+    with pytest.raises(RuntimeError, match="Review daemon error: Error generating text: API error"):
+        list(reviewer.review([("file1.py", "print('Hello')")], [FeedbackType.REVIEW]))
+
+
+def test_without_unix_sockets(socket_path, monkeypatch):
+    """
+    Test that there is no daemon to connect to, nor to start, on platforms without Unix sockets.
+    """
+    monkeypatch.delattr("socket.AF_UNIX")
+
+    assert connect(socket_path) is None
+    with pytest.raises(RuntimeError, match="not supported"):
+        ReviewServer(socket_path, MockAIConsumer())
+
+
+def test_socket_is_private(socket_path, start_server):
+    """
+    Test that only the user can connect to the socket.
+    """
+    start_server(MockAIConsumer())
+
+    assert socket_path.stat().st_mode & 0o077 == 0
+
+
+def test_daemon_already_running(socket_path, start_server):
+    """
+    Test that a second daemon cannot take over the socket of a running one.
+    """
+    start_server(MockAIConsumer())
+
+    with pytest.raises(RuntimeError, match="already listening"):
+        ReviewServer(socket_path, MockAIConsumer())
+
+
+def test_stale_socket_is_replaced(socket_path, start_server):
+    """
+    Test that the socket left behind by a daemon that did not exit cleanly is replaced.
+    """
+    socket_path.touch()
+
+    start_server(MockAIConsumer())
+
+    assert connect(socket_path) is not None
@@ -0,0 +1,125 @@
+from utils.diff_parser import FileStatus, parse_diff, unquote_path
+
+MODIFIED_DIFF = """diff --git a/src/app.py b/src/app.py
+index 83db48f..bf269f4 100644
+--- a/src/app.py
++++ b/src/app.py
+@@ -1,3 +1,4 @@ def main():
+ import os
+-import re
++import sys
++diff --git a/fake b/fake
+ print(os)
+@@ -10 +11 @@
+-old
++new
+\\ No newline at end of file
+"""
+
+
+def test_parse_modified_file():
+    """
+    Test that a modified file is parsed with its paths, hunk ranges and hunk lines, and that
+    hunk content looking like a header is not mistaken for a new file.
+    """
+    [diff_file] = list(parse_diff(MODIFIED_DIFF.splitlines(keepends=True)))
+
+    assert diff_file.path == "src/app.py"
+    assert diff_file.old_path == "src/app.py"
+    assert diff_file.status == FileStatus.MODIFIED
+    assert not diff_file.is_binary
+    assert [
+        (hunk.old_start, hunk.old_count, hunk.new_start, hunk.new_count, hunk.header) for hunk in diff_file.hunks
+    ] == [(1, 3, 1, 4, "def main():"), (10, 1, 11, 1, "")]
+    assert diff_file.hunks[0].lines[-2] == "+diff --git a/fake b/fake"
+    assert diff_file.hunks[1].lines == ["-old", "+new", "\\ No newline at end of file"]
+
+
+def test_review_input_drops_hunk_headers():
+    """
+    Test that the review input keeps the file headers and lines, without the hunk headers.
+    """
+    [diff_file] = list(parse_diff(MODIFIED_DIFF.splitlines()))
+
+    review_input = diff_file.review_input()
+
+    assert review_input.startswith("diff --git a/src/app.py b/src/app.py\nindex 83db48f..bf269f4 100644\n--- a/src")
+    assert "@@" not in review_input
+    assert review_input.endswith("-old\n+new\n\\ No newline at end of file")
+
+
+def test_patch_rebuilds_the_diff():
+    """
+    Test that the patch of a file is the diff it was parsed from, with explicit hunk line counts.
+    """
+    [diff_file] = list(parse_diff(MODIFIED_DIFF.splitlines(keepends=True)))
+
+    assert diff_file.patch() == MODIFIED_DIFF.rstrip("\n").replace("@@ -10 +11 @@", "@@ -10,1 +11,1 @@")
+
+
+def test_parse_statuses():
+    """
+    Test that added, deleted, renamed and binary files are detected.
+    """
+    diff = """diff --git a/new file.py b/new file.py
+new file mode 100644
+index 0000000..e69de29
+--- /dev/null
++++ b/new file.py\t
+@@ -0,0 +1 @@
++x = 1
+diff --git a/old.py b/old.py
+deleted file mode 100644
+index e69de29..0000000
+diff --git a/a b.py b/c d.py
+similarity index 100%
+rename from a b.py
+rename to c d.py
+diff --git a/logo.png b/logo.png
+index 1234567..89abcde 100644
+Binary files a/logo.png and b/logo.png differ
+"""
+    added, deleted, renamed, binary = parse_diff(diff.splitlines())
+
+    assert (added.status, added.old_path, added.path) == (FileStatus.ADDED, None, "new file.py")
+    assert (deleted.status, deleted.new_path, deleted.path) == (FileStatus.DELETED, None, "old.py")
+    assert (renamed.status, renamed.old_path, renamed.path) == (FileStatus.RENAMED, "a b.py", "c d.py")
+    assert renamed.hunks == []
+    assert binary.is_binary
+    assert binary.path == "logo.png"
+
+
+def test_parse_quoted_paths():
+    """
+    Test that paths quoted by git are decoded.
+    """
+    diff = 'diff --git "a/caf\\303\\251 \\"x\\".py" "b/caf\\303\\251 \\"x\\".py"\n'
+
+    [diff_file] = list(parse_diff([diff]))
+
+    assert diff_file.path == 'café "x".py'
+    assert unquote_path("plain.py") == "plain.py"
+
+
+def test_parse_diff_is_lazy():
+    """
+    Test that every file is yielded as soon as the next one starts, before the rest of the diff is read.
+    """
+    consumed = []
+
+    def lines():
+        for line in ["diff --git a/a.py b/a.py", "diff --git a/b.py b/b.py", "diff --git a/c.py b/c.py"]:
+            consumed.append(line)
+            yield line
+
+    diff_files = parse_diff(lines())
+
+    assert next(diff_files).path == "a.py"
+    assert len(consumed) == 2
+
+
+def test_parse_ignores_preamble():
+    """
+    Test that text before the first file, like a commit message, is ignored.
+    """
+    assert list(parse_diff(["commit 123", "", "    diff --git in a message"])) == []
@@ -0,0 +1,236 @@
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from utils.ai_feedback_filter import AIConsumerFeedbackResponse, FeedbackType
+from utils.dispatcher import ReviewDispatcher
+from utils.protocols import AIConsumerProtocol
+
+
+class SlowAIConsumer(AIConsumerProtocol):
+    """Consumer whose latency depends on the input, tracking how many calls run at once."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def generate_text(self, instructions: str, input: str, model: str) -> str:
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            # The first files are the slowest, so they finish last
+            time.sleep(0.05 / (int(input) + 1))
+            if AIConsumerFeedbackResponse.TYPES_OF_FEEDBACK[FeedbackType.SECURITY] in instructions:
+                return f"Security {input}"
+            return f"Review {input}"
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def slow_consumer():
+    return SlowAIConsumer()
+
+
+def test_review_keeps_file_order(slow_consumer):
+    """
+    Test that results are yielded in the order the files were given, even when the first
+    requests are the last ones to finish.
+    """
+    dispatcher = ReviewDispatcher(AIConsumerFeedbackResponse(consumer=slow_consumer), max_workers=4)
+    files = [(f"file{index}.py", str(index)) for index in range(6)]
+
+    results = list(dispatcher.review(files, [FeedbackType.REVIEW, FeedbackType.SECURITY]))
+
+    assert [file_name for file_name, _ in results] == [file_name for file_name, _ in files]
+    assert results[2] == ("file2.py", {"review": ["Review 2"], "security": ["Security 2"], "format": []})
+
+
+def test_review_respects_concurrency_limit(slow_consumer):
+    """
+    Test that no more than `max_workers` requests are sent at the same time.
+    """
+    dispatcher = ReviewDispatcher(AIConsumerFeedbackResponse(consumer=slow_consumer), max_workers=2)
+    files = [(f"file{index}.py", str(index)) for index in range(6)]
+
+    list(dispatcher.review(files, [FeedbackType.REVIEW, FeedbackType.SECURITY]))
+
+    assert slow_consumer.max_active == 2
+
+
+def test_invalid_max_workers(slow_consumer):
+    """
+    Test that the dispatcher rejects a concurrency limit lower than one.
+    """
+    with pytest.raises(ValueError, match="Invalid max workers"):
+        ReviewDispatcher(AIConsumerFeedbackResponse(consumer=slow_consumer), max_workers=0)
+
+
+def test_review_combined(slow_consumer):
+    """
+    Test that combined mode sends a single request per file.
+    """
+    feedback_response = AIConsumerFeedbackResponse(consumer=slow_consumer)
+    dispatcher = ReviewDispatcher(feedback_response, max_workers=2, combined=True)
+    with patch.object(feedback_response, "get_combined_feedback", return_value={"review": ["Review"]}) as mock:
+        results = list(dispatcher.review([("file1.py", "1")], [FeedbackType.REVIEW, FeedbackType.FORMAT]))
+
+    assert results == [("file1.py", {"review": ["Review"], "security": [], "format": []})]
+    mock.assert_called_once_with("1", [FeedbackType.REVIEW, FeedbackType.FORMAT])
+
+
+def test_review_packed(slow_consumer):
+    """
+    Test that packed files are reviewed with a single request per feedback type, and that large
+    files are still reviewed on their own.
+    """
+    feedback_response = AIConsumerFeedbackResponse(consumer=slow_consumer)
+    dispatcher = ReviewDispatcher(feedback_response, max_workers=2, pack_tokens=100)
+    files = [("file1.py", "1"), ("file2.py", "2"), ("file3.py", "3".zfill(1000))]
+    with patch.object(feedback_response, "get_packed_feedback", return_value=[["Review 1"], []]) as mock:
+        results = list(dispatcher.review(files, [FeedbackType.REVIEW]))
+
+    assert results == [
+        ("file1.py", {"review": ["Review 1"], "security": [], "format": []}),
+        ("file2.py", {"review": [], "security": [], "format": []}),
+        ("file3.py", {"review": [f"Review {'3'.zfill(1000)}"], "security": [], "format": []}),
+    ]
+    mock.assert_called_once_with(files[:2], FeedbackType.REVIEW)
+
+
+def test_review_file_feedback_types(slow_consumer):
+    """
+    Test that files with their own feedback types only get those requests, packed or not.
+    """
+    feedback_response = AIConsumerFeedbackResponse(consumer=slow_consumer)
+    files = [("file1.py", "1"), ("file2.py", "2")]
+    file_feedback_types = {"file1.py": [FeedbackType.REVIEW]}
+    feedback_types = [FeedbackType.REVIEW, FeedbackType.SECURITY]
+
+    results = list(ReviewDispatcher(feedback_response).review(files, feedback_types, file_feedback_types))
+
+    assert results == [
+        ("file1.py", {"review": ["Review 1"], "security": [], "format": []}),
+        ("file2.py", {"review": ["Review 2"], "security": ["Security 2"], "format": []}),
+    ]
+
+    dispatcher = ReviewDispatcher(feedback_response, pack_tokens=100)
+    with patch.object(feedback_response, "get_packed_feedback", side_effect=[[["A"], ["B"]], [["C"]]]) as mock:
+        results = list(dispatcher.review(files, feedback_types, file_feedback_types))
+
+    assert results == [
+        ("file1.py", {"review": ["A"], "security": [], "format": []}),
+        ("file2.py", {"review": ["B"], "security": ["C"], "format": []}),
+    ]
+    assert mock.call_args_list[1].args == (files[1:], FeedbackType.SECURITY)
+
+
+def test_review_chunked_file(slow_consumer):
+    """
+    Test that every chunk of a file is reviewed, and that their feedback is merged without the
+    lines already reported by a previous chunk.
+    """
+    feedback_response = AIConsumerFeedbackResponse(consumer=slow_consumer)
+    dispatcher = ReviewDispatcher(feedback_response, max_workers=2)
+    responses = {"1": ["Issue A", "Issue B", "Issue B"], "2": ["Issue B", "Issue C"]}
+    with patch.object(feedback_response, "get_feedback", side_effect=lambda input, _: responses[input]):
+        results = list(dispatcher.review([("file1.py", ["1", "2"])], [FeedbackType.REVIEW]))
+
+    assert results == [
+        ("file1.py", {"review": ["Issue A", "Issue B", "Issue B", "Issue C"], "security": [], "format": []})
+    ]
+
+
+class FindingAIConsumer(AIConsumerProtocol):
+    """Consumer that only finds something in file 0, faster than it reviews any other file."""
+
+    def __init__(self):
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def generate_text(self, instructions: str, input: str, model: str) -> str:
+        with self.lock:
+            self.calls += 1
+        if input == "0":
+            time.sleep(0.02)
+            return "Found a bug"
+        time.sleep(0.2)
+        return "OK"
+
+
+def test_review_fail_fast():
+    """
+    Test that once a file gets feedback, the queued requests are cancelled and their files reported
+    as unreviewed.
+    """
+    consumer = FindingAIConsumer()
+    dispatcher = ReviewDispatcher(AIConsumerFeedbackResponse(consumer=consumer), max_workers=2, fail_fast=True)
+    files = [(f"file{index}.py", str(index)) for index in range(10)]
+
+    start = time.monotonic()
+    results = list(dispatcher.review(files, [FeedbackType.REVIEW]))
+
+    # file1 was already in progress, and finished on its own
+    assert results == [
+        ("file0.py", {"review": ["Found a bug"], "security": [], "format": []}),
+        ("file1.py", {"review": [], "security": [], "format": []}),
+    ]
+    assert dispatcher.unreviewed == [f"file{index}.py" for index in range(2, 10)]
+    assert consumer.calls == 2
+    assert time.monotonic() - start < 0.5
+
+
+def test_review_without_fail_fast_reviews_every_file():
+    """
+    Test that every file is reviewed when fail fast is off, even after feedback.
+    """
+    consumer = FindingAIConsumer()
+    dispatcher = ReviewDispatcher(AIConsumerFeedbackResponse(consumer=consumer), max_workers=10)
+    files = [(f"file{index}.py", str(index)) for index in range(10)]
+
+    results = list(dispatcher.review(files, [FeedbackType.REVIEW]))
+
+    assert len(results) == 10
+    assert dispatcher.unreviewed == []
+
+
+class RecordingAIConsumer(AIConsumerProtocol):
+    """Consumer recording the order its calls start in."""
+
+    def __init__(self):
+        self.inputs: list[str] = []
+
+    def generate_text(self, instructions: str, input: str, model: str) -> str:
+        self.inputs.append(input)
+        return f"Review {input}"
+
+
+def test_review_longest_first():
+    """
+    Test that the requests predicted to take longest start first, and results are still yielded in file order.
+    """
+    consumer = RecordingAIConsumer()
+    durations = {"file0.py": 1.0, "file1.py": 5.0, "file2.py": 0.5, "file3.py": 5.0}
+    predicted = []
+
+    def predict_duration(file_name: str, feedback_type: str, tokens: int) -> float:
+        predicted.append((file_name, feedback_type))
+        return durations[file_name]
+
+    dispatcher = ReviewDispatcher(
+        AIConsumerFeedbackResponse(consumer=consumer), max_workers=1, predict_duration=predict_duration
+    )
+    files = [(f"file{index}.py", str(index)) for index in range(4)]
+
+    results = list(dispatcher.review(files, [FeedbackType.REVIEW]))
+
+    # Ties keep the file order
+    assert consumer.inputs == ["1", "3", "0", "2"]
+    assert [file_name for file_name, _ in results] == [file_name for file_name, _ in files]
+    assert results[1] == ("file1.py", {"review": ["Review 1"], "security": [], "format": []})
+    assert predicted[0] == ("file0.py", "REVIEW")
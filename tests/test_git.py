@@ -0,0 +1,173 @@
+import subprocess
+
+import pytest
+
+from utils.diff_parser import FileStatus, parse_diff
+from utils.git import (
+    BlobReader,
+    GitError,
+    git_toplevel,
+    parse_numstat,
+    patch_ids,
+    range_diff,
+    range_numstat,
+    rev_list,
+    staged_diff,
+    staged_numstat,
+    stream_diff,
+)
+
+
+def test_staged_diff(git_repository):
+    """
+    Test that the staged changes of a real repository are parsed, including paths with spaces.
+    """
+    (git_repository / "my file.py").write_text("print('Hello')\n")
+    (git_repository / "other.py").write_text("x = 1\n")
+    subprocess.run(["git", "add", "."], check=True)
+
+    diff_files = list(staged_diff())
+
+    assert [(diff_file.path, diff_file.status) for diff_file in diff_files] == [
+        ("my file.py", FileStatus.ADDED),
+        ("other.py", FileStatus.ADDED),
+    ]
+    assert diff_files[0].hunks[0].lines == ["+print('Hello')"]
+
+
+def test_staged_diff_of_some_paths(git_repository):
+    """
+    Test that the staged changes can be limited to some paths, taken literally rather than as patterns.
+    """
+    for name in ("a[1].py", "a1.py", "b.py"):
+        (git_repository / name).write_text("x = 1\n")
+    subprocess.run(["git", "add", "."], check=True)
+
+    assert [diff_file.path for diff_file in staged_diff(paths=["a[1].py", "b.py"])] == ["a[1].py", "b.py"]
+    assert staged_numstat(paths=["a1.py"]) == {"a1.py": (1, 0)}
+    assert staged_numstat(ignore_whitespace=True, paths=["b.py"]) == {"b.py": (1, 0)}
+
+
+def test_staged_diff_keeps_carriage_returns(git_repository):
+    """
+    Test that the output of git is only split on newlines, like git counts the lines of a hunk: a carriage
+    return inside a line does not end the hunk early, and CRLF line endings are kept.
+    """
+    (git_repository / "crlf.py").write_bytes(b"x = 1\r\ny = 2\r\n")
+    (git_repository / "cr.py").write_bytes(b'x = "a\rb"\ny = 2\n')
+    subprocess.run(["git", "add", "."], check=True)
+
+    diff_files = {diff_file.path: diff_file for diff_file in staged_diff()}
+
+    assert diff_files["crlf.py"].hunks[0].lines == ["+x = 1\r", "+y = 2\r"]
+    assert diff_files["cr.py"].hunks[0].lines == ['+x = "a\rb"', "+y = 2"]
+    assert diff_files["cr.py"].header_lines[-1] == "+++ b/cr.py"
+
+
+def test_stream_diff_error(git_repository):
+    """
+    Test that a failing git command raises a GitError with its error output.
+    """
+    with pytest.raises(GitError, match="unknown-ref"):
+        list(stream_diff(["git", "diff", "unknown-ref"]))
+
+
+def test_staged_numstat_ignoring_whitespace(git_repository):
+    """
+    Test that whitespace-only changes are missing from the numstat that ignores whitespace.
+    """
+    (git_repository / "style.py").write_text("x = 1\n")
+    (git_repository / "logic.py").write_text("x = 1\n")
+    subprocess.run(["git", "add", "."], check=True)
+    subprocess.run(["git", "commit", "-qm", "Initial commit"], check=True)
+    (git_repository / "style.py").write_text("x  =  1\n")
+    (git_repository / "logic.py").write_text("x = 2\n")
+    subprocess.run(["git", "add", "."], check=True)
+
+    assert staged_numstat() == {"logic.py": (1, 1), "style.py": (1, 1)}
+    assert staged_numstat(ignore_whitespace=True) == {"logic.py": (1, 1)}
+
+
+def test_parse_numstat():
+    """
+    Test that binary files and renames are parsed from the numstat output.
+    """
+    output = "-\t-\tlogo.png\x000\t0\t\x00old name.py\x00new name.py\x00"
+
+    assert parse_numstat(output) == {"logo.png": (None, None), "new name.py": (0, 0)}
+
+
+def test_staged_blob_reader(git_repository):
+    """
+    Test that the staged content of files is read, not their content in the working tree.
+    """
+    (git_repository / "my file.py").write_text("x = 1\n")
+    (git_repository / "other.py").write_text("y = 2\n")
+    subprocess.run(["git", "add", "."], check=True)
+    (git_repository / "my file.py").write_text("x = 3\n")
+
+    with BlobReader() as reader:
+        assert reader.read("my file.py") == "x = 1\n"
+        assert reader.read("missing.py") is None
+        assert reader.read("other.py") == "y = 2\n"
+    assert reader.process is None
+
+
+def test_range_diff(git_repository):
+    """
+    Test that the changes and commits of a range are read from the merge base of its refs.
+    """
+    (git_repository / "app.py").write_text("x = 1\n")
+    subprocess.run(["git", "add", "."], check=True)
+    subprocess.run(["git", "commit", "-qm", "Initial commit"], check=True)
+    subprocess.run(["git", "branch", "-q", "feature"], check=True)
+    (git_repository / "app.py").write_text("x = 2\n")
+    subprocess.run(["git", "commit", "-qam", "Main change"], check=True)
+    main_branch = subprocess.run(["git", "branch", "--show-current"], capture_output=True, text=True).stdout.strip()
+    subprocess.run(["git", "checkout", "-q", "feature"], check=True)
+    (git_repository / "feature.py").write_text("y = 1\n")
+    subprocess.run(["git", "add", "."], check=True)
+    subprocess.run(["git", "commit", "-qm", "Feature change"], check=True)
+    (git_repository / "feature.py").write_text("y = 2\n")
+    subprocess.run(["git", "commit", "-qam", "Feature fix"], check=True)
+
+    assert [diff_file.path for diff_file in range_diff(main_branch, "feature")] == ["feature.py"]
+    assert range_numstat(main_branch, "feature") == {"feature.py": (1, 0)}
+    assert len(rev_list(main_branch, "feature")) == 2
+    with BlobReader() as reader:
+        assert reader.read("feature.py", "feature~1") == "y = 1\n"
+
+
+def test_patch_ids_ignore_line_numbers(git_repository):
+    """
+    Test that the same change at other line numbers has the same patch id, and files without hunks none.
+    """
+    diff = """diff --git a/app.py b/app.py
+--- a/app.py
++++ b/app.py
+@@ -{start},2 +{start},3 @@
+ context
++added
+ context
+"""
+    binary = "diff --git a/logo.png b/logo.png\nBinary files a/logo.png and b/logo.png differ\n"
+    diff_files = [next(parse_diff(text.splitlines())) for text in (diff.format(start=1), diff.format(start=40), binary)]
+
+    first, moved, binary_id = patch_ids(diff_files)
+
+    assert first is not None and first == moved
+    assert binary_id is None
+
+
+def test_git_toplevel(git_repository, monkeypatch):
+    """
+    Test that the root of the working tree is found from any of its directories, and outside of it an error raised.
+    """
+    (git_repository / "src").mkdir()
+
+    assert git_toplevel() == str(git_repository)
+    monkeypatch.chdir(git_repository / "src")
+    assert git_toplevel() == str(git_repository)
+    monkeypatch.chdir(git_repository.parent)
+    with pytest.raises(GitError):
+        git_toplevel()
@@ -0,0 +1,115 @@
+import sqlite3
+import time
+
+import pytest
+
+from utils.history import DEFAULT_SECONDS_PER_TOKEN, HISTORY_FILE, ReviewHistory, history_path
+from utils.stats import CallRecord
+
+
+def call(file: str | None, latency: float, feedback_type: str | None = "REVIEW", **kwargs) -> CallRecord:
+    return CallRecord(file, feedback_type, "gpt-4o-mini", latency, **kwargs)
+
+
+@pytest.fixture
+def history(tmp_path):
+    return ReviewHistory("/repo", tmp_path)
+
+
+def test_history_path():
+    """
+    Test that calls are recorded under the path of their file, without the commit of `--per-commit`.
+    """
+    assert history_path("src/app.py") == "src/app.py"
+    assert history_path("0123456789ab:src/app.py") == "src/app.py"
+    assert history_path("a.py, b.py") is None
+
+
+def test_record_skips_calls_without_a_single_path(history):
+    """
+    Test that failed calls, calls outside a review and packed calls are not recorded.
+    """
+    recorded = history.record(
+        [
+            call("app.py", 1.0, input_tokens=1_000, output_tokens=100),
+            call("app.py", 2.0, error="API error"),
+            call(None, 1.0, feedback_type=None),
+            call("a.py, b.py", 1.0),
+        ]
+    )
+
+    assert recorded == 1
+    assert history.paths() == [
+        {
+            "path": "app.py",
+            "calls": 1,
+            "average_latency": 1.0,
+            "max_latency": 1.0,
+            "input_tokens": 1_000,
+            "output_tokens": 100,
+            "cost": pytest.approx((1_000 * 0.15 + 100 * 0.60) / 1e6),
+        }
+    ]
+
+
+def test_predict_from_recent_calls(history, tmp_path):
+    """
+    Test that the duration of a known request is the average of its recent calls, and of an unknown one
+    the latency per token of its feedback type, or the default.
+    """
+    history.record([call("slow.py", 4.0, input_tokens=1_000), call("slow.py", 6.0, input_tokens=1_000)])
+    history.record([call("other.py", 1.0, feedback_type="SECURITY")])
+
+    assert history.predict("slow.py", "REVIEW", 10) == pytest.approx(5.0)
+    assert history.predict("0123456789ab:slow.py", "REVIEW", 10) == pytest.approx(5.0)
+    assert history.predict("new.py", "REVIEW", 100) == pytest.approx(0.5)
+    assert history.predict("new.py", "FORMAT", 100) == pytest.approx(100 * DEFAULT_SECONDS_PER_TOKEN)
+    # Other repositories have their own history
+    assert ReviewHistory("/other", tmp_path).predict("slow.py", "REVIEW", 10) == pytest.approx(
+        10 * DEFAULT_SECONDS_PER_TOKEN
+    )
+
+
+def test_paths_order(history):
+    """
+    Test that paths are listed slowest first by average latency, or most expensive first by total cost.
+    """
+    history.record(
+        [
+            call("slow.py", 5.0, input_tokens=1_000, output_tokens=10),
+            call("cheap.py", 1.0),
+            call("expensive.py", 1.0, input_tokens=100_000, output_tokens=10),
+            call("expensive.py", 1.0, input_tokens=100_000, output_tokens=10),
+        ]
+    )
+
+    assert [path["path"] for path in history.paths("latency")] == ["slow.py", "cheap.py", "expensive.py"]
+    assert [path["path"] for path in history.paths("cost", limit=2)] == ["expensive.py", "slow.py"]
+    with pytest.raises(ValueError):
+        history.paths("size")
+
+
+def test_old_calls_are_forgotten(tmp_path):
+    """
+    Test that recording calls forgets the ones past the maximum age.
+    """
+    history = ReviewHistory("/repo", tmp_path, max_age=60)
+    history.record([call("old.py", 1.0)])
+    with sqlite3.connect(tmp_path / HISTORY_FILE) as connection:
+        connection.execute("UPDATE calls SET recorded_at = ?", (time.time() - 120,))
+
+    history.record([call("new.py", 1.0)])
+
+    assert [path["path"] for path in history.paths()] == ["new.py"]
+
+
+def test_unreadable_history_is_empty(tmp_path):
+    """
+    Test that a corrupt database is treated as an empty history, like the feedback cache.
+    """
+    (tmp_path / HISTORY_FILE).write_text("not a database")
+    history = ReviewHistory("/repo", tmp_path)
+
+    assert history.record([call("app.py", 1.0)]) == 0
+    assert history.predict("app.py", "REVIEW", 10) == pytest.approx(10 * DEFAULT_SECONDS_PER_TOKEN)
+    assert history.paths() == []
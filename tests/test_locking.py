@@ -0,0 +1,55 @@
+import sys
+import threading
+import time
+
+from utils.locking import file_lock, serialized_output
+
+
+def test_file_lock_is_exclusive(tmp_path):
+    """
+    Test that a single holder of a file lock runs at a time.
+    """
+    lock_path = tmp_path / "locks" / "test.lock"
+    events = []
+
+    def hold(name: str) -> None:
+        with file_lock(lock_path):
+            events.append(f"{name} start")
+            time.sleep(0.05)
+            events.append(f"{name} end")
+
+    threads = [threading.Thread(target=hold, args=(name,)) for name in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert events in (["a start", "a end", "b start", "b end"], ["b start", "b end", "a start", "a end"])
+
+
+def test_serialized_output(tmp_path, capsys):
+    """
+    Test that the output of the block is only printed once the block is over, even when it fails.
+    """
+    try:
+        with serialized_output(tmp_path / "output.lock"):
+            print("first")
+            assert capsys.readouterr().out == ""
+            print("second")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+
+    assert capsys.readouterr().out == "first\nsecond\n"
+
+
+def test_file_lock_without_fcntl(tmp_path, monkeypatch):
+    """
+    Test that the lock is skipped, rather than failing, on platforms without fcntl.
+    """
+    monkeypatch.setitem(sys.modules, "fcntl", None)
+
+    with file_lock(tmp_path / "test.lock") as file:
+        file.write("state")
+
+    assert (tmp_path / "test.lock").read_text() == "state"
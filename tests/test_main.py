@@ -1,19 +1,51 @@
-from unittest.mock import MagicMock, patch
+import io
+import json
+import threading
+import time
+from unittest.mock import MagicMock, call, patch
 
+import httpx
 import pytest
+from openai import APITimeoutError
 
+from benchmarks.fakes import FakeBackend, FakeResponsesServer
 from hooks.main import EXIT_CODE_FAIL, EXIT_CODE_SUCCESS, main
+from tests.test_ai_consumer_feedback_response import MockAIConsumer
 from utils.ai_feedback_filter import FeedbackType
+from utils.commit_range import CommitDiff
+from utils.daemon import ReviewServer
+from utils.diff_parser import parse_diff
+from utils.dispatcher import ReviewDispatcher
 
 # filepath: /Users/jose.ariza/projects/python-precommit-project/hooks/test_main.py
 
 
-@pytest.fixture
-def mock_subprocess_run():
-    with patch("hooks.main.subprocess.run") as mock_run:
+@pytest.fixture(autouse=True)
+def isolated_cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+
+
+def git_process(returncode: int = 0, stdout: str = "", stderr: str = "") -> MagicMock:
+    """Builds a fake `git diff` process whose output can be streamed."""
+    process = MagicMock(stdout=io.BytesIO(stdout.encode()), stderr=io.BytesIO(stderr.encode()))
+    process.__enter__.return_value = process
+    process.wait.return_value = returncode
+    return process
+
+
+@pytest.fixture(autouse=True)
+def mock_subprocess_numstat():
+    with patch("utils.git.subprocess.run") as mock_run:
+        mock_run.return_value = MagicMock(returncode=0, stdout="1\t1\tfile1.py\0")
         yield mock_run
 
 
+@pytest.fixture
+def mock_subprocess_popen():
+    with patch("utils.git.subprocess.Popen") as mock_popen:
+        yield mock_popen
+
+
 @pytest.fixture
 def mock_feedback_response():
     with patch("hooks.main.AIConsumerFeedbackResponse") as mock_response:
@@ -22,42 +54,38 @@ def mock_feedback_response():
 
 @pytest.fixture
 def mock_openai_client():
-    with patch("utils.openai_consumer.OpenAI") as MockOpenAI:
+    with patch("openai.OpenAI") as MockOpenAI:
         mock_client = MockOpenAI.return_value
         yield mock_client
 
 
-def test_main_no_changes(mock_subprocess_run, mock_openai_client):
+def test_main_no_changes(mock_subprocess_popen, mock_openai_client):
     """
     Test main function when no changes are staged for commit.
     """
     # Arrange
     mock_openai_client.responses.create.return_value = MagicMock(output_text="Generated text")
-    mock_subprocess_run.return_value = MagicMock(returncode=0, stdout="")
+    mock_subprocess_popen.return_value = git_process(stdout="")
     with patch("sys.argv", ["main"]):  # Mock sys.argv to simulate no arguments
         # Act
         result = main()
 
         # Assert
         assert result == EXIT_CODE_SUCCESS
-        mock_subprocess_run.assert_called_once_with(
-            ["git", "diff", "--staged"],
-            capture_output=True,
-            text=True,
-        )
+        mock_subprocess_popen.assert_called_once()
+        assert mock_subprocess_popen.call_args.args[0] == ["git", "diff", "--staged"]
 
 
-def test_main_successful_feedback(mock_subprocess_run, mock_feedback_response, mock_openai_client):
+def test_main_successful_feedback(mock_subprocess_popen, mock_feedback_response, mock_openai_client):
     """
     Test main function when feedback processing is successful with no issues.
     """
     # Arrange
     mock_openai_client.responses.create.return_value = MagicMock(output_text="Generated text")
-    mock_subprocess_run.return_value = MagicMock(
-        returncode=0,
+    mock_subprocess_popen.return_value = git_process(
         stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\nprint('Hello')",
     )
-    mock_feedback_response.return_value.get_all_feedback.return_value = {"FORMAT": []}
+    mock_feedback_response.return_value.get_feedback.return_value = []
 
     # Act
     with patch("sys.argv", ["main"]):  # Mock sys.argv to simulate no arguments
@@ -65,21 +93,20 @@ def test_main_successful_feedback(mock_subprocess_run, mock_feedback_response, m
 
         # Assert
         assert result == EXIT_CODE_SUCCESS
-        mock_subprocess_run.assert_called_once()
-        mock_feedback_response.return_value.get_all_feedback.assert_called_once()
+        mock_subprocess_popen.assert_called_once()
+        mock_feedback_response.return_value.get_feedback.assert_called_once()
 
 
-def test_main_feedback_with_issues(mock_subprocess_run, mock_feedback_response, mock_openai_client):
+def test_main_feedback_with_issues(mock_subprocess_popen, mock_feedback_response, mock_openai_client):
     """
     Test main function when feedback processing finds issues.
     """
     # Arrange
     mock_openai_client.responses.create.return_value = MagicMock(output_text="Generated text")
-    mock_subprocess_run.return_value = MagicMock(
-        returncode=0,
+    mock_subprocess_popen.return_value = git_process(
         stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\nprint('Hello')",
     )
-    mock_feedback_response.return_value.get_all_feedback.return_value = {"FORMAT": ["Issue 1", "Issue 2"]}
+    mock_feedback_response.return_value.get_feedback.return_value = ["Issue 1", "Issue 2"]
 
     with patch("sys.argv", ["main"]):  # Mock sys.argv to simulate no arguments
         # Act
@@ -87,57 +114,52 @@ def test_main_feedback_with_issues(mock_subprocess_run, mock_feedback_response,
 
         # Assert
         assert result == EXIT_CODE_FAIL
-        mock_subprocess_run.assert_called_once()
-        mock_feedback_response.return_value.get_all_feedback.assert_called_once()
+        mock_subprocess_popen.assert_called_once()
+        mock_feedback_response.return_value.get_feedback.assert_called_once()
 
 
-def test_main_git_diff_error(mock_subprocess_run, mock_openai_client):
+def test_main_git_diff_error(mock_subprocess_popen, mock_openai_client):
     """
     Test main function when git diff command fails.
     """
     # Arrange
     mock_openai_client.responses.create.return_value = MagicMock(output_text="Generated text")
-    mock_subprocess_run.return_value = MagicMock(returncode=1, stderr="Git error")
+    mock_subprocess_popen.return_value = git_process(returncode=1, stderr="Git error")
     with patch("sys.argv", ["main"]):  # Mock sys.argv to simulate no arguments
         # Act
         result = main()
 
         # Assert
         assert result == EXIT_CODE_FAIL
-        mock_subprocess_run.assert_called_once()
+        mock_subprocess_popen.assert_called_once()
 
 
-def test_main_unexpected_exception(mock_subprocess_run, mock_openai_client):
+def test_main_unexpected_exception(mock_subprocess_popen, mock_openai_client):
     """
     Test main function when an unexpected exception occurs.
     """
     # Arrange
     mock_openai_client.responses.create.return_value = MagicMock(output_text="Generated text")
-    mock_subprocess_run.side_effect = Exception("Unexpected error")
+    mock_subprocess_popen.side_effect = Exception("Unexpected error")
     with patch("sys.argv", ["main"]):  # Mock sys.argv to simulate no arguments
         # Act
         result = main()
 
         # Assert
         assert result == EXIT_CODE_FAIL
-        mock_subprocess_run.assert_called_once()
+        mock_subprocess_popen.assert_called_once()
 
 
-def test_main_with_format_flag(mock_subprocess_run, mock_feedback_response, mock_openai_client):
+def test_main_with_format_flag(mock_subprocess_popen, mock_feedback_response, mock_openai_client):
     """
     Test main function when --format flag is passed.
     """
     # Arrange
     mock_openai_client.responses.create.return_value = MagicMock(output_text="Generated text")
-    mock_subprocess_run.return_value = MagicMock(
-        returncode=0,
+    mock_subprocess_popen.return_value = git_process(
         stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\nprint('Hello')",
     )
-    mock_feedback_response.return_value.get_all_feedback.return_value = {
-        "review": [],
-        "security": [],
-        "format": [],
-    }
+    mock_feedback_response.return_value.get_feedback.return_value = []
 
     # Act
     with patch("sys.argv", ["main", "--format"]):  # Mock sys.argv to simulate --format flag
@@ -145,24 +167,27 @@ def test_main_with_format_flag(mock_subprocess_run, mock_feedback_response, mock
 
         # Assert
         assert result == EXIT_CODE_SUCCESS
-        mock_subprocess_run.assert_called_once()
-        mock_feedback_response.return_value.get_all_feedback.assert_called_once_with(
-            input=" a/file1.py b/file1.py\nprint('Hello')",
-            feedback_types=[FeedbackType.REVIEW, FeedbackType.FORMAT],
+        mock_subprocess_popen.assert_called_once()
+        mock_feedback_response.return_value.get_feedback.assert_has_calls(
+            [
+                call("diff --git a/file1.py b/file1.py\nprint('Hello')", FeedbackType.REVIEW),
+                call("diff --git a/file1.py b/file1.py\nprint('Hello')", FeedbackType.FORMAT),
+            ],
+            any_order=True,
         )
+        assert mock_feedback_response.return_value.get_feedback.call_count == 2
 
 
-def test_main_with_security_flag(mock_subprocess_run, mock_feedback_response, mock_openai_client):
+def test_main_with_security_flag(mock_subprocess_popen, mock_feedback_response, mock_openai_client):
     """
     Test main function when --security flag is passed.
     """
     # Arrange
     mock_openai_client.responses.create.return_value = MagicMock(output_text="Generated text")
-    mock_subprocess_run.return_value = MagicMock(
-        returncode=0,
+    mock_subprocess_popen.return_value = git_process(
         stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\nprint('Hello')",
     )
-    mock_feedback_response.return_value.get_all_feedback.return_value = {"SECURITY": []}
+    mock_feedback_response.return_value.get_feedback.return_value = []
 
     # Act
     with patch("sys.argv", ["main", "--security"]):  # Mock sys.argv to simulate --security flag
@@ -170,24 +195,27 @@ def test_main_with_security_flag(mock_subprocess_run, mock_feedback_response, mo
 
         # Assert
         assert result == EXIT_CODE_SUCCESS
-        mock_subprocess_run.assert_called_once()
-        mock_feedback_response.return_value.get_all_feedback.assert_called_once_with(
-            input=" a/file1.py b/file1.py\nprint('Hello')",
-            feedback_types=[FeedbackType.REVIEW, FeedbackType.SECURITY],
+        mock_subprocess_popen.assert_called_once()
+        mock_feedback_response.return_value.get_feedback.assert_has_calls(
+            [
+                call("diff --git a/file1.py b/file1.py\nprint('Hello')", FeedbackType.REVIEW),
+                call("diff --git a/file1.py b/file1.py\nprint('Hello')", FeedbackType.SECURITY),
+            ],
+            any_order=True,
         )
+        assert mock_feedback_response.return_value.get_feedback.call_count == 2
 
 
-def test_main_with_no_fail_flag(mock_subprocess_run, mock_feedback_response, mock_openai_client):
+def test_main_with_no_fail_flag(mock_subprocess_popen, mock_feedback_response, mock_openai_client):
     """
     Test main function when --no-fail flag is passed.
     """
     # Arrange
     mock_openai_client.responses.create.return_value = MagicMock(output_text="Generated text")
-    mock_subprocess_run.return_value = MagicMock(
-        returncode=0,
+    mock_subprocess_popen.return_value = git_process(
         stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\nprint('Hello')",
     )
-    mock_feedback_response.return_value.get_all_feedback.return_value = {"FORMAT": ["Issue 1"]}
+    mock_feedback_response.return_value.get_feedback.return_value = ["Issue 1"]
 
     # Act
     with patch("sys.argv", ["main", "--no-fail"]):  # Mock sys.argv to simulate --no-fail flag
@@ -195,24 +223,26 @@ def test_main_with_no_fail_flag(mock_subprocess_run, mock_feedback_response, moc
 
         # Assert
         assert result == EXIT_CODE_SUCCESS
-        mock_subprocess_run.assert_called_once()
-        mock_feedback_response.return_value.get_all_feedback.assert_called_once_with(
-            input=" a/file1.py b/file1.py\nprint('Hello')",
-            feedback_types=[FeedbackType.REVIEW],
+        mock_subprocess_popen.assert_called_once()
+        mock_feedback_response.return_value.get_feedback.assert_has_calls(
+            [
+                call("diff --git a/file1.py b/file1.py\nprint('Hello')", FeedbackType.REVIEW),
+            ],
+            any_order=True,
         )
+        assert mock_feedback_response.return_value.get_feedback.call_count == 1
 
 
-def test_main_with_multiple_flags(mock_subprocess_run, mock_feedback_response, mock_openai_client):
+def test_main_with_multiple_flags(mock_subprocess_popen, mock_feedback_response, mock_openai_client):
     """
     Test main function when multiple flags are passed.
     """
     # Arrange
     mock_openai_client.responses.create.return_value = MagicMock(output_text="Generated text")
-    mock_subprocess_run.return_value = MagicMock(
-        returncode=0,
+    mock_subprocess_popen.return_value = git_process(
         stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\nprint('Hello')",
     )
-    mock_feedback_response.return_value.get_all_feedback.return_value = {"FORMAT": [], "SECURITY": []}
+    mock_feedback_response.return_value.get_feedback.return_value = []
 
     # Act
     with patch("sys.argv", ["main", "--format", "--security"]):  # Mock sys.argv to simulate multiple flags
@@ -220,8 +250,536 @@ def test_main_with_multiple_flags(mock_subprocess_run, mock_feedback_response, m
 
         # Assert
         assert result == EXIT_CODE_SUCCESS
-        mock_subprocess_run.assert_called_once()
-        mock_feedback_response.return_value.get_all_feedback.assert_called_once_with(
-            input=" a/file1.py b/file1.py\nprint('Hello')",
-            feedback_types=[FeedbackType.REVIEW, FeedbackType.FORMAT, FeedbackType.SECURITY],
+        mock_subprocess_popen.assert_called_once()
+        mock_feedback_response.return_value.get_feedback.assert_has_calls(
+            [
+                call("diff --git a/file1.py b/file1.py\nprint('Hello')", FeedbackType.REVIEW),
+                call("diff --git a/file1.py b/file1.py\nprint('Hello')", FeedbackType.FORMAT),
+                call("diff --git a/file1.py b/file1.py\nprint('Hello')", FeedbackType.SECURITY),
+            ],
+            any_order=True,
+        )
+        assert mock_feedback_response.return_value.get_feedback.call_count == 3
+
+
+def test_main_with_no_cache_flag(mock_subprocess_popen, mock_feedback_response, mock_openai_client):
+    """
+    Test main function when --no-cache flag is passed.
+    """
+    # Arrange
+    mock_subprocess_popen.return_value = git_process(
+        stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\nprint('Hello')",
+    )
+    mock_feedback_response.return_value.get_feedback.return_value = []
+
+    # Act
+    with patch("sys.argv", ["main", "--no-cache"]):  # Mock sys.argv to simulate --no-cache flag
+        result = main()
+
+        # Assert
+        assert result == EXIT_CODE_SUCCESS
+        assert mock_feedback_response.call_args.kwargs["cache"] is None
+
+
+def test_main_skips_files(mock_subprocess_popen, mock_feedback_response, mock_openai_client, capsys):
+    """
+    Test main function when some staged files are not worth reviewing.
+    """
+    # Arrange
+    mock_subprocess_popen.return_value = git_process(
+        stdout=(
+            "diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\n+print('Hello')\n"
+            "diff --git a/poetry.lock b/poetry.lock\n@@ -1 +1 @@\n+x\n"
+            "diff --git a/logo.png b/logo.png\nBinary files a/logo.png and b/logo.png differ\n"
+            "diff --git a/file2.py b/file2.py\n@@ -1 +1 @@\n-x=1\n+x = 1\n"
+        ),
+    )
+    mock_feedback_response.return_value.get_feedback.return_value = []
+
+    # Act
+    with patch("sys.argv", ["main", "--security"]):
+        result = main()
+
+        # Assert
+        assert result == EXIT_CODE_SUCCESS
+        assert mock_feedback_response.return_value.get_feedback.call_count == 2
+        assert (
+            "Skipped 3 file(s) and 6 API call(s): 1 excluded by pattern, 1 binary, 1 whitespace-only."
+            in capsys.readouterr().out
         )
+
+
+def test_main_with_commit_range(mock_subprocess_popen, mock_feedback_response, mock_openai_client):
+    """
+    Test main function when --from-ref is passed: the combined changes of the range are reviewed.
+    """
+    # Arrange
+    mock_subprocess_popen.return_value = git_process(
+        stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\n+print('Hello')\n",
+    )
+    mock_feedback_response.return_value.get_feedback.return_value = []
+
+    # Act
+    result = main(["--no-daemon", "--from-ref", "origin/main", "--to-ref", "feature"])
+
+    # Assert
+    assert result == EXIT_CODE_SUCCESS
+    assert mock_subprocess_popen.call_args.args[0] == ["git", "diff", "origin/main...feature"]
+    assert mock_feedback_response.return_value.get_feedback.call_count == 1
+
+
+def test_main_per_commit(mock_feedback_response, mock_openai_client, capsys):
+    """
+    Test main function when --per-commit is passed: every commit is reviewed on its own, labelled with it.
+    """
+    # Arrange
+    [diff_file] = parse_diff(["diff --git a/file1.py b/file1.py", "@@ -1 +1 @@", "+print('Hello')"])
+    commits = [CommitDiff("a" * 40, [diff_file], ["id"], {"file1.py"}), CommitDiff("b" * 40, [], [], {"file1.py"})]
+    mock_feedback_response.return_value.get_feedback.return_value = ["Use logging"]
+
+    # Act
+    with patch("utils.commit_range.CommitRangeReader") as mock_reader:
+        mock_reader.return_value.read.return_value = iter(commits)
+        mock_reader.return_value.duplicates = [("b" * 40, "file1.py")]
+        result = main(["--no-daemon", "--from-ref", "origin/main", "--per-commit"])
+
+    # Assert
+    assert result == EXIT_CODE_FAIL
+    assert mock_reader.call_args.args == ("origin/main", "HEAD")
+    output = capsys.readouterr().out
+    assert "review Feedback for: aaaaaaaaaaaa:file1.py" in output
+    assert "Skipped 1 file change(s) already made by an earlier commit of the range." in output
+
+
+def test_main_per_commit_needs_from_ref(mock_openai_client):
+    """
+    Test main function when --per-commit is passed without a range.
+    """
+    with pytest.raises(SystemExit):
+        main(["--per-commit"])
+
+
+def test_main_with_context_file(mock_subprocess_popen, mock_openai_client, tmp_path):
+    """
+    Test main function when --context-file is passed: the file starts the instructions of every request.
+    """
+    # Arrange
+    mock_subprocess_popen.return_value = git_process(
+        stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\n+print('Hello')\n",
+    )
+    mock_openai_client.responses.create.return_value = MagicMock(output_text="OK")
+    context_path = tmp_path / "STYLE.md"
+    context_path.write_text("Prefer f-strings.\n")
+
+    # Act
+    result = main(["--no-cache", "--no-daemon", "--context-file", str(context_path)])
+
+    # Assert
+    assert result == EXIT_CODE_SUCCESS
+    assert "Prefer f-strings." in mock_openai_client.responses.create.call_args.kwargs["instructions"]
+
+
+def test_main_with_missing_context_file(mock_openai_client, tmp_path):
+    """
+    Test main function when the --context-file cannot be read.
+    """
+    with pytest.raises(SystemExit):
+        main(["--context-file", str(tmp_path / "missing.md")])
+
+
+@pytest.mark.parametrize(("policy", "expected"), [("fail", EXIT_CODE_FAIL), ("pass", EXIT_CODE_SUCCESS)])
+def test_main_with_deadline(mock_subprocess_popen, mock_openai_client, capsys, policy, expected):
+    """
+    Test main function when --deadline is reached: the slow request times out and the reviewed files are listed.
+    """
+    # Arrange
+    mock_subprocess_popen.return_value = git_process(
+        stdout=(
+            "diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\n+print('Hello')\n"
+            "diff --git a/slow.py b/slow.py\n@@ -1 +1 @@\n+print('World')\n"
+        ),
+    )
+
+    def create(input, timeout, **kwargs):
+        if "slow.py" in input:
+            time.sleep(timeout)
+            raise APITimeoutError(httpx.Request("POST", "https://api.openai.com/v1/responses"))
+        return MagicMock(output_text="OK")
+
+    mock_openai_client.responses.create.side_effect = create
+
+    # Act
+    result = main(["--no-cache", "--review-whitespace-only", "--deadline", "0.2", "--on-timeout", policy])
+
+    # Assert
+    assert result == expected
+    output = capsys.readouterr().out
+    assert "Deadline of 0.2s reached: 1 file(s) reviewed, 1 timed out." in output
+    assert "Reviewed:\n  file1.py\nTimed out:\n  slow.py" in output
+
+
+def test_main_with_cluster(mock_subprocess_popen, mock_feedback_response, mock_openai_client, capsys):
+    """
+    Test main function when --cluster is passed: files with the same change are reviewed once.
+    """
+    # Arrange
+    mock_subprocess_popen.return_value = git_process(
+        stdout=(
+            "diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\n-import old\n+import new\n"
+            "diff --git a/file2.py b/file2.py\n@@ -5 +5 @@\n-import old\n+import  new\n"
+            "diff --git a/file3.py b/file3.py\n@@ -1 +1 @@\n+print('Hello')\n"
+        ),
+    )
+    mock_feedback_response.return_value.get_feedback.return_value = ["Unused import"]
+
+    # Act
+    result = main(["--no-daemon", "--review-whitespace-only", "--cluster"])
+
+    # Assert
+    assert result == EXIT_CODE_FAIL
+    assert mock_feedback_response.return_value.get_feedback.call_count == 2
+    output = capsys.readouterr().out
+    assert "review Feedback for: file1.py, file2.py\nUnused import" in output
+    assert "review Feedback for: file3.py\nUnused import" in output
+    assert "Clustered 2 file(s) with the same change into 1 cluster(s)" in output
+
+
+def test_main_with_triage(mock_subprocess_popen, mock_feedback_response, mock_openai_client, capsys):
+    """
+    Test main function when --triage is passed: SECURITY is only requested for the files that need it.
+    """
+    # Arrange
+    mock_subprocess_popen.return_value = git_process(
+        stdout=(
+            "diff --git a/README.md b/README.md\n@@ -1 +1 @@\n-Teh app\n+The app\n"
+            "diff --git a/app.js b/app.js\n@@ -1 +1 @@\n-el.textContent = html\n+el.innerHTML = html\n"
+        ),
+    )
+    mock_feedback_response.return_value.get_feedback.return_value = []
+
+    # Act
+    result = main(["--no-daemon", "--review-whitespace-only", "--security", "--triage"])
+
+    # Assert
+    assert result == EXIT_CODE_SUCCESS
+    requests = [
+        (input.split("\n", 1)[0], feedback_type)
+        for input, feedback_type in (
+            call.args for call in mock_feedback_response.return_value.get_feedback.call_args_list
+        )
+    ]
+    assert sorted(requests, key=str) == sorted(
+        [
+            ("diff --git a/README.md b/README.md", FeedbackType.REVIEW),
+            ("diff --git a/app.js b/app.js", FeedbackType.REVIEW),
+            ("diff --git a/app.js b/app.js", FeedbackType.SECURITY),
+        ],
+        key=str,
+    )
+    assert "Triage: requested SECURITY for 1 of 2 file(s)." in capsys.readouterr().out
+
+
+def test_main_with_stats_json(mock_subprocess_popen, mock_openai_client, tmp_path, capsys):
+    """
+    Test main function when --stats and --stats-json are passed.
+    """
+    # Arrange
+    mock_subprocess_popen.return_value = git_process(
+        stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\n+print('Hello')\n",
+    )
+    mock_openai_client.responses.create.return_value = MagicMock(
+        output_text="OK",
+        usage=MagicMock(input_tokens=120, output_tokens=1, input_tokens_details=MagicMock(cached_tokens=0)),
+    )
+    stats_path = tmp_path / "stats.json"
+
+    # Act
+    result = main(["--no-cache", "--stats", "--stats-json", str(stats_path)])
+
+    # Assert
+    assert result == EXIT_CODE_SUCCESS
+    assert "Review stats: 1 call(s), 0 error(s)" in capsys.readouterr().out
+    stats = json.loads(stats_path.read_text())
+    assert stats["calls"][0]["file"] == "file1.py"
+    assert stats["calls"][0]["feedback_type"] == "REVIEW"
+    assert stats["calls"][0]["input_tokens"] == 120
+    assert {"git diff", "parsing", "review", "output"} <= set(stats["phases"])
+
+
+def test_main_uses_review_daemon(mock_subprocess_popen, mock_openai_client, tmp_path, capsys):
+    """
+    Test main function when a review daemon is running: the review is handed over to it.
+    """
+    # Arrange
+    mock_subprocess_popen.return_value = git_process(
+        stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\n+print('Hello')\n",
+    )
+    socket_path = tmp_path / "daemon.sock"
+    server = ReviewServer(socket_path, MockAIConsumer())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Act
+    try:
+        result = main(["--socket", str(socket_path)])
+    finally:
+        server.shutdown()
+        server.close()
+
+    # Assert
+    assert result == EXIT_CODE_FAIL
+    assert "review Feedback for: file1.py\nFeedback 1\nFeedback 2\n" in capsys.readouterr().out
+    mock_openai_client.responses.create.assert_not_called()
+
+
+def test_main_uses_review_daemon_of_cache_dir(mock_subprocess_popen, mock_openai_client, tmp_path, monkeypatch, capsys):
+    """
+    Test main function finds the review daemon listening in the cache directory given by --cache-dir.
+    """
+    # Arrange
+    monkeypatch.delenv("AI_REVIEW_SOCKET", raising=False)
+    mock_subprocess_popen.return_value = git_process(
+        stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\n+print('Hello')\n",
+    )
+    server = ReviewServer(tmp_path / "cache" / "daemon.sock", MockAIConsumer())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Act
+    try:
+        result = main(["--cache-dir", str(tmp_path / "cache")])
+    finally:
+        server.shutdown()
+        server.close()
+
+    # Assert
+    assert result == EXIT_CODE_FAIL
+    assert "review Feedback for: file1.py\nFeedback 1\nFeedback 2\n" in capsys.readouterr().out
+    mock_openai_client.responses.create.assert_not_called()
+
+
+def test_main_without_unix_sockets(mock_subprocess_popen, mock_openai_client, monkeypatch):
+    """
+    Test main function reviews in process on platforms without Unix sockets.
+    """
+    # Arrange
+    monkeypatch.delattr("socket.AF_UNIX")
+    mock_openai_client.responses.create.return_value = MagicMock(output_text="OK")
+    mock_subprocess_popen.return_value = git_process(
+        stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\n+print('Hello')\n",
+    )
+
+    # Act
+    result = main(["--no-cache"])
+
+    # Assert
+    assert result == EXIT_CODE_SUCCESS
+    mock_openai_client.responses.create.assert_called_once()
+
+
+def test_main_records_history(mock_subprocess_popen, mock_openai_client, tmp_path, capsys):
+    """
+    Test main function records the calls in the review history, listed by `ai-review stats`.
+    """
+    # Arrange
+    mock_subprocess_popen.return_value = git_process(
+        stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\n+print('Hello')\n",
+    )
+    mock_openai_client.responses.create.return_value = MagicMock(
+        output_text="OK",
+        usage=MagicMock(input_tokens=120, output_tokens=1, input_tokens_details=MagicMock(cached_tokens=0)),
+    )
+
+    # Act
+    with (
+        patch("hooks.main.git_toplevel", return_value="/repo"),
+        patch("hooks.stats.git_toplevel", return_value="/repo"),
+    ):
+        result = main([])
+        capsys.readouterr()
+        stats_result = main(["stats", "--limit", "1"])
+
+    # Assert
+    assert result == EXIT_CODE_SUCCESS
+    assert stats_result == EXIT_CODE_SUCCESS
+    out = capsys.readouterr().out
+    assert "Slowest paths:\n  file1.py: 1 call(s)" in out
+    assert "Most expensive paths:\n  file1.py: 1 call(s)" in out
+    assert "120 input / 1 output tokens" in out
+
+
+@pytest.mark.parametrize("option", ["--no-history", "--no-cache"])
+def test_main_with_no_history(mock_subprocess_popen, mock_openai_client, capsys, option):
+    """
+    Test main function does not record the calls with --no-history, nor with --no-cache.
+    """
+    # Arrange
+    mock_subprocess_popen.return_value = git_process(
+        stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\n+print('Hello')\n",
+    )
+    mock_openai_client.responses.create.return_value = MagicMock(output_text="OK")
+
+    # Act
+    with (
+        patch("hooks.main.git_toplevel", return_value="/repo"),
+        patch("hooks.stats.git_toplevel", return_value="/repo"),
+    ):
+        result = main([option])
+        stats_result = main(["stats"])
+
+    # Assert
+    assert result == EXIT_CODE_SUCCESS
+    assert stats_result == EXIT_CODE_SUCCESS
+    assert "No review history for /repo." in capsys.readouterr().out
+
+
+@pytest.mark.parametrize(("args", "longest_first"), [([], False), (["--longest-first"], True)])
+def test_main_longest_first(mock_subprocess_popen, mock_feedback_response, mock_openai_client, args, longest_first):
+    """
+    Test main function only reads every file before starting the longest requests with --longest-first,
+    so that requests are otherwise sent while git is still writing the diff.
+    """
+    # Arrange
+    mock_subprocess_popen.return_value = git_process(
+        stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\n+print('Hello')\n",
+    )
+    mock_feedback_response.return_value.get_feedback.return_value = []
+
+    # Act
+    with (
+        patch("hooks.main.git_toplevel", return_value="/repo"),
+        patch("hooks.main.ReviewDispatcher", wraps=ReviewDispatcher) as dispatcher,
+    ):
+        result = main(["--no-daemon", *args])
+
+    # Assert
+    assert result == EXIT_CODE_SUCCESS
+    assert (dispatcher.call_args.kwargs["predict_duration"] is not None) == longest_first
+
+
+def test_main_longest_first_needs_history():
+    """
+    Test main function refuses --longest-first without the review history.
+    """
+    with pytest.raises(SystemExit):
+        main(["--longest-first", "--no-cache"])
+
+
+def test_main_with_batch(mock_subprocess_popen, tmp_path, monkeypatch, capsys):
+    """
+    Test main function with --batch: the requests are submitted as a batch, and its feedback fails the hook.
+    """
+    # Arrange
+    mock_subprocess_popen.return_value = git_process(
+        stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\n+print('Hello')\n",
+    )
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+
+    # Act
+    with FakeResponsesServer(FakeBackend(response_lines=1, line_length=12)) as server:
+        result = main(["--security", "--batch", "--batch-poll-interval", "0.01", "--base-url", server.base_url])
+
+    # Assert
+    assert result == EXIT_CODE_FAIL
+    out = capsys.readouterr().out
+    assert "review Feedback for: file1.py\n1. Consider ren\nsecurity Feedback for: file1.py\n1. Consider ren\n" in out
+    assert "Batch batch_0 completed: 2 request(s) answered." in out
+    assert len(server.batches) == 1
+
+
+def test_main_batch_cannot_have_a_deadline(mock_openai_client):
+    """
+    Test main function rejects --batch with --deadline.
+    """
+    with pytest.raises(SystemExit):
+        main(["--batch", "--deadline", "10"])
+
+
+def test_main_with_filenames(
+    mock_subprocess_popen, mock_subprocess_numstat, mock_feedback_response, mock_openai_client
+):
+    """
+    Test main function when pre-commit passes its shard of the files: only their changes are reviewed.
+    """
+    # Arrange
+    mock_subprocess_popen.return_value = git_process(
+        stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\n+print('Hello')\n",
+    )
+    mock_feedback_response.return_value.get_feedback.return_value = []
+
+    # Act
+    result = main(["--no-cache", "file1.py", "dir/file 2.py"])
+
+    # Assert
+    assert result == EXIT_CODE_SUCCESS
+    pathspec = ["--", ":(literal)file1.py", ":(literal)dir/file 2.py"]
+    assert mock_subprocess_popen.call_args.args[0] == ["git", "diff", "--staged", *pathspec]
+    [numstat] = [call.args[0] for call in mock_subprocess_numstat.call_args_list if "--numstat" in call.args[0]]
+    assert numstat[-3:] == pathspec
+
+
+@pytest.mark.parametrize("file_name", ["stats", "watch", "serve"])
+def test_main_with_filenames_of_subcommands(
+    file_name, mock_subprocess_popen, mock_subprocess_numstat, mock_feedback_response, mock_openai_client
+):
+    """
+    Test main function when pre-commit passes a staged file named like a subcommand after `--`: it is reviewed.
+    """
+    # Arrange
+    mock_subprocess_popen.return_value = git_process(
+        stdout=f"diff --git a/{file_name} b/{file_name}\n@@ -1 +1 @@\n+Hello\n",
+    )
+    mock_subprocess_numstat.return_value.stdout = f"1\t1\t{file_name}\0"
+    mock_feedback_response.return_value.get_feedback.return_value = []
+
+    # Act
+    result = main(["--no-cache", "--", file_name, "a.py"])
+
+    # Assert
+    assert result == EXIT_CODE_SUCCESS
+    assert mock_subprocess_popen.call_args.args[0][-2:] == [f":(literal){file_name}", ":(literal)a.py"]
+    assert mock_feedback_response.return_value.get_feedback.call_count == 1
+
+
+def test_main_dry_run(mock_subprocess_popen, mock_openai_client, capsys):
+    """
+    Test main function when --dry-run is passed: the review is estimated without making any request.
+    """
+    # Arrange
+    mock_subprocess_popen.return_value = git_process(
+        stdout="diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\n+print('Hello')\n",
+    )
+
+    # Act
+    result = main(["--security", "--dry-run"])
+
+    # Assert
+    assert result == EXIT_CODE_SUCCESS
+    mock_openai_client.responses.create.assert_not_called()
+    output = capsys.readouterr().out
+    assert "Dry run: 1 file(s), 2 call(s)" in output
+    assert "  file1.py: 2 call(s)" in output
+
+
+def test_main_over_budget(mock_subprocess_popen, mock_openai_client, capsys):
+    """
+    Test main function when the files do not fit in --max-input-tokens: source files are reviewed before
+    tests, and the rest are reported as unreviewed.
+    """
+    # Arrange
+    mock_openai_client.responses.create.return_value = MagicMock(output_text="")
+    mock_subprocess_popen.return_value = git_process(
+        stdout=(
+            "diff --git a/test_file1.py b/test_file1.py\n@@ -1 +1 @@\n+assert True\n"
+            "diff --git a/file1.py b/file1.py\n@@ -1 +1 @@\n+print('Hello')\n"
+        ),
+    )
+
+    # Act
+    result = main(["--no-daemon", "--no-cache", "--review-whitespace-only", "--max-input-tokens", "100"])
+
+    # Assert
+    assert result == EXIT_CODE_SUCCESS
+    [request] = mock_openai_client.responses.create.call_args_list
+    assert "file1.py" in request.kwargs["input"]
+    output = capsys.readouterr().out
+    assert "Budget of 100 input tokens exceeded: 1 file(s) selected" in output
+    assert "Over budget:\n  test_file1.py\n" in output
@@ -1,16 +1,22 @@
+import threading
+import time
+from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
+import httpx
 import pytest
-from openai import OpenAIError
+from openai import APITimeoutError, BadRequestError, InternalServerError, OpenAIError, RateLimitError
 
-from utils.openai_consumer import OpenAIConsumer
+from utils.openai_consumer import OpenAIConsumer, retry_after
+from utils.protocols import ReviewCancelled, ReviewTimedOut
+from utils.stats import RunStats
 
 # utils/test_openai_consumer.py
 
 
 @pytest.fixture
 def mock_openai_client():
-    with patch("utils.openai_consumer.OpenAI") as MockOpenAI:
+    with patch("openai.OpenAI") as MockOpenAI:
         mock_client = MockOpenAI.return_value
         yield mock_client
 
@@ -47,3 +53,230 @@ def test_generate_text_error(mock_openai_client):
     mock_openai_client.responses.create.assert_called_once_with(
         model="gpt-4o-mini", instructions="Write a story", input="Once upon a time"
     )
+
+
+def api_error(error_class, status_code: int, headers: dict[str, str] | None = None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/responses")
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return error_class("API error", response=response, body=None)
+
+
+def test_generate_text_retries_transient_errors(mock_openai_client):
+    """
+    Test that rate limit and server errors are retried until the call succeeds, and retries are recorded.
+    """
+    # Arrange
+    mock_openai_client.responses.create.side_effect = [
+        api_error(RateLimitError, 429, {"retry-after-ms": "10"}),
+        api_error(InternalServerError, 503),
+        MagicMock(output_text="Generated text"),
+    ]
+    stats = RunStats()
+    consumer = OpenAIConsumer(stats=stats, backoff_base=0.01)
+
+    # Act
+    result = consumer.generate_text(instructions="Write a poem", input="Roses are red", model="gpt-4o-mini")
+
+    # Assert
+    assert result == "Generated text"
+    assert mock_openai_client.responses.create.call_count == 3
+    assert stats.calls[0].retries == 2
+    assert stats.calls[0].error is None
+
+
+def test_generate_text_does_not_retry_permanent_errors(mock_openai_client):
+    """
+    Test that client errors other than rate limits fail right away.
+    """
+    # Arrange
+    mock_openai_client.responses.create.side_effect = api_error(BadRequestError, 400)
+    consumer = OpenAIConsumer(backoff_base=0.01)
+
+    # Act & Assert
+    with pytest.raises(RuntimeError, match="Error generating text: API error"):
+        consumer.generate_text(instructions="Write a story", input="Once upon a time", model="gpt-4o-mini")
+    assert mock_openai_client.responses.create.call_count == 1
+
+
+def test_generate_text_gives_up_after_max_retries(mock_openai_client):
+    """
+    Test that a call failing with transient errors fails once it runs out of retries.
+    """
+    # Arrange
+    mock_openai_client.responses.create.side_effect = api_error(InternalServerError, 500)
+    stats = RunStats()
+    consumer = OpenAIConsumer(stats=stats, max_retries=2, backoff_base=0.01)
+
+    # Act & Assert
+    with pytest.raises(RuntimeError, match="Error generating text"):
+        consumer.generate_text(instructions="Write a story", input="Once upon a time", model="gpt-4o-mini")
+    assert mock_openai_client.responses.create.call_count == 3
+    assert stats.calls[0].retries == 2
+    assert stats.calls[0].error == "API error"
+
+
+def test_generate_text_respects_retry_deadline(mock_openai_client):
+    """
+    Test that a Retry-After past the retry deadline fails the call instead of waiting.
+    """
+    # Arrange
+    mock_openai_client.responses.create.side_effect = api_error(RateLimitError, 429, {"retry-after": "120"})
+    consumer = OpenAIConsumer(retry_deadline=60)
+
+    # Act & Assert
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match="Error generating text"):
+        consumer.generate_text(instructions="Write a story", input="Once upon a time", model="gpt-4o-mini")
+    assert time.monotonic() - start < 1
+    assert mock_openai_client.responses.create.call_count == 1
+
+
+@pytest.mark.parametrize(
+    ("headers", "expected"),
+    [
+        ({"retry-after-ms": "1500"}, 1.5),
+        ({"retry-after": "2"}, 2.0),
+        ({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}, 0.0),
+        ({"retry-after": "soon"}, None),
+        ({}, None),
+    ],
+)
+def test_retry_after(headers, expected):
+    """
+    Test that Retry-After is read in milliseconds, seconds or as an HTTP date.
+    """
+    assert retry_after(api_error(RateLimitError, 429, headers)) == expected
+
+
+def event_stream(events):
+    stream = MagicMock()
+    stream.__enter__.return_value = iter(events)
+    return stream
+
+
+def test_generate_text_stream(mock_openai_client):
+    """
+    Test that streamed text deltas are joined, and the usage is read from the completed response.
+    """
+    # Arrange
+    usage = SimpleNamespace(input_tokens=10, output_tokens=2, input_tokens_details=None)
+    mock_openai_client.responses.create.return_value = event_stream(
+        [
+            SimpleNamespace(type="response.created"),
+            SimpleNamespace(type="response.output_text.delta", delta="Generated "),
+            SimpleNamespace(type="response.output_text.delta", delta="text"),
+            SimpleNamespace(type="response.completed", response=SimpleNamespace(usage=usage)),
+        ]
+    )
+    stats = RunStats()
+    consumer = OpenAIConsumer(stats=stats, stream=True)
+
+    # Act
+    result = consumer.generate_text(instructions="Write a poem", input="Roses are red", model="gpt-4o-mini")
+
+    # Assert
+    assert result == "Generated text"
+    mock_openai_client.responses.create.assert_called_once_with(
+        model="gpt-4o-mini", instructions="Write a poem", input="Roses are red", stream=True
+    )
+    assert stats.calls[0].output_tokens == 2
+
+
+def test_generate_text_stream_error(mock_openai_client):
+    """
+    Test that an error event fails the call.
+    """
+    # Arrange
+    mock_openai_client.responses.create.return_value = event_stream(
+        [SimpleNamespace(type="error", message="Server overloaded")]
+    )
+    consumer = OpenAIConsumer(stream=True)
+
+    # Act & Assert
+    with pytest.raises(RuntimeError, match="Error generating text: Server overloaded"):
+        consumer.generate_text(instructions="Write a story", input="Once upon a time", model="gpt-4o-mini")
+
+
+def test_generate_text_stream_cancelled(mock_openai_client):
+    """
+    Test that setting the cancel event stops reading the stream, and the cancelled call is recorded.
+    """
+    # Arrange
+    cancel_event = threading.Event()
+
+    def events():
+        yield SimpleNamespace(type="response.output_text.delta", delta="Generated ")
+        cancel_event.set()
+        yield SimpleNamespace(type="response.output_text.delta", delta="text")
+        pytest.fail("The stream was read after the call was cancelled")
+
+    mock_openai_client.responses.create.return_value = event_stream(events())
+    stats = RunStats()
+    consumer = OpenAIConsumer(stats=stats, stream=True, cancel_event=cancel_event)
+
+    # Act & Assert
+    with pytest.raises(ReviewCancelled):
+        consumer.generate_text(instructions="Write a story", input="Once upon a time", model="gpt-4o-mini")
+    assert stats.calls[0].error == "cancelled"
+
+
+def test_generate_text_cancelled_before_call(mock_openai_client):
+    """
+    Test that no call is made once the review is cancelled.
+    """
+    # Arrange
+    cancel_event = threading.Event()
+    cancel_event.set()
+    consumer = OpenAIConsumer(cancel_event=cancel_event)
+
+    # Act & Assert
+    with pytest.raises(ReviewCancelled):
+        consumer.generate_text(instructions="Write a story", input="Once upon a time", model="gpt-4o-mini")
+    mock_openai_client.responses.create.assert_not_called()
+
+
+def test_generate_text_times_out_at_deadline(mock_openai_client):
+    """
+    Test that every request times out at the deadline, and a request cut short by it is not retried.
+    """
+    # Arrange
+    mock_openai_client.responses.create.side_effect = APITimeoutError(
+        httpx.Request("POST", "https://api.openai.com/v1/responses")
+    )
+    stats = RunStats()
+    consumer = OpenAIConsumer(stats=stats, backoff_base=0.01, deadline=time.monotonic() + 30)
+
+    # Act & Assert
+    with pytest.raises(ReviewTimedOut):
+        consumer.generate_text(instructions="Write a story", input="Once upon a time", model="gpt-4o-mini")
+    assert mock_openai_client.responses.create.call_count == 1
+    assert 29 < mock_openai_client.responses.create.call_args.kwargs["timeout"] <= 30
+    assert stats.calls[0].error == "timed out"
+
+
+def test_generate_text_after_deadline(mock_openai_client):
+    """
+    Test that no call is made once the deadline has passed.
+    """
+    # Arrange
+    consumer = OpenAIConsumer(deadline=time.monotonic())
+
+    # Act & Assert
+    with pytest.raises(ReviewTimedOut, match="Review deadline reached"):
+        consumer.generate_text(instructions="Write a story", input="Once upon a time", model="gpt-4o-mini")
+    mock_openai_client.responses.create.assert_not_called()
+
+
+def test_client_is_built_on_first_call():
+    """
+    Test that the OpenAI client is only built when a call is made, and then reused.
+    """
+    with patch("openai.OpenAI") as MockOpenAI:
+        MockOpenAI.return_value.responses.create.return_value = MagicMock(output_text="OK")
+        consumer = OpenAIConsumer(base_url="http://localhost/v1", api_key="test")
+        MockOpenAI.assert_not_called()
+
+        consumer.generate_text(instructions="Review", input="diff", model="gpt-4o-mini")
+        consumer.generate_text(instructions="Review", input="diff", model="gpt-4o-mini")
+
+    MockOpenAI.assert_called_once_with(base_url="http://localhost/v1", api_key="test", max_retries=0)
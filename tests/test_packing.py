@@ -0,0 +1,43 @@
+from utils.packing import FILE_HEADER_TOKENS, pack_files
+from utils.tokens import estimate_tokens
+
+
+def test_pack_small_files_together():
+    """
+    Test that consecutive small files are packed together up to the token budget, keeping their order.
+    """
+    files = [(f"file{index}.py", ["import os"]) for index in range(5)]
+    file_tokens = estimate_tokens("import os") + FILE_HEADER_TOKENS
+
+    packs = list(pack_files(files, token_budget=file_tokens * 2))
+
+    assert packs == [files[0:2], files[2:4], files[4:5]]
+
+
+def test_pack_large_file_alone():
+    """
+    Test that a file larger than the token budget, or split in chunks, always gets a pack of its own.
+    """
+    small = ("small.py", ["import os"])
+    large = ("large.py", ["x = 1\n" * 1000])
+    chunked = ("chunked.py", ["x = 1", "y = 2"])
+
+    packs = list(pack_files([small, large, small, chunked, small], token_budget=100))
+
+    assert packs == [[small], [large], [small], [chunked], [small]]
+
+
+def test_pack_no_files():
+    """
+    Test that no packs are yielded when there are no files.
+    """
+    assert list(pack_files([], token_budget=100)) == []
+
+
+def test_estimate_tokens():
+    """
+    Test that the token estimate counts punctuation and splits long words.
+    """
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("a = b(c)") == 6
+    assert estimate_tokens("extraordinarily") == 4
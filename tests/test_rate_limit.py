@@ -0,0 +1,116 @@
+import json
+import threading
+import time
+
+import pytest
+
+from utils.protocols import ReviewCancelled
+from utils.rate_limit import RateLimiter, TokenBucket
+
+
+def test_token_bucket_invalid_rate():
+    """
+    Test that a bucket needs a positive rate.
+    """
+    with pytest.raises(ValueError, match="Invalid rate: 0"):
+        TokenBucket(0)
+
+
+def test_unlimited_limiter_never_waits():
+    """
+    Test that a limiter without limits lets every request through.
+    """
+    limiter = RateLimiter()
+
+    assert sum(limiter.acquire(1_000_000) for _ in range(100)) < 0.1
+
+
+def test_requests_per_minute():
+    """
+    Test that requests over the per-minute budget wait for the bucket to refill.
+    """
+    limiter = RateLimiter(requests_per_minute=600)
+    limiter.requests.available = 2
+
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.acquire()
+
+    # The third request waits for 1/10s worth of refill
+    assert 0.08 <= time.monotonic() - start < 0.5
+
+
+def test_tokens_per_minute_caps_large_requests():
+    """
+    Test that a request larger than the whole token budget waits for a full bucket instead of forever.
+    """
+    limiter = RateLimiter(tokens_per_minute=6_000)
+    limiter.tokens.available = 5_900
+
+    waited = limiter.acquire(10_000)
+
+    assert 0.5 <= waited < 1.5
+
+
+def test_throttle_delays_next_request():
+    """
+    Test that a Retry-After from the API makes every thread wait before its next request.
+    """
+    limiter = RateLimiter(requests_per_minute=6_000)
+    limiter.throttle(0.1)
+
+    waits = []
+    threads = [threading.Thread(target=lambda: waits.append(limiter.acquire())) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert min(waits) >= 0.08
+
+
+def test_acquire_cancelled_while_waiting():
+    """
+    Test that a request waiting for the bucket to refill stops waiting once the review is cancelled.
+    """
+    limiter = RateLimiter(requests_per_minute=1)
+    limiter.requests.available = 0
+    cancel_event = threading.Event()
+    threading.Timer(0.05, cancel_event.set).start()
+
+    start = time.monotonic()
+    with pytest.raises(ReviewCancelled):
+        limiter.acquire(cancel_event=cancel_event)
+
+    assert time.monotonic() - start < 1
+
+
+def test_budgets_shared_between_processes(tmp_path):
+    """
+    Test that limiters sharing a state file share their budgets, like hooks running in parallel processes.
+    """
+    state_path = tmp_path / "rate_limit.json"
+    first = RateLimiter(requests_per_minute=2, state_path=state_path)
+    second = RateLimiter(requests_per_minute=2, state_path=state_path)
+    cancel_event = threading.Event()
+    cancel_event.set()
+
+    first.acquire()
+    first.acquire()
+
+    # The budget is empty for every process, so the second one would have to wait
+    with pytest.raises(ReviewCancelled):
+        second.acquire(cancel_event=cancel_event)
+    assert RateLimiter(requests_per_minute=2).acquire(cancel_event=cancel_event) == pytest.approx(0, abs=0.01)
+
+
+def test_corrupt_shared_state_is_reset(tmp_path):
+    """
+    Test that a state file that cannot be parsed is replaced by full budgets.
+    """
+    state_path = tmp_path / "rate_limit.json"
+    state_path.write_text("{")
+    limiter = RateLimiter(tokens_per_minute=1_000, state_path=state_path)
+
+    assert limiter.acquire(100) < 0.1
+    assert json.loads(state_path.read_text())["tokens"][0] == pytest.approx(900, abs=1)
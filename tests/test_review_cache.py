@@ -0,0 +1,162 @@
+import os
+import time
+
+import pytest
+
+from utils.review_cache import ReviewCache, normalize_diff
+
+
+@pytest.fixture
+def review_cache(tmp_path):
+    return ReviewCache(tmp_path / "cache", max_entries=2)
+
+
+def test_set_and_get(review_cache):
+    """
+    Test that stored feedback is returned for the same key.
+    """
+    key = ReviewCache.make_key("diff", "REVIEW", "gpt-4o-mini", "instructions")
+    review_cache.set(key, ["Feedback 1"])
+
+    assert review_cache.get(key) == ["Feedback 1"]
+
+
+def test_get_missing_key(review_cache):
+    """
+    Test that a missing key is a cache miss and does not create the cache directory.
+    """
+    assert review_cache.get(ReviewCache.make_key("diff")) is None
+    assert not review_cache.cache_dir.exists()
+
+
+def test_get_stale_entry(review_cache):
+    """
+    Test that entries older than `max_age` are treated as a cache miss and removed.
+    """
+    key = ReviewCache.make_key("diff")
+    review_cache.set(key, [])
+    review_cache.max_age = 0
+    time.sleep(0.01)
+
+    assert review_cache.get(key) is None
+    assert not review_cache._path(key).exists()
+
+
+def test_set_in_full_directory(review_cache, monkeypatch):
+    """
+    Test that feedback that cannot be written is not stored, without an error or a temporary file left behind.
+    """
+    key = ReviewCache.make_key("diff")
+
+    def fail(*args):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr("json.dump", fail)
+    review_cache.set(key, ["Feedback"])
+
+    assert review_cache.get(key) is None
+    assert list(review_cache.cache_dir.rglob("*")) == [review_cache._path(key).parent]
+
+
+def test_set_in_read_only_directory(tmp_path):
+    """
+    Test that feedback is not stored when the cache directory cannot be created.
+    """
+    (tmp_path / "file").write_text("")
+    review_cache = ReviewCache(tmp_path / "file" / "cache")
+    key = ReviewCache.make_key("diff")
+
+    review_cache.set(key, ["Feedback"])
+
+    assert review_cache.get(key) is None
+
+
+def test_get_corrupted_entry(review_cache):
+    """
+    Test that an unreadable entry is treated as a cache miss.
+    """
+    key = ReviewCache.make_key("diff")
+    review_cache.set(key, [])
+    review_cache._path(key).write_text("{not json")
+
+    assert review_cache.get(key) is None
+
+
+def test_prune_removes_least_recently_used(review_cache):
+    """
+    Test that pruning keeps only the most recently used entries.
+    """
+    keys = [ReviewCache.make_key(str(index)) for index in range(3)]
+    now = time.time()
+    for index, key in enumerate(keys):
+        review_cache.set(key, [str(index)])
+        os.utime(review_cache._path(key), (now - 100 + index, now - 100 + index))
+    # Reading the oldest entry makes it the most recently used one
+    review_cache.get(keys[0])
+
+    assert review_cache.prune() == 1
+    assert review_cache.get(keys[1]) is None
+    assert review_cache.get(keys[0]) == ["0"]
+    assert review_cache.get(keys[2]) == ["2"]
+
+
+def test_prune_keeps_other_state(review_cache):
+    """
+    Test that pruning only removes entries, and keeps the other state of the cache directory, like batches.
+    """
+    review_cache.max_entries = 0
+    review_cache.set(ReviewCache.make_key("diff"), [])
+    batch_state = review_cache.cache_dir / "batches" / f"{ReviewCache.make_key('batch')}.json"
+    batch_state.parent.mkdir()
+    batch_state.write_text("{}")
+
+    assert review_cache.prune() == 1
+    assert batch_state.exists()
+
+
+def test_make_key_changes_with_every_part():
+    """
+    Test that every part of the key changes the resulting hash.
+    """
+    base = ReviewCache.make_key("diff", "REVIEW", "gpt-4o-mini", "instructions")
+
+    assert base == ReviewCache.make_key("diff", "REVIEW", "gpt-4o-mini", "instructions")
+    assert base != ReviewCache.make_key("diff", "SECURITY", "gpt-4o-mini", "instructions")
+    assert base != ReviewCache.make_key("diff", "REVIEW", "gpt-4o", "instructions")
+    assert base != ReviewCache.make_key("diff", "REVIEW", "gpt-4o-mini", "other instructions")
+
+
+def test_normalize_diff():
+    """
+    Test that line endings and surrounding blank lines do not change the normalized diff.
+    """
+    assert normalize_diff("\n+line 1\r\n-line 2\n\n") == normalize_diff("+line 1\n-line 2")
+
+
+def test_hits_and_misses(review_cache):
+    """
+    Test that lookups are counted as hits or misses.
+    """
+    key = ReviewCache.make_key("diff")
+    review_cache.get(key)
+    review_cache.set(key, [])
+    review_cache.get(key)
+    review_cache.get(key)
+
+    assert (review_cache.hits, review_cache.misses) == (2, 1)
+
+
+def test_memory_entries(tmp_path):
+    """
+    Test that recently used entries are served from memory, keeping only the configured number of them.
+    """
+    review_cache = ReviewCache(tmp_path / "cache", memory_entries=1)
+    first, second = ReviewCache.make_key("first"), ReviewCache.make_key("second")
+    review_cache.set(first, ["Feedback 1"])
+    review_cache.set(second, ["Feedback 2"])
+
+    for path in review_cache.cache_dir.glob("*/*.json"):
+        path.unlink()
+
+    assert review_cache.get(second) == ["Feedback 2"]
+    assert review_cache.get(first) is None
@@ -0,0 +1,76 @@
+import pytest
+
+from utils.ai_feedback_filter import FeedbackType
+from utils.routing import DEFAULT_MODEL, ModelRouter, Route, input_path
+
+
+def diff(path: str, lines: int = 1) -> str:
+    return f"diff --git a/{path} b/{path}\n" + "\n".join(f"+line {index}" for index in range(lines))
+
+
+def test_parse_route():
+    """
+    Test that every condition of a route is parsed, and that the route formats back to the same spec.
+    """
+    spec = "model=gpt-4.1,types=SECURITY|review,files=*.py|*.js,min-tokens=2000,max-tokens=8000"
+
+    parsed = Route.parse(spec)
+
+    assert parsed.model == "gpt-4.1"
+    assert parsed.feedback_types == {"SECURITY", "REVIEW"}
+    assert parsed.files == ("*.py", "*.js")
+    assert (parsed.min_tokens, parsed.max_tokens) == (2000, 8000)
+    assert Route.parse(parsed.to_spec()).to_spec() == parsed.to_spec()
+
+
+@pytest.mark.parametrize(
+    "spec",
+    ["types=FORMAT", "model=gpt-4.1,types", "model=gpt-4.1,size=10", "model=gpt-4.1,min-tokens=many"],
+)
+def test_parse_invalid_route(spec):
+    """
+    Test that routes without a model, with malformed or unknown conditions are rejected.
+    """
+    with pytest.raises(ValueError):
+        Route.parse(spec)
+
+
+def test_model_for():
+    """
+    Test that the first route matching the feedback type, the file and the input size chooses the model.
+    """
+    router = ModelRouter(
+        [
+            Route.parse("model=nano,types=FORMAT"),
+            Route.parse("model=large,types=SECURITY,min-tokens=100"),
+            Route.parse("model=docs,files=*.md"),
+        ],
+        default_model="small",
+    )
+
+    assert router.model_for(diff("app.py"), FeedbackType.FORMAT) == "nano"
+    assert router.model_for(diff("app.py"), FeedbackType.SECURITY) == "small"
+    assert router.model_for(diff("app.py", lines=100), FeedbackType.SECURITY) == "large"
+    assert router.model_for(diff("docs/README.md"), FeedbackType.REVIEW) == "docs"
+    assert router.model_for("no header", FeedbackType.REVIEW) == "small"
+
+
+def test_router_round_trip():
+    """
+    Test that a router sent to the review daemon chooses the same models.
+    """
+    router = ModelRouter([Route.parse("model=large,types=SECURITY")])
+
+    copy = ModelRouter.from_dict(router.to_dict())
+
+    assert copy.default_model == DEFAULT_MODEL
+    assert copy.model_for(diff("app.py"), FeedbackType.SECURITY) == "large"
+
+
+def test_input_path():
+    """
+    Test that the reviewed path is read from the header of the input, even for deleted files.
+    """
+    assert input_path(diff("src/app.py")) == "src/app.py"
+    assert input_path("diff --git a/old.py b/old.py\ndeleted file mode 100644") == "old.py"
+    assert input_path("===== FILE 0: a.py =====") is None
@@ -0,0 +1,97 @@
+import pytest
+
+from utils.diff_parser import parse_diff
+from utils.skip_rules import SkipReason, SkipRules, matches
+
+DIFF = """diff --git a/src/app.py b/src/app.py
+@@ -1 +1,2 @@
+-x=1
++x = 1
++y = 2
+diff --git a/poetry.lock b/poetry.lock
+@@ -1 +1 @@
+-a
++b
+diff --git a/static/app.min.js b/static/app.min.js
+@@ -1 +1 @@
+-a
++b
+diff --git a/logo.png b/logo.png
+Binary files a/logo.png and b/logo.png differ
+diff --git a/old.py b/old.py
+deleted file mode 100644
+@@ -1 +0,0 @@
+-x = 1
+diff --git a/a.py b/b.py
+similarity index 100%
+rename from a.py
+rename to b.py
+diff --git a/run.sh b/run.sh
+old mode 100644
+new mode 100755
+diff --git a/src/style.py b/src/style.py
+@@ -1 +1 @@
+-x  = 1
++x = 1
+"""
+
+
+@pytest.fixture
+def diff_files():
+    return {diff_file.path: diff_file for diff_file in parse_diff(DIFF.splitlines())}
+
+
+def test_skip_reasons(diff_files):
+    """
+    Test that lockfiles, minified assets, binaries, deletions, renames, mode changes and whitespace-only
+    changes are skipped, and that the other files are reviewed.
+    """
+    rules = SkipRules(whitespace_changes={"src/app.py", "poetry.lock", "static/app.min.js"})
+
+    assert {path: rules.skip_reason(diff_file) for path, diff_file in diff_files.items()} == {
+        "src/app.py": None,
+        "poetry.lock": SkipReason.EXCLUDED,
+        "static/app.min.js": SkipReason.EXCLUDED,
+        "logo.png": SkipReason.BINARY,
+        "old.py": SkipReason.DELETED,
+        "b.py": SkipReason.RENAMED,
+        "run.sh": SkipReason.NO_CONTENT,
+        "src/style.py": SkipReason.WHITESPACE,
+    }
+
+
+def test_skip_configurable_rules(diff_files):
+    """
+    Test the include patterns, the diff size limit and the option to review deleted files.
+    """
+    rules = SkipRules(include=["src/*"], exclude=[], max_diff_lines=2, skip_deleted=False)
+
+    assert rules.skip_reason(diff_files["src/app.py"]) == SkipReason.TOO_LARGE
+    assert rules.skip_reason(diff_files["src/style.py"]) is None
+    assert rules.skip_reason(diff_files["poetry.lock"]) == SkipReason.NOT_INCLUDED
+    assert SkipRules(exclude=[], skip_deleted=False).skip_reason(diff_files["old.py"]) is None
+
+
+def test_filter_and_summary(diff_files):
+    """
+    Test that filtering keeps the reviewed files and summarizes the skipped ones.
+    """
+    rules = SkipRules()
+
+    reviewed = [diff_file.path for diff_file in rules.filter(diff_files.values())]
+
+    assert reviewed == ["src/app.py", "src/style.py"]
+    assert rules.summary(calls_per_file=2) == (
+        "Skipped 6 file(s) and 12 API call(s): 2 excluded by pattern, 1 binary, 1 deleted, "
+        "1 pure rename or copy, 1 no content changes."
+    )
+    assert SkipRules().summary(calls_per_file=1) is None
+
+
+def test_matches():
+    """
+    Test that patterns without a slash match the file name, and the others the whole path.
+    """
+    assert matches("a/b/package-lock.json", ["package-lock.json"])
+    assert matches("docs/generated/api.md", ["docs/*"])
+    assert not matches("src/docs/api.md", ["docs/*"])
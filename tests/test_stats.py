@@ -0,0 +1,187 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from utils.pricing import estimate_cost, model_prices
+from utils.stats import RunStats, call_context
+
+
+def usage(input_tokens: int, output_tokens: int, cached_tokens: int = 0) -> SimpleNamespace:
+    return SimpleNamespace(
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        input_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+    )
+
+
+def test_record_call_uses_call_context():
+    """
+    Test that calls are labelled with the file and feedback type of the enclosing `call_context`.
+    """
+    stats = RunStats()
+
+    with call_context("file1.py", "REVIEW"):
+        record = stats.record_call("gpt-4o-mini", 0.5, usage(1_000, 100, 200))
+    outside = stats.record_call("gpt-4o-mini", 0.1)
+
+    assert (record.file, record.feedback_type) == ("file1.py", "REVIEW")
+    assert (record.input_tokens, record.output_tokens, record.cached_tokens) == (1_000, 100, 200)
+    assert record.cost == pytest.approx((800 * 0.15 + 200 * 0.075 + 100 * 0.60) / 1e6)
+    assert (outside.file, outside.feedback_type, outside.cost) == (None, None, None)
+
+
+def test_record_call_ignores_missing_usage():
+    """
+    Test that usage fields that are not token counts are recorded as unknown.
+    """
+    record = RunStats().record_call("gpt-4o-mini", 0.1, MagicMock())
+
+    assert (record.input_tokens, record.output_tokens, record.cached_tokens) == (None, None, None)
+
+
+def test_call_context_is_per_thread():
+    """
+    Test that concurrent workers label their calls with their own context.
+    """
+    stats = RunStats()
+
+    def work(file_name: str) -> None:
+        with call_context(file_name, "REVIEW"):
+            time.sleep(0.01)
+            stats.record_call("gpt-4o-mini", 0.01)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(work, [f"file{index}.py" for index in range(8)]))
+
+    assert sorted(call.file for call in stats.calls) == sorted(f"file{index}.py" for index in range(8))
+
+
+def test_nested_phases_are_exclusive():
+    """
+    Test that the time of a phase does not include the time of the phases nested in it.
+    """
+    stats = RunStats()
+
+    with stats.phase("review"):
+        time.sleep(0.02)
+        with stats.phase("output"):
+            time.sleep(0.05)
+
+    assert stats.phases["output"] >= 0.05
+    assert 0.02 <= stats.phases["review"] < 0.05
+
+
+def test_timed_only_counts_producing_items():
+    """
+    Test that `timed` records the time spent producing items, not the time spent consuming them.
+    """
+    stats = RunStats()
+
+    def slow_items():
+        for item in range(3):
+            time.sleep(0.01)
+            yield item
+
+    items = []
+    for item in stats.timed(slow_items(), "parsing"):
+        time.sleep(0.02)
+        items.append(item)
+
+    assert items == [0, 1, 2]
+    assert 0.03 <= stats.phases["parsing"] < 0.06
+
+
+def test_summary_and_json(tmp_path):
+    """
+    Test that the summary groups the calls by feedback type and file, and the JSON holds every call.
+    """
+    stats = RunStats()
+    with call_context("file1.py", "REVIEW"):
+        stats.record_call("gpt-4o-mini", 0.5, usage(1_000, 100))
+    with call_context("file2.py", "SECURITY"):
+        stats.record_call("gpt-4o-mini", 0.2, error="API error")
+    stats.cache_hits = 3
+
+    summary = stats.summary()
+    path = tmp_path / "stats.json"
+    stats.write_json(str(path))
+    data = json.loads(path.read_text())
+
+    assert "Review stats: 2 call(s), 1 error(s), 0 retries" in summary
+    assert "Cache: 3 hit(s), 0 miss(es)" in summary
+    assert "  REVIEW: 1 call(s), 0.50s, 1,000 input / 100 output tokens" in summary
+    assert "By model:\n  gpt-4o-mini: 2 call(s), 0.70s" in summary
+    assert "  file2.py: 1 call(s), 0.20s" in summary
+    assert data["totals"]["calls"] == 2
+    assert data["totals"]["input_tokens"] == 1_000
+    assert [call["file"] for call in data["calls"]] == ["file1.py", "file2.py"]
+    assert data["calls"][1]["error"] == "API error"
+
+
+def test_prompt_cache_summary():
+    """
+    Test that the tokens served from the prompt cache of the provider are reported with the latency they save.
+    """
+    stats = RunStats()
+    with call_context("file1.py", "REVIEW"):
+        stats.record_call("gpt-4o-mini", 1.0, usage(2_000, 10))
+    with call_context("file2.py", "REVIEW"):
+        stats.record_call("gpt-4o-mini", 0.5, usage(2_000, 10, cached_tokens=1_536))
+
+    summary = stats.summary()
+
+    assert "Tokens: 4,000 input (1,536 cached)" in summary
+    assert (
+        "Prompt cache: 1 of 2 call(s) hit, 38% of the input tokens cached, 0.50s average latency (1.00s without)"
+        in (summary)
+    )
+    assert "  file2.py: 1 call(s), 0.50s, 2,000 input (1,536 cached) / 10 output tokens" in summary
+
+
+def test_context_savings():
+    """
+    Test that the tokens saved by trimming the context are summed up and listed by file.
+    """
+    stats = RunStats()
+    stats.record_context("small.py", 100, 90)
+    stats.record_context("large.py", 2_000, 500)
+
+    summary = stats.summary()
+
+    assert "Context trimming: 2,100 -> 590 estimated input tokens in 2 file(s)" in summary
+    assert summary.index("  large.py: 2,000 -> 500") < summary.index("  small.py: 100 -> 90")
+    assert stats.to_dict()["context"]["large.py"] == {"before": 2_000, "after": 500}
+
+
+def test_triage_decisions():
+    """
+    Test that the files triage sent to more than REVIEW are listed with the reasons.
+    """
+    stats = RunStats()
+    stats.triage = {
+        "app.py": {"feedback_types": ["REVIEW", "SECURITY"], "reasons": {"SECURITY": "import of pickle on line 1"}},
+        "README.md": {"feedback_types": ["REVIEW"], "reasons": {}},
+    }
+
+    summary = stats.summary()
+
+    assert (
+        "Triage decisions: 1 of 2 file(s) need more than REVIEW\n  app.py: SECURITY (import of pickle on line 1)"
+        in summary
+    )
+    assert stats.to_dict()["triage"]["README.md"]["feedback_types"] == ["REVIEW"]
+
+
+def test_model_prices_match_snapshots():
+    """
+    Test that dated snapshots get the prices of their model, and the longest model name wins.
+    """
+    assert model_prices("gpt-4o-mini-2024-07-18") == model_prices("gpt-4o-mini")
+    assert model_prices("gpt-4o-2024-08-06") == model_prices("gpt-4o")
+    assert model_prices("unknown-model") is None
+    assert estimate_cost("unknown-model", 1_000, 100) is None
+    assert estimate_cost("gpt-4o", 1_000_000, 0) == pytest.approx(2.50)
@@ -0,0 +1,146 @@
+import subprocess
+
+import pytest
+
+from utils.ai_feedback_filter import FeedbackType
+from utils.diff_parser import parse_diff
+from utils.git import staged_diff
+from utils.triage import Triage
+
+ALL_TYPES = [FeedbackType.REVIEW, FeedbackType.SECURITY, FeedbackType.FORMAT]
+
+
+def diff_file(path: str, *lines: str, start: int = 1):
+    """Builds the diff of a file adding the given lines at `start`."""
+    [parsed] = parse_diff(
+        [f"diff --git a/{path} b/{path}", f"@@ -{start},0 +{start},{len(lines)} @@", *(f"+{line}" for line in lines)]
+    )
+    return parsed
+
+
+@pytest.fixture
+def triage():
+    return Triage(ALL_TYPES)
+
+
+def test_docstring_change_only_gets_review(triage):
+    """
+    Test that a change without security relevant code nor formatting issues only gets REVIEW.
+    """
+    source = 'def main():\n    """Runs the token-free app."""\n'
+
+    feedback_types = triage.triage("app.py", diff_file("app.py", '    """Runs the token-free app."""', start=2), source)
+
+    assert feedback_types == [FeedbackType.REVIEW]
+    assert triage.reasons["app.py"] == {}
+
+
+@pytest.mark.parametrize(
+    ("source", "line", "reason"),
+    [
+        ("import subprocess\n", 1, "import of subprocess on line 1"),
+        ("from subprocess import run as go\n\ngo(['ls'])\n", 3, "call to subprocess.run on line 3"),
+        ("cursor.execute(query)\n", 1, "call to cursor.execute on line 1"),
+        ("query = 'SELECT name FROM users WHERE id = %s'\n", 1, "SQL string on line 1"),
+        ("def login(user, password):\n    pass\n", 1, "password on line 1"),
+    ],
+)
+def test_python_security_constructs(triage, source, line, reason):
+    """
+    Test that security relevant Python constructs on the added lines are found on the syntax tree.
+    """
+    lines = source.splitlines()
+    assert triage.security_reason(diff_file("app.py", lines[line - 1], start=line), source) == reason
+
+
+def test_python_security_outside_added_lines(triage):
+    """
+    Test that security relevant code the change does not touch does not trigger a SECURITY pass.
+    """
+    source = "import subprocess\n\nx = 1\n"
+
+    assert triage.security_reason(diff_file("app.py", "x = 1", start=3), source) is None
+
+
+def test_security_tokens(triage):
+    """
+    Test that files without a syntax tree are checked on the tokens of their changed lines, removed ones included.
+    """
+    [removed] = parse_diff(["diff --git a/app.js b/app.js", "@@ -1 +0,0 @@", "-el.textContent = sanitize(html)"])
+
+    assert triage.security_reason(diff_file("app.js", "el.innerHTML = html")) == "innerHTML in added lines"
+    assert triage.security_reason(removed) == "sanitize in removed lines"
+    assert triage.security_reason(diff_file("README.md", "Fix a typo")) is None
+    assert triage.security_reason(diff_file(".github/workflows/ci.yml", "on: push")) == "sensitive path"
+
+
+@pytest.mark.parametrize(
+    ("line", "reason"),
+    [
+        ("x = 1 ", "trailing whitespace"),
+        ("\tx = 1", "tab indentation"),
+        ("x = 1\r", "carriage return"),
+        ("x" * 121, "line longer than 120 characters"),
+        ("x = 1", None),
+    ],
+)
+def test_format_reason(triage, line, reason):
+    """
+    Test that the lint-only check finds formatting issues in the added lines.
+    """
+    assert triage.format_reason(diff_file("app.py", line)) == reason
+
+
+def test_format_reason_missing_newline(triage):
+    """
+    Test that an added last line without a newline needs a FORMAT pass.
+    """
+    [parsed] = parse_diff(["diff --git a/a.py b/a.py", "@@ -0,0 +1 @@", "+x = 1", "\\ No newline at end of file"])
+
+    assert triage.format_reason(parsed) == "no newline at end of file"
+
+
+def test_staged_carriage_returns(triage, git_repository):
+    """
+    Test that the CRLF line endings of a staged file reach triage, and get it FORMAT.
+    """
+    (git_repository / "notes.txt").write_bytes(b"first\r\nsecond\r\n")
+    subprocess.run(["git", "add", "."], check=True)
+    [staged] = staged_diff()
+
+    feedback_types = triage.triage("notes.txt", staged, None)
+
+    assert feedback_types == [FeedbackType.REVIEW, FeedbackType.FORMAT]
+    assert triage.reasons["notes.txt"] == {"FORMAT": "carriage return"}
+
+
+def test_tabs_in_makefile(triage):
+    """
+    Test that tab indentation is expected in Makefiles.
+    """
+    assert triage.format_reason(diff_file("Makefile", "\tpytest")) is None
+
+
+def test_summary(triage):
+    """
+    Test that the summary counts the files that got every gated pass, and the decisions are serializable.
+    """
+    triage.triage("a.py", diff_file("a.py", "import pickle"), "import pickle\n")
+    triage.triage("b.py", diff_file("b.py", "x = 1"), "x = 1\n")
+
+    assert triage.file_feedback_types["a.py"] == [FeedbackType.REVIEW, FeedbackType.SECURITY]
+    assert triage.summary() == "Triage: requested SECURITY for 1 of 2 file(s), FORMAT for 0 of 2 file(s)."
+    assert triage.to_dict()["a.py"] == {
+        "feedback_types": ["REVIEW", "SECURITY"],
+        "reasons": {"SECURITY": "import of pickle on line 1"},
+    }
+
+
+def test_review_only_is_not_triaged():
+    """
+    Test that there is nothing to report when neither SECURITY nor FORMAT is requested.
+    """
+    triage = Triage([FeedbackType.REVIEW])
+
+    assert triage.triage("a.py", diff_file("a.py", "import pickle"), "import pickle\n") == [FeedbackType.REVIEW]
+    assert triage.summary() is None
@@ -0,0 +1,116 @@
+import argparse
+import os
+import subprocess
+import threading
+
+import pytest
+
+from hooks.main import add_consumer_arguments, add_review_arguments
+from hooks.watch import review_round, staged_files
+from tests.test_ai_consumer_feedback_response import MockAIConsumer
+from utils.ai_feedback_filter import AIConsumerFeedbackResponse, FeedbackType
+from utils.git import git_path
+from utils.review_cache import ReviewCache
+from utils.watch import IndexWatcher, SpeculativeReviewer
+
+
+@pytest.fixture
+def args(tmp_path):
+    parser = argparse.ArgumentParser()
+    add_review_arguments(parser)
+    add_consumer_arguments(parser)
+    return parser.parse_args(["--cache-dir", str(tmp_path / "cache")])
+
+
+def stage(path, content: str) -> None:
+    path.write_text(content)
+    subprocess.run(["git", "add", str(path)], check=True)
+
+
+def test_index_watcher_debounce(tmp_path):
+    """
+    Test that a change of the index is only reported once it has stayed unchanged for the debounce time.
+    """
+    index = tmp_path / "index"
+    index.write_text("1")
+    watcher = IndexWatcher(str(index), debounce=2)
+
+    # The index at startup is reviewed too
+    assert watcher.poll(now=watcher._changed_at + 2)
+    assert not watcher.pending
+
+    os.utime(index, ns=(0, 1_000_000_000))
+    assert not watcher.poll(now=100)
+    assert watcher.pending
+    os.utime(index, ns=(0, 2_000_000_000))
+    assert not watcher.poll(now=101)
+    assert not watcher.poll(now=102.5)
+    assert watcher.poll(now=103)
+    assert not watcher.poll(now=110)
+
+
+def test_speculative_review_fills_hook_cache(git_repository, args):
+    """
+    Test that files reviewed ahead of the commit are answered from the cache afterwards.
+    """
+    stage(git_repository / "file1.py", "print('Hello')\n")
+    consumer = MockAIConsumer()
+    cache = ReviewCache(args.cache_dir)
+    reviewer = SpeculativeReviewer(AIConsumerFeedbackResponse(consumer, cache), [FeedbackType.REVIEW])
+    files = staged_files(args)
+
+    reviewed, with_feedback = reviewer.review(files)
+
+    assert reviewed == with_feedback == ["file1.py"]
+    assert AIConsumerFeedbackResponse(consumer, cache).get_feedback(files[0][1][0], FeedbackType.REVIEW) == [
+        "Feedback 1",
+        "Feedback 2",
+    ]
+    assert consumer.calls == 1
+
+
+def test_speculative_review_needs_cache():
+    """
+    Test that reviewing ahead of the commit without a cache is refused.
+    """
+    with pytest.raises(ValueError, match="needs a cache"):
+        SpeculativeReviewer(AIConsumerFeedbackResponse(MockAIConsumer()), [FeedbackType.REVIEW])
+
+
+@pytest.mark.parametrize("combined", [False, True])
+def test_review_round_discards_changed_diffs(git_repository, args, capsys, combined):
+    """
+    Test that the feedback of a file staged again during the review is discarded, and the rest is kept, with
+    combined requests too.
+    """
+    stage(git_repository / "file1.py", "print('Hello')\n")
+    stage(git_repository / "file2.py", "print('Bye')\n")
+
+    class RestagingAIConsumer(MockAIConsumer):
+        def generate_text(self, instructions: str, input: str, model: str) -> str:
+            if "file2.py" in input:
+                stage(git_repository / "file2.py", "print('Bye!')\n")
+            if "Review this code once for each" in instructions:
+                return "OK"
+            return super().generate_text(instructions, input, model)
+
+    cache = ReviewCache(args.cache_dir)
+    feedback_response = AIConsumerFeedbackResponse(RestagingAIConsumer(), cache)
+    feedback_types = [FeedbackType.REVIEW, FeedbackType.SECURITY] if combined else [FeedbackType.REVIEW]
+    reviewer = SpeculativeReviewer(feedback_response, feedback_types, max_workers=1, combined=combined)
+    files = staged_files(args)
+
+    review_round(args, reviewer, threading.Event())
+
+    output = capsys.readouterr().out
+    assert "Reviewed 1 staged file(s) ahead of the commit" in output
+    assert "Discarded the feedback of 1 file(s) changed during the review." in output
+    assert cache.get(feedback_response.cache_key(files[0][1][0], FeedbackType.REVIEW, combined=combined)) is not None
+    assert cache.get(feedback_response.cache_key(files[1][1][0], FeedbackType.REVIEW, combined=combined)) is None
+
+
+def test_git_path(git_repository):
+    """
+    Test that the index path is found from the repository.
+    """
+    assert os.path.abspath(git_path("index")) == str(git_repository / ".git" / "index")
@@ -1,6 +1,9 @@
+import re
 from enum import Enum
 
 from utils.protocols import AIConsumerProtocol
+from utils.review_cache import ReviewCache, normalize_diff
+from utils.routing import DEFAULT_MODEL, ModelRouter
 
 
 class FeedbackType(Enum):
@@ -8,6 +11,11 @@ class FeedbackType(Enum):
     SECURITY = "SECURITY"
     FORMAT = "FORMAT"
 
+    @property
+    def key(self) -> str:
+        """The key used for this feedback type in `get_all_feedback` results."""
+        return self.value.lower()
+
 
 class AIConsumerFeedbackResponse:
     TYPES_OF_FEEDBACK = {
@@ -15,69 +23,338 @@ class AIConsumerFeedbackResponse:
         FeedbackType.SECURITY: "Please review this code security based in OWASP and provide feedback",  # noqa: E501
         FeedbackType.FORMAT: "Please review this code format, based on the best lint and format practices, and provide feedback",  # noqa: E501
     }
+    # Shared by every request, so that it starts the prompt of every call
+    COMMON_INSTRUCTIONS = "Return OK if there is no feedback. Avoid giving general recommendations that are already addressed or that have no action items to be fixed."  # noqa: E501
+    CONTEXT_HEADER = "Repository context to take into account in the review:"
+    SECTION_PATTERN = re.compile(r"^\W*(REVIEW|SECURITY|FORMAT)\W*$")
+    FILE_HEADER = "===== FILE {index}: {file_name} ====="
+    FILE_HEADER_PATTERN = re.compile(r"^\W*FILE (\d+)\b.*=+\W*$")
+
+    def __init__(
+        self,
+        consumer: AIConsumerProtocol,
+        cache: ReviewCache | None = None,
+        router: ModelRouter | None = None,
+        context: str = "",
+    ):
+        """
+        Initializes the AIConsumerFeedbackResponse.
+
+        The instructions of every request start with the same prefix: the common instructions, then the
+        repository context. The prefix is byte-identical across calls and runs, so that the provider can
+        reuse its prompt cache for it, and only the end of the instructions depends on the request.
 
-    def __init__(self, consumer: AIConsumerProtocol):
+        :param consumer: The AI consumer that generates the feedback.
+        :param cache: The feedback cache, if any.
+        :param router: Chooses the model of the requests made without an explicit one (default: always
+            the default model).
+        :param context: Repository-wide context sent with every request, like a style guide.
+        """
         self.consumer = consumer
+        self.cache = cache
+        self.router = router
+        self.context = context.strip()
+        self.prefix = self.COMMON_INSTRUCTIONS + "\n\n"
+        if self.context:
+            self.prefix += f"{self.CONTEXT_HEADER}\n\n{self.context}\n\n"
+
+    def model_for(self, input: str, feedback_type: FeedbackType, model: str | None = None) -> str:
+        """
+        Gets the model of a request: the given one, or the one chosen by the router.
+
+        :param input: The input for the AI consumer.
+        :param feedback_type: The type of feedback requested.
+        :param model: The model requested by the caller, if any.
+        :return: The model.
+        """
+        if model is not None:
+            return model
+        if self.router is None:
+            return DEFAULT_MODEL
+        return self.router.model_for(input, feedback_type)
+
+    def get_feedback(
+        self,
+        input: str,
+        feedback_type: FeedbackType,
+        model: str | None = None,
+    ) -> list[str]:
+        """
+        Get the feedback of the given type from the AI consumer, or from the cache when available.
+        """
+        instructions = self._generate_instructions(feedback_type)
+        model = self.model_for(input, feedback_type, model)
+        if self.cache is None:
+            return self._filter_feedback(instructions=instructions, input=input, model=model)
+
+        key = self.cache_key(input, feedback_type, model)
+        feedback = self.cache.get(key)
+        if feedback is None:
+            feedback = self._filter_feedback(instructions=instructions, input=input, model=model)
+            self.cache.set(key, feedback)
+        return feedback
+
+    def cache_key(
+        self,
+        input: str,
+        feedback_type: FeedbackType,
+        model: str | None = None,
+        combined: bool = False,
+    ) -> str:
+        """
+        Builds the cache key of a feedback request.
+
+        :param input: The input for the AI consumer.
+        :param feedback_type: The type of feedback requested.
+        :param model: The model used for text generation.
+        :param combined: Whether the feedback is a section of a combined request, whose instructions differ
+            from the ones of the feedback type requested on its own.
+        :return: The cache key.
+        """
+        return ReviewCache.make_key(
+            normalize_diff(input),
+            feedback_type.value,
+            self.model_for(input, feedback_type, model),
+            self._generate_instructions(feedback_type),
+            *(("combined",) if combined else ()),
+        )
 
     def get_review_feedback(
         self,
         input: str,
-        model: str = "gpt-4o-mini",
+        model: str | None = None,
     ) -> list[str]:
         """
         Get the review feedback from the AI consumer.
         """
-        return self._filter_feedback(
-            instructions=self._generate_instructions(FeedbackType.REVIEW),
-            input=input,
-            model=model,
-        )
+        return self.get_feedback(input, FeedbackType.REVIEW, model)
 
     def get_security_feedback(
         self,
         input: str,
-        model: str = "gpt-4o-mini",
+        model: str | None = None,
     ) -> list[str]:
         """
         Get the security feedback from the AI consumer.
         """
-        return self._filter_feedback(
-            instructions=self._generate_instructions(FeedbackType.SECURITY),
-            input=input,
-            model=model,
-        )
+        return self.get_feedback(input, FeedbackType.SECURITY, model)
 
     def get_format_feedback(
         self,
         input: str,
-        model: str = "gpt-4o-mini",
+        model: str | None = None,
     ) -> list[str]:
         """
         Get the format feedback from the AI consumer.
         """
-        return self._filter_feedback(
-            instructions=self._generate_instructions(FeedbackType.FORMAT),
-            input=input,
-            model=model,
-        )
+        return self.get_feedback(input, FeedbackType.FORMAT, model)
 
     def get_all_feedback(
         self,
         input: str,
-        model: str = "gpt-4o-mini",
+        model: str | None = None,
         feedback_types: list[FeedbackType] | None = None,
+        combined: bool = False,
     ) -> dict[str, list[str]]:
         """
         Get all feedback from the AI consumer.
+
+        If `combined` is set, all the feedback types are requested with a single call.
         """
         if feedback_types is None:
             feedback_types = [FeedbackType.REVIEW]
+        if combined:
+            return self.get_combined_feedback(input, feedback_types, model)
         return {
             "review": self.get_review_feedback(input, model) if FeedbackType.REVIEW in feedback_types else [],
             "security": self.get_security_feedback(input, model) if FeedbackType.SECURITY in feedback_types else [],
             "format": self.get_format_feedback(input, model) if FeedbackType.FORMAT in feedback_types else [],
         }
 
+    def get_combined_feedback(
+        self,
+        input: str,
+        feedback_types: list[FeedbackType],
+        model: str | None = None,
+    ) -> dict[str, list[str]]:
+        """
+        Get the feedback of several types from a single request to the AI consumer.
+
+        Feedback types cached by an earlier combined request are not requested again, feedback types routed to
+        different models are requested with one call per model, and every section missing from the response is
+        requested on its own with `get_feedback`. Sections are cached apart from the feedback types requested on
+        their own, whose instructions differ.
+
+        :param input: The input for the AI consumer.
+        :param feedback_types: The types of feedback to request.
+        :param model: The model to use for text generation (default: chosen by the router).
+        :return: The feedback, shaped like `get_all_feedback`.
+        """
+        feedback: dict[str, list[str]] = {feedback_type.key: [] for feedback_type in FeedbackType}
+        pending: dict[str, list[FeedbackType]] = {}
+        # Follow the enum order so the combined instructions do not depend on the argument order
+        for feedback_type in FeedbackType:
+            if feedback_type not in feedback_types:
+                continue
+            type_model = self.model_for(input, feedback_type, model)
+            cached = (
+                self.cache.get(self.cache_key(input, feedback_type, type_model, combined=True))
+                if self.cache is not None
+                else None
+            )
+            if cached is None:
+                pending.setdefault(type_model, []).append(feedback_type)
+            else:
+                feedback[feedback_type.key] = cached
+
+        # Feedback types routed to different models are requested with one call per model
+        for type_model, model_pending in pending.items():
+            self._request_combined_feedback(input, model_pending, type_model, feedback)
+        return feedback
+
+    def _request_combined_feedback(
+        self,
+        input: str,
+        pending: list[FeedbackType],
+        model: str,
+        feedback: dict[str, list[str]],
+    ) -> None:
+        """
+        Requests several feedback types of an input with a single call, storing their feedback in `feedback`.
+        """
+        if len(pending) == 1:
+            feedback[pending[0].key] = self.get_feedback(input, pending[0], model)
+            return
+        response = self.consumer.generate_text(self._generate_combined_instructions(pending), input, model)
+        sections = self._split_response(response, self.SECTION_PATTERN)
+        if not self._parse_feedback(response):
+            # A bare OK answers every section at once
+            sections = {feedback_type.value: [] for feedback_type in pending}
+        for feedback_type in pending:
+            if feedback_type.value not in sections:
+                # Malformed or missing section, ask for it on its own
+                feedback[feedback_type.key] = self.get_feedback(input, feedback_type, model)
+                continue
+            feedback[feedback_type.key] = sections[feedback_type.value]
+            if self.cache is not None:
+                self.cache.set(
+                    self.cache_key(input, feedback_type, model, combined=True), sections[feedback_type.value]
+                )
+
+    def get_packed_feedback(
+        self,
+        files: list[tuple[str, str]],
+        feedback_type: FeedbackType,
+        model: str | None = None,
+    ) -> list[list[str]]:
+        """
+        Get the feedback of the given type for several files from a single request to the AI consumer.
+
+        Every file is delimited in the input with a numbered header, which the AI consumer repeats in its
+        response so the feedback can be attributed back to each file. Cached files are not requested
+        again, files routed to different models are requested with one call per model, and every file
+        missing from the response is requested on its own with `get_feedback`.
+
+        :param files: The (file name, file content) pairs to review.
+        :param feedback_type: The type of feedback to request.
+        :param model: The model to use for text generation (default: chosen by the router).
+        :return: The feedback of every file, in the same order as `files`.
+        """
+        models = [self.model_for(input, feedback_type, model) for _, input in files]
+        feedback: list[list[str] | None] = [
+            self.cache.get(self.cache_key(input, feedback_type, file_model)) if self.cache is not None else None
+            for (_, input), file_model in zip(files, models, strict=True)
+        ]
+        pending: dict[str, list[int]] = {}
+        for index, file_feedback in enumerate(feedback):
+            if file_feedback is None:
+                pending.setdefault(models[index], []).append(index)
+
+        # Files routed to different models are requested with one call per model
+        for file_model, indexes in pending.items():
+            self._request_packed_feedback(files, indexes, feedback_type, file_model, feedback)
+        return [file_feedback or [] for file_feedback in feedback]
+
+    def _request_packed_feedback(
+        self,
+        files: list[tuple[str, str]],
+        pending: list[int],
+        feedback_type: FeedbackType,
+        model: str,
+        feedback: list[list[str] | None],
+    ) -> None:
+        """
+        Requests the feedback of several files with a single call, storing it in `feedback` by file index.
+        """
+        if len(pending) == 1:
+            feedback[pending[0]] = self.get_feedback(files[pending[0]][1], feedback_type, model)
+            return
+        input = "\n".join(
+            f"{self.FILE_HEADER.format(index=index, file_name=files[index][0])}\n{files[index][1]}" for index in pending
+        )
+        response = self.consumer.generate_text(self._generate_packed_instructions(feedback_type), input, model)
+        sections = self._split_response(response, self.FILE_HEADER_PATTERN)
+        if not self._parse_feedback(response):
+            # A bare OK answers every file at once
+            sections = {str(index): [] for index in pending}
+        for index in pending:
+            file_input = files[index][1]
+            if str(index) not in sections:
+                # Malformed or missing file, ask for it on its own
+                feedback[index] = self.get_feedback(file_input, feedback_type, model)
+                continue
+            feedback[index] = sections[str(index)]
+            if self.cache is not None:
+                self.cache.set(self.cache_key(file_input, feedback_type, model), sections[str(index)])
+
+    def _generate_packed_instructions(self, feedback_type: FeedbackType) -> str:
+        """
+        Generates the instructions of a single request covering several files.
+
+        :param feedback_type: The type of feedback to generate instructions for.
+        :return: The generated instructions.
+        """
+        return (
+            f"{self._generate_instructions(feedback_type)}\n\nThe input contains several files, each one starting "
+            f"with a header line like `{self.FILE_HEADER.format(index='N', file_name='path')}`. Review every file "
+            "separately. Start the answer of each file with its header line, exactly as it appears in the input, "
+            "and always include every file."
+        )
+
+    def _generate_combined_instructions(self, feedback_types: list[FeedbackType]) -> str:
+        """
+        Generates the instructions of a single request covering several feedback types.
+
+        :param feedback_types: The types of feedback to generate instructions for.
+        :return: The generated instructions.
+        """
+        sections = "\n\n".join(
+            f"### {feedback_type.value}\n{self._task(feedback_type)}" for feedback_type in feedback_types
+        )
+        return (
+            f"{self.prefix}Review this code once for each of the following sections. Start the answer of each "
+            "section with a line containing only its name, in the form `### NAME`, and always include every "
+            "section.\n\n" + sections
+        )
+
+    def _split_response(self, response: str, header_pattern: re.Pattern[str]) -> dict[str, list[str]]:
+        """
+        Splits a response into the feedback found under each header line.
+
+        :param response: The response of the AI consumer.
+        :param header_pattern: The pattern of the header lines, whose first group identifies the section.
+        :return: The parsed feedback of every section found in the response, by its identifier.
+        """
+        sections: dict[str, list[str]] = {}
+        current: list[str] | None = None
+        for line in response.split("\n"):
+            match = header_pattern.match(line.strip())
+            if match:
+                current = sections.setdefault(match.group(1), [])
+            elif current is not None:
+                current.append(line)
+        return {section: self._parse_feedback("\n".join(lines)) for section, lines in sections.items()}
+
     def _generate_instructions(self, feedback_type: FeedbackType) -> str:
         """
         Generates instructions for the AI consumer based on the feedback type.
@@ -85,27 +362,42 @@ class AIConsumerFeedbackResponse:
         :param feedback_type: The type of feedback to generate instructions for.
         :return: The generated instructions.
         """
+        return self.prefix + self._task(feedback_type)
+
+    def _task(self, feedback_type: FeedbackType) -> str:
+        """
+        Gets the part of the instructions specific to a feedback type.
+
+        :param feedback_type: The type of feedback.
+        :return: The instructions of the feedback type.
+        """
         if feedback_type not in self.TYPES_OF_FEEDBACK:
             raise ValueError(f"Invalid feedback type: {feedback_type}")
-        return f"{self.TYPES_OF_FEEDBACK[feedback_type]}. Return OK if there is no feedback. Avoid giving general recommendations that are already addressed or that have no action items to be fixed"  # noqa: E501
+        return f"{self.TYPES_OF_FEEDBACK[feedback_type]}."
 
     def _filter_feedback(
         self,
         instructions: str,
         input: str,
-        model: str = "gpt-4o-mini",
+        model: str = DEFAULT_MODEL,
     ) -> list[str]:
         """
         Filters feedback using the AI consumer.
 
         :param instructions: The instructions for the AI consumer.
         :param input: The input for the AI consumer.
-        :param model: The model to use for text generation (default: "gpt-4o-mini").
+        :param model: The model to use for text generation (default: DEFAULT_MODEL).
         :return: The filtered feedback.
         """
         response = self.consumer.generate_text(instructions, input, model)
-        # Parse the response
-        response = response.split("\n")
+        return self._parse_feedback(response)
+
+    def _parse_feedback(self, response: str) -> list[str]:
+        """
+        Parses the feedback lines of a response.
+
+        :param response: The response of the AI consumer.
+        :return: The lines of the response that contain feedback.
+        """
         # Check if the response contains feedback
-        feedback = [line for line in response if line and line != "OK"]
-        return feedback
+        return [line for line in response.split("\n") if line and line.strip() != "OK"]
@@ -0,0 +1,287 @@
+import json
+import threading
+import time
+from collections.abc import Iterable, Iterator, Mapping
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Final
+
+from utils.ai_feedback_filter import AIConsumerFeedbackResponse, FeedbackType
+from utils.dispatcher import DEFAULT_MAX_WORKERS, ReviewDispatcher
+from utils.protocols import AIConsumerProtocol
+from utils.review_cache import ReviewCache, default_cache_dir
+
+if TYPE_CHECKING:
+    from utils.openai_consumer import OpenAIConsumer
+
+BATCH_DIR = "batches"
+BATCH_ENDPOINT: Final = "/v1/responses"
+COMPLETION_WINDOW: Final = "24h"
+DEFAULT_POLL_INTERVAL = 30.0
+# The state of a batch submitted by a run that never came back is forgotten after this, in seconds
+STATE_MAX_AGE = 7 * 24 * 3600
+# Batches in these states are over, and their output is final
+FINAL_STATUSES = {"completed", "expired", "cancelled", "failed"}
+
+
+class BatchError(RuntimeError):
+    """Raised when a batch cannot be submitted or fails as a whole."""
+
+
+def request_id(instructions: str, input: str, model: str) -> str:
+    """
+    Gets the id of a request in a batch, the same for identical requests.
+
+    :return: The custom id of the request.
+    """
+    return ReviewCache.make_key(model, instructions, input)
+
+
+class BatchRecorder(AIConsumerProtocol):
+    """
+    AI consumer recording the requests of a review instead of making them. Every request is answered
+    with OK, so that the review asks for nothing else.
+    """
+
+    def __init__(self) -> None:
+        # The body of every request, by request id
+        self.requests: dict[str, dict[str, str]] = {}
+        self.lock = threading.Lock()
+
+    def generate_text(self, instructions: str, input: str, model: str) -> str:
+        with self.lock:
+            self.requests[request_id(instructions, input, model)] = {
+                "model": model,
+                "instructions": instructions,
+                "input": input,
+            }
+        return "OK"
+
+
+class BatchConsumer(AIConsumerProtocol):
+    """
+    AI consumer answering the requests of a review from the results of a batch, and making the requests the
+    batch did not answer with the given consumer.
+    """
+
+    def __init__(self, results: Mapping[str, tuple[str, Any]], consumer: "OpenAIConsumer"):
+        """
+        Initializes the BatchConsumer.
+
+        :param results: The generated text and token usage of every answered request, by request id.
+        :param consumer: The consumer making the other requests.
+        """
+        self.results = results
+        self.consumer = consumer
+        self.lock = threading.Lock()
+        self.answered = 0
+        self.requested = 0
+
+    def generate_text(self, instructions: str, input: str, model: str) -> str:
+        result = self.results.get(request_id(instructions, input, model))
+        if result is None:
+            with self.lock:
+                self.requested += 1
+            return self.consumer.generate_text(instructions, input, model)
+        text, usage = result
+        with self.lock:
+            self.answered += 1
+        if self.consumer.stats is not None:
+            # Batch requests have no latency of their own
+            self.consumer.stats.record_call(model, 0.0, usage)
+        return text
+
+
+class BatchReviewer:
+    """
+    Reviews files with the Batch API, for bulk reviews where cost and rate limits matter more than latency.
+
+    The review runs twice. The first run records every request the review needs without making it, nor
+    caching anything, while cached feedback is used as usual. The requests are then written to a JSONL
+    file, submitted as a single batch and polled until the batch is over. The second run answers the
+    requests from the results of the batch, so that the feedback is parsed, merged and cached exactly like
+    a synchronous review. Requests the batch could not answer, and the follow-up requests of malformed
+    responses, are made synchronously.
+
+    The state of every submitted batch is saved on disk, keyed by its requests, so that a run interrupted
+    while polling resumes the same batch when it reviews the same changes again, instead of submitting
+    another one.
+    """
+
+    def __init__(
+        self,
+        feedback_response: AIConsumerFeedbackResponse,
+        consumer: "OpenAIConsumer",
+        cache_dir: Path | str | None = None,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        combined: bool = False,
+        pack_tokens: int = 0,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ):
+        """
+        Initializes the BatchReviewer.
+
+        :param feedback_response: The feedback response whose cache, router and context the review uses.
+        :param consumer: The consumer whose client submits the batch, and that makes the requests the batch
+            did not answer.
+        :param cache_dir: The directory where the state of the batches is saved, in a `batches` subdirectory
+            (default: `default_cache_dir()`).
+        :param max_workers: The maximum number of requests recorded, or made synchronously, at the same time.
+        :param combined: Whether to request all the feedback types of a file with a single request.
+        :param pack_tokens: The token budget used to pack several small files into a single request,
+            or 0 to send one request per file.
+        :param poll_interval: The time between two checks of the status of the batch, in seconds.
+        """
+        self.feedback_response = feedback_response
+        self.consumer = consumer
+        self.state_dir = (Path(cache_dir) if cache_dir is not None else default_cache_dir()) / BATCH_DIR
+        self.max_workers = max_workers
+        self.combined = combined
+        self.pack_tokens = pack_tokens
+        self.poll_interval = poll_interval
+        # The files left without a complete review
+        self.unreviewed: list[str] = []
+        self.batch: dict[str, Any] | None = None
+        self.answered = 0
+        self.requested = 0
+
+    def review(
+        self,
+        files: Iterable[tuple[str, str | list[str]]],
+        feedback_types: list[FeedbackType],
+        file_feedback_types: Mapping[str, list[FeedbackType]] | None = None,
+    ) -> Iterator[tuple[str, dict[str, list[str]]]]:
+        """
+        Reviews every (file, feedback type) pair with a single batch.
+
+        :param files: The (file name, file content or chunks) pairs to review.
+        :param feedback_types: The types of feedback to request for each file.
+        :param file_feedback_types: The types of feedback to request for some files instead, by file name.
+        :return: An iterator of (file name, feedback) pairs, in file order, once the batch is over.
+        :raises BatchError: If the batch cannot be submitted or fails.
+        """
+        files = list(files)
+        recorder = BatchRecorder()
+        cache = self.feedback_response.cache
+        # The placeholder answers of the recorder must not be cached
+        recording_cache = ReviewCache(cache.cache_dir, read_only=True) if cache is not None else None
+        for _ in self._dispatcher(recorder, recording_cache).review(files, feedback_types, file_feedback_types):
+            pass
+
+        results = self.run(recorder.requests) if recorder.requests else {}
+        consumer = BatchConsumer(results, self.consumer)
+        dispatcher = self._dispatcher(consumer, cache)
+        try:
+            yield from dispatcher.review(files, feedback_types, file_feedback_types)
+        finally:
+            self.unreviewed = dispatcher.unreviewed
+            self.answered, self.requested = consumer.answered, consumer.requested
+
+    def run(self, requests: Mapping[str, dict[str, str]]) -> dict[str, tuple[str, Any]]:
+        """
+        Submits the requests as a batch, or resumes the batch already submitted for them, and waits for it.
+
+        :param requests: The body of every request, by request id.
+        :return: The generated text and token usage of every answered request, by request id.
+        :raises BatchError: If the batch cannot be submitted or fails.
+        """
+        from openai import OpenAIError
+
+        lines = [
+            json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": requests[custom_id]})
+            for custom_id in sorted(requests)
+        ]
+        content = ("\n".join(lines) + "\n").encode("utf-8")
+        state_path = self.state_dir / f"{ReviewCache.make_key(content.decode('utf-8'))}.json"
+        self._prune()
+        try:
+            batch = self._load(state_path) or self._submit(content, state_path)
+            while batch["status"] not in FINAL_STATUSES:
+                time.sleep(self.poll_interval)
+                batch = self.consumer.client.batches.retrieve(batch["id"]).model_dump()
+            results = self._results(batch["output_file_id"]) if batch.get("output_file_id") else {}
+        except OpenAIError as e:
+            raise BatchError(f"Error running the batch: {e}") from e
+        # The batch is over, the next run submits a new one
+        state_path.unlink(missing_ok=True)
+        self.batch = batch
+        if batch["status"] == "failed":
+            errors = (batch.get("errors") or {}).get("data") or []
+            messages = "; ".join(error.get("message") or "" for error in errors)
+            raise BatchError(f"Batch {batch['id']} failed: {messages or 'unknown error'}")
+        return results
+
+    def summary(self) -> str | None:
+        """
+        Describes the batch of the review.
+
+        :return: The summary, or None if every request was answered from the cache.
+        """
+        if self.batch is None:
+            return None
+        summary = f"Batch {self.batch['id']} {self.batch['status']}: {self.answered} request(s) answered"
+        if self.requested:
+            summary += f", {self.requested} made without the batch"
+        return summary + "."
+
+    def _dispatcher(self, consumer: AIConsumerProtocol, cache: ReviewCache | None) -> ReviewDispatcher:
+        feedback_response = AIConsumerFeedbackResponse(
+            consumer=consumer,
+            cache=cache,
+            router=self.feedback_response.router,
+            context=self.feedback_response.context,
+        )
+        return ReviewDispatcher(
+            feedback_response, max_workers=self.max_workers, combined=self.combined, pack_tokens=self.pack_tokens
+        )
+
+    def _submit(self, content: bytes, state_path: Path) -> dict[str, Any]:
+        """Uploads the requests and creates their batch, saving its state to resume it."""
+        client = self.consumer.client
+        input_file = client.files.create(file=("batch.jsonl", content), purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window=COMPLETION_WINDOW
+        ).model_dump()
+        state_path.parent.mkdir(parents=True, exist_ok=True)
+        state_path.write_text(json.dumps({"id": batch["id"], "submitted": time.time()}), encoding="utf-8")
+        return batch
+
+    def _load(self, state_path: Path) -> dict[str, Any] | None:
+        """Gets the batch already submitted for the same requests, if any."""
+        from openai import NotFoundError
+
+        try:
+            state = json.loads(state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        try:
+            batch: dict[str, Any] = self.consumer.client.batches.retrieve(state["id"]).model_dump()
+        except NotFoundError:
+            return None
+        return batch
+
+    def _results(self, output_file_id: str) -> dict[str, tuple[str, Any]]:
+        """Downloads the output of a batch, keeping the requests that succeeded."""
+        from openai.types.responses import Response
+
+        results = {}
+        for line in self.consumer.client.files.content(output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+            body = Response.model_validate(response["body"])
+            results[result["custom_id"]] = (body.output_text, body.usage)
+        return results
+
+    def _prune(self) -> None:
+        """Forgets the batches submitted long ago by runs that never came back for them."""
+        if not self.state_dir.exists():
+            return
+        for path in self.state_dir.glob("*.json"):
+            try:
+                if time.time() - path.stat().st_mtime > STATE_MAX_AGE:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,232 @@
+from collections.abc import Iterable, Mapping
+
+from utils.ai_feedback_filter import AIConsumerFeedbackResponse, FeedbackType
+from utils.batch import BatchRecorder
+from utils.pricing import estimate_cost
+from utils.review_cache import ReviewCache
+from utils.skip_rules import matches
+from utils.tokens import estimate_tokens
+
+# The output tokens assumed for every call, to estimate its cost before making it
+ESTIMATED_OUTPUT_TOKENS = 300
+# Test files and fixtures, reviewed after the source files they test
+TEST_PATTERNS = (
+    "test_*",
+    "*_test.*",
+    "*.test.*",
+    "*.spec.*",
+    "conftest.py",
+    "tests/*",
+    "*/tests/*",
+    "test/*",
+    "*/test/*",
+)
+# How the files are ranked when the budget cannot review them all, by the first criterion that tells them apart:
+# risky paths first, source files before tests, and smaller diffs first
+PRIORITY_CRITERIA = ("risky", "source", "small")
+
+
+def parse_priority(spec: str) -> tuple[str, ...]:
+    """
+    Parses a priority like `source,small`.
+
+    :param spec: The comma-separated criteria, most important first.
+    :return: The criteria.
+    :raises ValueError: If a criterion is unknown or repeated.
+    """
+    criteria = tuple(criterion.strip() for criterion in spec.split(","))
+    unknown = [criterion for criterion in criteria if criterion not in PRIORITY_CRITERIA]
+    if unknown:
+        raise ValueError(f"Unknown priority criteria: {', '.join(unknown)} (expected {', '.join(PRIORITY_CRITERIA)})")
+    if len(set(criteria)) != len(criteria):
+        raise ValueError(f"Repeated priority criteria: {spec!r}")
+    return criteria
+
+
+class Estimate:
+    """The estimated calls, input tokens and cost of reviewing some files."""
+
+    __slots__ = ("calls", "input_tokens", "cost", "unpriced")
+
+    def __init__(self, calls: int = 0, input_tokens: int = 0, cost: float = 0.0, unpriced: int = 0):
+        self.calls = calls
+        self.input_tokens = input_tokens
+        self.cost = cost
+        # The calls to models of unknown prices, left out of the cost
+        self.unpriced = unpriced
+
+    def __add__(self, other: "Estimate") -> "Estimate":
+        return Estimate(
+            self.calls + other.calls,
+            self.input_tokens + other.input_tokens,
+            self.cost + other.cost,
+            self.unpriced + other.unpriced,
+        )
+
+    def add_call(self, model: str, input_tokens: int) -> None:
+        """Adds a call to a model, with its estimated input tokens."""
+        self.calls += 1
+        self.input_tokens += input_tokens
+        cost = estimate_cost(model, input_tokens, ESTIMATED_OUTPUT_TOKENS)
+        if cost is None:
+            self.unpriced += 1
+        else:
+            self.cost += cost
+
+    def describe(self) -> str:
+        """Describes the estimate, like `2 call(s), 1,200 input tokens, $0.0004`."""
+        description = f"{self.calls} call(s), {self.input_tokens:,} input tokens, ${self.cost:.4f}"
+        if self.unpriced:
+            description += f" (without {self.unpriced} call(s) to models of unknown prices)"
+        return description
+
+
+class BudgetGovernor:
+    """
+    Bounds the estimated input tokens and cost of a review, before any request is made.
+
+    The requests of every file are listed the same way a review makes them, without making them: with the
+    same instructions, chunks, combined requests and routed models, and without the requests answered from
+    the cache. Packing is ignored, so the estimate of packed files is on the high side.
+
+    When the budget cannot review every file, the files are ranked by priority, and each one is selected if
+    it still fits in what is left of the budget. The others are left unreviewed.
+    """
+
+    def __init__(
+        self,
+        feedback_response: AIConsumerFeedbackResponse,
+        max_input_tokens: int = 0,
+        max_cost: float = 0.0,
+        priority: tuple[str, ...] = PRIORITY_CRITERIA,
+        combined: bool = False,
+    ):
+        """
+        Initializes the BudgetGovernor.
+
+        :param feedback_response: The feedback response whose cache, router and context the review uses.
+        :param max_input_tokens: The maximum estimated input tokens of the review, or 0 for no limit.
+        :param max_cost: The maximum estimated cost of the review in USD, or 0 for no limit.
+        :param priority: The criteria ranking the files, most important first, among `PRIORITY_CRITERIA`.
+        :param combined: Whether the review requests all the feedback types of a file with a single request.
+        """
+        self.feedback_response = feedback_response
+        self.max_input_tokens = max_input_tokens
+        self.max_cost = max_cost
+        self.priority = priority
+        self.combined = combined
+        # The estimate of every file, in file order
+        self.estimates: dict[str, Estimate] = {}
+        # The files left unreviewed because they did not fit in the budget, in file order
+        self.unreviewed: list[str] = []
+        self.selected = Estimate()
+
+    def select(
+        self,
+        files: Iterable[tuple[str, list[str]]],
+        feedback_types: list[FeedbackType],
+        file_feedback_types: Mapping[str, list[FeedbackType]] | None = None,
+    ) -> list[tuple[str, list[str]]]:
+        """
+        Estimates the review of every file, and selects the files that fit in the budget.
+
+        :param files: The (file name, chunks) pairs to review.
+        :param feedback_types: The types of feedback to request for each file.
+        :param file_feedback_types: The types of feedback to request for some files instead, by file name,
+            looked up once every file is read from `files`.
+        :return: The selected files, in file order.
+        """
+        files = list(files)
+        self.estimates, self.selected = {}, Estimate()
+        for file_name, chunks in files:
+            file_types = (file_feedback_types or {}).get(file_name, feedback_types)
+            self.estimates[file_name] = self.estimate(file_name, chunks, file_types)
+        selected = set()
+        # Stable, so that files of equal priority keep their order
+        for index in sorted(range(len(files)), key=lambda index: self._rank(files[index][0])):
+            estimate = self.estimates[files[index][0]]
+            if self._fits(self.selected + estimate):
+                self.selected += estimate
+                selected.add(index)
+        self.unreviewed = [file_name for index, (file_name, _) in enumerate(files) if index not in selected]
+        return [file for index, file in enumerate(files) if index in selected]
+
+    def estimate(self, file_name: str, chunks: list[str], feedback_types: list[FeedbackType]) -> Estimate:
+        """
+        Estimates the review of a file, recording its requests instead of making them.
+
+        :param file_name: The name of the file.
+        :param chunks: The chunks of the file.
+        :param feedback_types: The types of feedback to request for the file.
+        :return: The estimated calls, input tokens and cost of the requests not answered from the cache.
+        """
+        recorder = BatchRecorder()
+        cache = self.feedback_response.cache
+        feedback_response = AIConsumerFeedbackResponse(
+            consumer=recorder,
+            # The placeholder answers of the recorder must not be cached
+            cache=ReviewCache(cache.cache_dir, read_only=True) if cache is not None else None,
+            router=self.feedback_response.router,
+            context=self.feedback_response.context,
+        )
+        # The same requests as the dispatcher makes for a single file, made in turn
+        for input in chunks:
+            if self.combined and len(feedback_types) > 1:
+                feedback_response.get_combined_feedback(input, feedback_types)
+            else:
+                for feedback_type in feedback_types:
+                    feedback_response.get_feedback(input, feedback_type)
+        estimate = Estimate()
+        for body in recorder.requests.values():
+            estimate.add_call(body["model"], estimate_tokens(body["instructions"]) + estimate_tokens(body["input"]))
+        return estimate
+
+    def total(self) -> Estimate:
+        """Gets the estimate of every file, selected or not."""
+        return sum(self.estimates.values(), Estimate())
+
+    def report(self) -> str:
+        """
+        Describes the estimate of every file, for a dry run.
+        """
+        lines = [f"Dry run: {len(self.estimates)} file(s), {self.total().describe()} estimated."]
+        lines.extend(f"  {file_name}: {estimate.describe()}" for file_name, estimate in self.estimates.items())
+        return "\n".join(lines)
+
+    def summary(self) -> str | None:
+        """
+        Describes the files the budget left unreviewed.
+
+        :return: The summary, or None if every file fits in the budget.
+        """
+        if not self.unreviewed:
+            return None
+        limits = []
+        if self.max_input_tokens:
+            limits.append(f"{self.max_input_tokens:,} input tokens")
+        if self.max_cost:
+            limits.append(f"${self.max_cost:g}")
+        return (
+            f"Budget of {' and '.join(limits)} exceeded: {len(self.estimates) - len(self.unreviewed)} file(s) "
+            f"selected for {self.selected.describe()} estimated, {len(self.unreviewed)} left unreviewed."
+        )
+
+    def _fits(self, estimate: Estimate) -> bool:
+        if self.max_input_tokens and estimate.input_tokens > self.max_input_tokens:
+            return False
+        return not self.max_cost or estimate.cost <= self.max_cost
+
+    def _rank(self, file_name: str) -> tuple[int, ...]:
+        """Ranks a file by the priority criteria, lowest first."""
+        # Imported here, as triage imports ast and history imports sqlite3, which are slow to import
+        from utils.history import COMMIT_PREFIX
+        from utils.triage import SECURITY_PATHS
+
+        # The files of a commit range are labelled with their commit, which the patterns must not see
+        path = COMMIT_PREFIX.sub("", file_name)
+        keys = {
+            "risky": 0 if matches(path, SECURITY_PATHS) else 1,
+            "source": 1 if matches(path, TEST_PATTERNS) else 0,
+            "small": self.estimates[file_name].input_tokens,
+        }
+        return tuple(keys[criterion] for criterion in self.priority)
@@ -0,0 +1,61 @@
+from collections.abc import Iterator
+
+from utils.diff_parser import DiffFile, Hunk
+from utils.tokens import estimate_tokens
+
+DEFAULT_CHUNK_TOKENS = 8000
+
+
+def _split_hunk(hunk: Hunk, max_tokens: int) -> Iterator[tuple[list[str], int]]:
+    """
+    Splits a hunk into pieces under the token limit, only cutting between lines when the hunk is too large.
+
+    :return: An iterator of (lines, estimated tokens) pairs.
+    """
+    line_tokens = [estimate_tokens(line) + 1 for line in hunk.lines]
+    if sum(line_tokens) <= max_tokens:
+        yield hunk.lines, sum(line_tokens)
+        return
+    lines: list[str] = []
+    tokens = 0
+    for line, line_token_count in zip(hunk.lines, line_tokens, strict=True):
+        if lines and tokens + line_token_count > max_tokens:
+            yield lines, tokens
+            lines, tokens = [], 0
+        lines.append(line)
+        tokens += line_token_count
+    if lines:
+        yield lines, tokens
+
+
+def chunk_diff_file(diff_file: DiffFile, max_tokens: int = DEFAULT_CHUNK_TOKENS) -> list[str]:
+    """
+    Splits the review input of a file into chunks under the token limit.
+
+    Chunks are cut on hunk boundaries, and a single hunk is only cut between lines when it does not fit
+    on its own. Every chunk repeats the file headers. A file that fits the limit gets a single chunk equal
+    to its `review_input()`.
+
+    :param diff_file: The diff of the file.
+    :param max_tokens: The maximum estimated number of tokens of a chunk, or 0 to never split the file.
+    :return: The review inputs of the chunks.
+    """
+    if max_tokens <= 0:
+        return [diff_file.review_input()]
+    header_lines = [diff_file.header, *diff_file.header_lines]
+    # Always leave some room for the hunk lines, even when the headers are huge
+    budget = max(max_tokens - estimate_tokens("\n".join(header_lines)), max_tokens // 4, 1)
+
+    chunks: list[list[str]] = []
+    lines: list[str] = []
+    tokens = 0
+    for hunk in diff_file.hunks:
+        for hunk_lines, hunk_tokens in _split_hunk(hunk, budget):
+            if lines and tokens + hunk_tokens > budget:
+                chunks.append(lines)
+                lines, tokens = [], 0
+            lines.extend(hunk_lines)
+            tokens += hunk_tokens
+    if lines or not chunks:
+        chunks.append(lines)
+    return ["\n".join([*header_lines, *chunk]) for chunk in chunks]
@@ -0,0 +1,128 @@
+import hashlib
+import keyword
+import posixpath
+import re
+from collections.abc import Iterable, Iterator
+
+from utils.diff_parser import DiffFile
+
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+WHITESPACE = re.compile(r"\s+")
+# Kept as they are when identifiers are normalized, as they carry the structure of the change
+KEYWORDS = frozenset([*keyword.kwlist, *keyword.softkwlist])
+
+
+def normalize_lines(lines: Iterable[str], identifiers: bool = False) -> list[str]:
+    """
+    Normalizes the changed lines of a diff, so that changes differing only in layout compare equal.
+
+    Whitespace is collapsed, and blank lines are dropped. With `identifiers`, every identifier other than a
+    keyword is replaced by its order of first appearance, so that the same change made to differently named
+    variables compares equal too, while a change renaming one name to another still differs from a change
+    leaving it alone.
+
+    :param lines: The added and removed lines, with their `+` or `-` prefix.
+    :param identifiers: Whether to normalize identifiers.
+    :return: The normalized lines.
+    """
+    names: dict[str, str] = {}
+
+    def rename(match: re.Match[str]) -> str:
+        name = match.group()
+        if name in KEYWORDS:
+            return name
+        return names.setdefault(name, f"v{len(names)}")
+
+    normalized = []
+    for line in lines:
+        content = WHITESPACE.sub(" ", line[1:]).strip()
+        if not content:
+            continue
+        if identifiers:
+            content = IDENTIFIER.sub(rename, content)
+        normalized.append(line[0] + content)
+    return normalized
+
+
+def fingerprint(diff_file: DiffFile, identifiers: bool = False) -> str | None:
+    """
+    Fingerprints the change made to a file: its normalized added and removed lines, without their context or
+    position, and the extension of the file, since the same change means different things in different languages.
+
+    :param diff_file: The diff of the file.
+    :param identifiers: Whether to normalize identifiers, see `normalize_lines`.
+    :return: The fingerprint, or None if the file has no changed lines to compare.
+    """
+    if diff_file.is_binary:
+        return None
+    lines = normalize_lines(
+        (line for hunk in diff_file.hunks for line in hunk.lines if line[:1] in ("+", "-")), identifiers
+    )
+    if not lines:
+        return None
+    digest = hashlib.sha256(posixpath.splitext(diff_file.path)[1].encode())
+    for line in lines:
+        digest.update(b"\n" + line.encode())
+    return digest.hexdigest()
+
+
+class ChangeClusters:
+    """
+    Groups the files whose changes are the same once normalized, like the files of a mechanical refactor,
+    so that only the first file of every cluster is reviewed and its feedback applies to all of them.
+    """
+
+    def __init__(self, identifiers: bool = False):
+        """
+        Initializes the ChangeClusters.
+
+        :param identifiers: Whether changes that only differ by the names of their identifiers are clustered.
+        """
+        self.identifiers = identifiers
+        # The names of the files of every cluster, by the name of the file reviewed for it
+        self.clusters: dict[str, list[str]] = {}
+        self._representatives: dict[str, str] = {}
+
+    def filter(self, diff_files: Iterable[DiffFile], prefix: str = "") -> Iterator[DiffFile]:
+        """
+        Lazily drops the files whose change was already made to an earlier file, adding them to its cluster.
+
+        :param diff_files: The diffs of the files.
+        :param prefix: The prefix of the file names, like the commit of the files when reviewing commits.
+        :return: An iterator of the diffs of the files to review.
+        """
+        for diff_file in diff_files:
+            file_name = prefix + diff_file.path
+            key = fingerprint(diff_file, self.identifiers)
+            representative = self._representatives.setdefault(key, file_name) if key is not None else file_name
+            self.clusters.setdefault(representative, []).append(file_name)
+            if representative == file_name:
+                yield diff_file
+
+    def members(self, file_name: str) -> list[str]:
+        """
+        Gets the files a review applies to.
+
+        :param file_name: The name of a reviewed file.
+        :return: The names of the files of its cluster, itself first.
+        """
+        return self.clusters.get(file_name, [file_name])
+
+    def summary(self, top: int = 5) -> str | None:
+        """
+        Describes the clusters of several files.
+
+        :param top: The number of clusters listed, largest first.
+        :return: The summary, or None if every change is unique.
+        """
+        clusters = sorted((files for files in self.clusters.values() if len(files) > 1), key=len, reverse=True)
+        if not clusters:
+            return None
+        files = sum(len(cluster) for cluster in clusters)
+        lines = [
+            f"Clustered {files} file(s) with the same change into {len(clusters)} cluster(s), "
+            f"saving the review of {files - len(clusters)} file(s):"
+        ]
+        for cluster in clusters[:top]:
+            lines.append(f"  {len(cluster)} files like {cluster[0]}")
+        return "\n".join(lines)
@@ -0,0 +1,88 @@
+from collections.abc import Iterator
+
+from utils.diff_parser import DiffFile
+from utils.dispatcher import DEFAULT_MAX_WORKERS
+from utils.git import commit_diff, commit_numstat, patch_ids, rev_list
+
+
+class CommitDiff:
+    """The file diffs of a commit, with what the review needs to know about them."""
+
+    __slots__ = ("commit", "diff_files", "patch_ids", "whitespace_changes")
+
+    def __init__(
+        self,
+        commit: str,
+        diff_files: list[DiffFile],
+        patch_ids: list[str | None],
+        whitespace_changes: set[str] | None,
+    ):
+        self.commit = commit
+        self.diff_files = diff_files
+        self.patch_ids = patch_ids
+        self.whitespace_changes = whitespace_changes
+
+
+class CommitRangeReader:
+    """
+    Reads the diffs of the commits of a range in parallel, and drops the file changes already seen in an
+    earlier commit of the range, like cherry-picks, rebased duplicates and reverted then reapplied changes.
+
+    Changes are compared with `git patch-id`, so the same change at other line numbers or with other
+    whitespace is still a duplicate.
+    """
+
+    def __init__(
+        self,
+        from_ref: str,
+        to_ref: str,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        whitespace_check: bool = True,
+    ):
+        """
+        Initializes the CommitRangeReader.
+
+        :param from_ref: The ref whose commits are excluded from the range.
+        :param to_ref: The ref whose commits are read.
+        :param max_workers: The maximum number of commits read at the same time.
+        :param whitespace_check: Whether to list the files of every commit that still change when whitespace
+            is ignored, for the whitespace skip rule.
+        """
+        self.from_ref = from_ref
+        self.to_ref = to_ref
+        self.max_workers = max_workers
+        self.whitespace_check = whitespace_check
+        self.duplicates: list[tuple[str, str]] = []
+
+    def read(self) -> Iterator[CommitDiff]:
+        """
+        Reads the commits of the range.
+
+        :return: An iterator of the diff of every commit, oldest first, without the duplicate file changes.
+            The duplicates are listed in `duplicates` as (commit, file name) pairs.
+        :raises GitError: If a git command fails.
+        """
+        commits = rev_list(self.from_ref, self.to_ref)
+        if not commits:
+            return
+        # Imported here, as concurrent.futures is slow to import and not needed when there is nothing to review
+        from concurrent.futures import ThreadPoolExecutor
+
+        seen: set[str] = set()
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(commits))) as executor:
+            for commit_diff in executor.map(self._read_commit, commits):
+                diff_files = []
+                for diff_file, patch_id in zip(commit_diff.diff_files, commit_diff.patch_ids, strict=True):
+                    if patch_id is not None and patch_id in seen:
+                        self.duplicates.append((commit_diff.commit, diff_file.path))
+                        continue
+                    if patch_id is not None:
+                        seen.add(patch_id)
+                    diff_files.append(diff_file)
+                commit_diff.diff_files = diff_files
+                yield commit_diff
+
+    def _read_commit(self, commit: str) -> CommitDiff:
+        diff_files = list(commit_diff(commit))
+        whitespace_changes = set(commit_numstat(commit, ignore_whitespace=True)) if self.whitespace_check else None
+        return CommitDiff(commit, diff_files, patch_ids(diff_files), whitespace_changes)
@@ -0,0 +1,84 @@
+import argparse
+from pathlib import Path
+from typing import Any
+
+CONFIG_FILE = "pyproject.toml"
+CONFIG_TABLE = "ai-review"
+
+
+class ConfigError(ValueError):
+    """Raised when the configuration cannot be read or has invalid values."""
+
+
+def load_config(path: Path | str = CONFIG_FILE) -> dict[str, Any]:
+    """
+    Reads the `[tool.ai-review]` table of a pyproject.toml file.
+
+    :param path: The path of the file.
+    :return: The options of the table, or an empty dict if the file or the table does not exist.
+    :raises ConfigError: If the file is not valid TOML or the table is not a table.
+    """
+    try:
+        with open(path, "rb") as file:
+            content = file.read()
+    except FileNotFoundError:
+        return {}
+    # Imported here, as tomllib is slow to import and not needed without a configuration file
+    import tomllib
+
+    try:
+        data = tomllib.loads(content.decode("utf-8"))
+    except (tomllib.TOMLDecodeError, UnicodeDecodeError) as e:
+        raise ConfigError(f"Invalid {path}: {e}") from e
+    config = data.get("tool", {}).get(CONFIG_TABLE, {})
+    if not isinstance(config, dict):
+        raise ConfigError(f"Invalid {path}: [tool.{CONFIG_TABLE}] is not a table")
+    return config
+
+
+def apply_config(parser: argparse.ArgumentParser, config: dict[str, Any]) -> None:
+    """
+    Uses the configuration as the defaults of the options of a parser, so that command-line options still
+    override it. Keys are named like the long options, without their leading dashes, and their values are
+    checked like command-line values. Options that can be repeated are set by a list or a single value, and
+    the others only by a single value. Keys that are not options of the parser, like the options of another
+    command, are ignored.
+
+    :param parser: The parser.
+    :param config: The configuration, like `load_config` returns it.
+    :raises ConfigError: If a value is invalid.
+    """
+    actions = {
+        option[2:]: action for action in parser._actions for option in action.option_strings if option.startswith("--")
+    }
+    defaults = {}
+    for key, value in config.items():
+        action = actions.get(key)
+        if action is None or action.dest == "help":
+            continue
+        if isinstance(action, argparse._AppendAction):
+            # A single value sets a repeatable option too, like `exclude = "*.lock"`
+            items = value if isinstance(value, list) else [value]
+            defaults[action.dest] = [_convert(action, key, item) for item in items]
+        elif isinstance(value, list):
+            raise ConfigError(f"Invalid value for {key}: {value!r} is not a single value")
+        else:
+            defaults[action.dest] = _convert(action, key, value)
+    parser.set_defaults(**defaults)
+
+
+def _convert(action: argparse.Action, key: str, value: Any) -> Any:
+    if action.nargs == 0:
+        # Flags like --no-cache
+        if not isinstance(value, bool):
+            raise ConfigError(f"Invalid value for {key}: {value!r} is not a boolean")
+        return value
+    if isinstance(value, bool | dict):
+        raise ConfigError(f"Invalid value for {key}: {value!r}")
+    try:
+        converted = action.type(str(value)) if callable(action.type) else str(value)
+    except (TypeError, ValueError, argparse.ArgumentTypeError) as e:
+        raise ConfigError(f"Invalid value for {key}: {e}") from e
+    if action.choices is not None and converted not in action.choices:
+        raise ConfigError(f"Invalid value for {key}: {value!r} is not one of {', '.join(map(str, action.choices))}")
+    return converted
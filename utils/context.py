@@ -0,0 +1,157 @@
+from collections.abc import Iterable
+from enum import Enum
+
+from utils.diff_parser import DiffFile, FileStatus, Hunk
+
+DEFAULT_CONTEXT_LINES = 3
+# Enclosing scopes longer than this are replaced by the unified context, as they would cost more than they help
+MAX_SCOPE_LINES = 200
+# Header lines that carry no information the model can use
+DROPPED_HEADER_PREFIXES = ("index ", "--- ", "+++ ")
+
+
+class RemovedLines(Enum):
+    """How the removed lines of a diff are sent to the model."""
+
+    KEEP = "keep"
+    COUNT = "count"
+    DROP = "drop"
+
+
+def python_scopes(source: str) -> list[tuple[int, int]] | None:
+    """
+    Gets the line ranges of the functions and classes of a Python module, decorators included.
+
+    :param source: The module source.
+    :return: The (first line, last line) ranges, or None if the source does not parse.
+    """
+    # Imported here, as ast is slow to import and only needed to trim the context of Python files
+    import ast
+
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    scopes = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef | ast.AsyncFunctionDef | ast.ClassDef) and node.end_lineno is not None:
+            start = min([node.lineno, *(decorator.lineno for decorator in node.decorator_list)])
+            scopes.append((start, node.end_lineno))
+    return scopes
+
+
+# The scope extractors of the supported languages, by file extension
+SCOPE_EXTRACTORS = {".py": python_scopes, ".pyi": python_scopes}
+
+
+def changed_lines(diff_file: DiffFile) -> tuple[set[int], dict[int, list[str]]]:
+    """
+    Maps the changes of a file diff to the lines of the new file.
+
+    :param diff_file: The diff of the file.
+    :return: The numbers of the added lines, and the removed lines by the number of the new line they preceded.
+    """
+    added: set[int] = set()
+    removed: dict[int, list[str]] = {}
+    for hunk in diff_file.hunks:
+        line_number = hunk.new_start if hunk.new_count else hunk.new_start + 1
+        for line in hunk.lines:
+            if line.startswith("+"):
+                added.add(line_number)
+                line_number += 1
+            elif line.startswith("-"):
+                removed.setdefault(line_number, []).append(line)
+            elif not line.startswith("\\"):
+                line_number += 1
+    return added, removed
+
+
+def context_ranges(
+    lines: Iterable[int],
+    scopes: list[tuple[int, int]] | None,
+    line_count: int,
+    context_lines: int = DEFAULT_CONTEXT_LINES,
+) -> list[tuple[int, int]]:
+    """
+    Gets the line ranges to show around the changed lines: their innermost enclosing scope when there is
+    one short enough, their unified context otherwise.
+
+    :param lines: The changed line numbers.
+    :param scopes: The (first line, last line) ranges of the scopes of the file, if known.
+    :param line_count: The number of lines of the file.
+    :param context_lines: The number of unchanged lines shown around changes outside of any scope.
+    :return: The sorted, merged (first line, last line) ranges.
+    """
+    ranges = []
+    for line in lines:
+        enclosing = [
+            (start, end) for start, end in scopes or () if start <= line <= end and end - start < MAX_SCOPE_LINES
+        ]
+        if enclosing:
+            ranges.append(min(enclosing, key=lambda scope: scope[1] - scope[0]))
+        else:
+            ranges.append((max(1, line - context_lines), min(line_count, line + context_lines)))
+
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _removed(lines: list[str], removed_lines: RemovedLines) -> list[str]:
+    if removed_lines is RemovedLines.DROP or not lines:
+        return []
+    if removed_lines is RemovedLines.COUNT:
+        return [f"- [{len(lines)} line(s) removed]"]
+    return lines
+
+
+def trim_context(
+    diff_file: DiffFile,
+    source: str | None,
+    context_lines: int = DEFAULT_CONTEXT_LINES,
+    removed_lines: RemovedLines = RemovedLines.KEEP,
+) -> DiffFile:
+    """
+    Replaces the raw context of a file diff with the enclosing function or class of each change, taken
+    from the staged content of the file, and drops the header lines the model does not need.
+
+    Files in languages without scope support keep a unified context of `context_lines` lines. Files without
+    staged content or hunks, like deleted and binary files, are returned as they are.
+
+    :param diff_file: The diff of the file.
+    :param source: The staged content of the file, if any.
+    :param context_lines: The number of unchanged lines shown around changes outside of any scope.
+    :param removed_lines: How the removed lines are sent.
+    :return: A diff of the file with one hunk per shown range.
+    """
+    if source is None or not diff_file.hunks or diff_file.status is FileStatus.DELETED:
+        return diff_file
+    added, removed = changed_lines(diff_file)
+    # Split on newlines only, like git numbers the lines: form feeds or \x85 inside a line do not end it
+    source_lines = source.split("\n")
+    if source_lines[-1] == "":
+        source_lines.pop()
+    line_count = len(source_lines)
+    extension = diff_file.path[diff_file.path.rfind(".") :] if "." in diff_file.path else ""
+    extractor = SCOPE_EXTRACTORS.get(extension)
+    scopes = extractor(source) if extractor is not None else None
+    # Removals are anchored to the line that follows them, or to the last line at the end of the file
+    anchors = {min(line, line_count) for line in removed} if line_count else set()
+
+    trimmed = DiffFile(diff_file.header, diff_file.old_path, diff_file.new_path)
+    trimmed.status = diff_file.status
+    trimmed.header_lines = [line for line in diff_file.header_lines if not line.startswith(DROPPED_HEADER_PREFIXES)]
+    for start, end in context_ranges(added | anchors, scopes, line_count, context_lines):
+        hunk = Hunk(start, end - start + 1, start, end - start + 1, "")
+        for line_number in range(start, end + 1):
+            hunk.lines.extend(_removed(removed.get(line_number, []), removed_lines))
+            prefix = "+" if line_number in added else " "
+            hunk.lines.append(f"{prefix}{source_lines[line_number - 1]}")
+        if end == line_count:
+            hunk.lines.extend(_removed(removed.get(line_count + 1, []), removed_lines))
+        trimmed.hunks.append(hunk)
+    return trimmed
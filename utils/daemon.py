@@ -0,0 +1,277 @@
+import json
+import os
+import threading
+from collections.abc import Iterable, Iterator, Mapping
+from io import BufferedIOBase
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from utils.ai_feedback_filter import AIConsumerFeedbackResponse, FeedbackType
+from utils.dispatcher import DEFAULT_MAX_WORKERS, ReviewDispatcher
+from utils.protocols import AIConsumerProtocol
+from utils.review_cache import ReviewCache, default_cache_dir
+from utils.routing import ModelRouter
+
+if TYPE_CHECKING:
+    import socket
+    import socketserver
+
+ENV_SOCKET = "AI_REVIEW_SOCKET"
+SOCKET_FILE = "daemon.sock"
+
+
+def default_socket_path() -> Path:
+    """
+    Returns the path of the review daemon socket: $AI_REVIEW_SOCKET, or a socket in the cache directory.
+    """
+    return Path(os.environ.get(ENV_SOCKET) or default_cache_dir() / SOCKET_FILE)
+
+
+def unix_sockets_supported() -> bool:
+    """Checks whether the platform has Unix sockets, which the review daemon listens on."""
+    # Imported here, like socketserver, as the hook only needs them when a daemon may be running
+    import socket
+
+    return hasattr(socket, "AF_UNIX")
+
+
+def _send(wfile: BufferedIOBase, message: dict[str, Any]) -> None:
+    wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+    wfile.flush()
+
+
+def _receive(rfile: BufferedIOBase) -> dict[str, Any] | None:
+    line = rfile.readline()
+    if not line:
+        return None
+    message: dict[str, Any] = json.loads(line)
+    return message
+
+
+class ReviewServer:
+    """
+    Review daemon listening on a Unix socket, so that hooks share a warm AI consumer, its pooled
+    keep-alive connections and an in-memory cache instead of starting from scratch on every commit.
+    The models are chosen by every client, but the API is the one of the daemon consumer.
+
+    The protocol is one JSON object per line. The client sends the review options, then every file with
+    its chunks and optionally its own feedback types, then an end message; the server answers with the
+    feedback of every file, in file order, as soon as it is ready, then a done message listing the files
+    left unreviewed, or an error message.
+    """
+
+    def __init__(self, socket_path: Path | str, consumer: AIConsumerProtocol, cache: ReviewCache | None = None):
+        """
+        Initializes the ReviewServer and binds its socket.
+
+        :param socket_path: The path of the Unix socket.
+        :param consumer: The AI consumer shared by every review.
+        :param cache: The feedback cache shared by every review that does not opt out of it, if any.
+        :raises RuntimeError: If the platform has no Unix sockets, or another daemon is already listening on
+            the socket.
+        """
+        if not unix_sockets_supported():
+            raise RuntimeError("Unix sockets are not supported on this platform")
+        self.socket_path = Path(socket_path)
+        self.consumer = consumer
+        self.cache = cache
+        if self.socket_path.exists():
+            if connect(self.socket_path) is not None:
+                raise RuntimeError(f"A review daemon is already listening on {self.socket_path}")
+            # Left behind by a daemon that did not exit cleanly
+            self.socket_path.unlink()
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        import socketserver
+
+        # Only the user may connect, from the moment the socket is created
+        umask = os.umask(0o077)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(str(self.socket_path), self._handler_class())
+        finally:
+            os.umask(umask)
+        self.server.daemon_threads = True
+
+    def serve_forever(self) -> None:
+        self.server.serve_forever()
+
+    def shutdown(self) -> None:
+        self.server.shutdown()
+
+    def close(self) -> None:
+        self.server.server_close()
+        self.socket_path.unlink(missing_ok=True)
+
+    def handle(self, rfile: BufferedIOBase, wfile: BufferedIOBase) -> None:
+        """
+        Handles a review request.
+
+        :param rfile: The request stream.
+        :param wfile: The response stream.
+        """
+        try:
+            options = _receive(rfile)
+            if options is None:
+                return
+            dispatcher = ReviewDispatcher(
+                AIConsumerFeedbackResponse(
+                    consumer=self.consumer,
+                    cache=self.cache if options["cache"] else None,
+                    router=ModelRouter.from_dict(options["router"]) if options.get("router") else None,
+                    context=options.get("context", ""),
+                ),
+                max_workers=options["concurrency"],
+                combined=options["combined"],
+                pack_tokens=options["pack_tokens"],
+                fail_fast=options["fail_fast"],
+            )
+            feedback_types = [FeedbackType(value) for value in options["feedback_types"]]
+            file_feedback_types: dict[str, list[FeedbackType]] = {}
+            files = self._files(rfile, file_feedback_types)
+            for file_name, feedback in dispatcher.review(files, feedback_types, file_feedback_types):
+                _send(wfile, {"file": file_name, "feedback": feedback})
+            _send(wfile, {"done": True, "unreviewed": dispatcher.unreviewed})
+        except BrokenPipeError:
+            # The hook went away
+            return
+        except Exception as e:
+            _send(wfile, {"error": str(e)})
+        if self.cache is not None:
+            self.cache.prune()
+
+    def _files(
+        self, rfile: BufferedIOBase, file_feedback_types: dict[str, list[FeedbackType]]
+    ) -> Iterator[tuple[str, list[str]]]:
+        while (message := _receive(rfile)) is not None and "file" in message:
+            if "feedback_types" in message:
+                file_feedback_types[message["file"]] = [FeedbackType(value) for value in message["feedback_types"]]
+            yield message["file"], message["chunks"]
+
+    def _handler_class(self) -> "type[socketserver.StreamRequestHandler]":
+        import socketserver
+
+        review_server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                review_server.handle(self.rfile, self.wfile)
+
+        return Handler
+
+
+def connect(socket_path: Path | str | None = None) -> "socket.socket | None":
+    """
+    Connects to the review daemon.
+
+    :param socket_path: The path of the daemon socket (default: `default_socket_path()`).
+    :return: The connected socket, or None if no daemon is listening or the platform has no Unix sockets.
+    """
+    import socket
+
+    if not unix_sockets_supported():
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(str(socket_path if socket_path is not None else default_socket_path()))
+    except OSError:
+        connection.close()
+        return None
+    return connection
+
+
+class DaemonReviewer:
+    """
+    Client side of the review daemon, with the same interface as `ReviewDispatcher`.
+    """
+
+    def __init__(
+        self,
+        connection: "socket.socket",
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        combined: bool = False,
+        pack_tokens: int = 0,
+        fail_fast: bool = False,
+        cache: bool = True,
+        router: ModelRouter | None = None,
+        context: str = "",
+    ):
+        """
+        Initializes the DaemonReviewer.
+
+        :param connection: The socket connected to the daemon, closed once the review is done.
+        :param max_workers: The maximum number of requests sent by the daemon at the same time.
+        :param combined: Whether to request all the feedback types of a file with a single call.
+        :param pack_tokens: The token budget used to pack several small files into a single request.
+        :param fail_fast: Whether to cancel every outstanding request once a request gets any feedback.
+        :param cache: Whether the daemon may use its feedback cache.
+        :param router: Chooses the model of every request (default: always the default model).
+        :param context: Repository-wide context sent with every request.
+        """
+        self.connection = connection
+        self.options = {
+            "concurrency": max_workers,
+            "combined": combined,
+            "pack_tokens": pack_tokens,
+            "fail_fast": fail_fast,
+            "cache": cache,
+            "router": router.to_dict() if router is not None else None,
+            "context": context,
+        }
+        self.unreviewed: list[str] = []
+
+    def review(
+        self,
+        files: Iterable[tuple[str, str | list[str]]],
+        feedback_types: list[FeedbackType],
+        file_feedback_types: Mapping[str, list[FeedbackType]] | None = None,
+    ) -> Iterator[tuple[str, dict[str, list[str]]]]:
+        """
+        Sends the files to the daemon while they are read, and yields its feedback as soon as it arrives.
+
+        :param files: The (file name, file content or chunks) pairs to review.
+        :param feedback_types: The types of feedback to request for each file.
+        :param file_feedback_types: The types of feedback to request for some files instead, by file name.
+        :return: An iterator of (file name, feedback) pairs, in the order the files were given.
+        :raises RuntimeError: If the daemon fails or goes away.
+        """
+        rfile = self.connection.makefile("rb")
+        wfile = self.connection.makefile("wb")
+        errors: list[BaseException] = []
+
+        def send_files() -> None:
+            try:
+                types = [feedback_type.value for feedback_type in feedback_types]
+                _send(wfile, {**self.options, "feedback_types": types})
+                for file_name, input in files:
+                    message = {"file": file_name, "chunks": [input] if isinstance(input, str) else input}
+                    if file_feedback_types is not None and file_name in file_feedback_types:
+                        message["feedback_types"] = [
+                            feedback_type.value for feedback_type in file_feedback_types[file_name]
+                        ]
+                    _send(wfile, message)
+                _send(wfile, {"end": True})
+            except BaseException as e:
+                errors.append(e)
+                import socket
+
+                # Unblocks the reader, which reports the error
+                self.connection.shutdown(socket.SHUT_RDWR)
+
+        # Files are sent from another thread, so that neither side blocks on a full socket buffer
+        sender = threading.Thread(target=send_files, daemon=True)
+        sender.start()
+        try:
+            while (message := _receive(rfile)) is not None:
+                if "error" in message:
+                    raise RuntimeError(f"Review daemon error: {message['error']}")
+                if "done" in message:
+                    self.unreviewed = message["unreviewed"]
+                    return
+                yield message["file"], message["feedback"]
+            sender.join()
+            if errors:
+                raise errors[0]
+            raise RuntimeError("Review daemon error: the connection was closed")
+        finally:
+            rfile.close()
+            wfile.close()
+            self.connection.close()
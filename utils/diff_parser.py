@@ -0,0 +1,238 @@
+import re
+from collections.abc import Iterable, Iterator
+from enum import Enum
+
+HUNK_PATTERN = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@(.*)$")
+PREFIX_PATTERN = re.compile(r"^[a-z]/")
+C_ESCAPES = {"a": "\a", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v", '"': '"', "\\": "\\"}
+DEV_NULL = "/dev/null"
+
+
+class FileStatus(Enum):
+    ADDED = "added"
+    DELETED = "deleted"
+    MODIFIED = "modified"
+    RENAMED = "renamed"
+    COPIED = "copied"
+
+
+class Hunk:
+    """A hunk of a file diff: its line ranges and its raw ` `, `+`, `-` and `\\` lines."""
+
+    __slots__ = ("old_start", "old_count", "new_start", "new_count", "header", "lines")
+
+    def __init__(self, old_start: int, old_count: int, new_start: int, new_count: int, header: str):
+        self.old_start = old_start
+        self.old_count = old_count
+        self.new_start = new_start
+        self.new_count = new_count
+        self.header = header
+        self.lines: list[str] = []
+
+    def __repr__(self) -> str:
+        return f"Hunk(-{self.old_start},{self.old_count} +{self.new_start},{self.new_count})"
+
+
+class DiffFile:
+    """The diff of a single file, as parsed from `git diff` output."""
+
+    __slots__ = ("old_path", "new_path", "status", "is_binary", "header", "header_lines", "hunks")
+
+    def __init__(self, header: str, old_path: str | None, new_path: str | None):
+        self.header = header
+        self.old_path = old_path
+        self.new_path = new_path
+        self.status = FileStatus.MODIFIED
+        self.is_binary = False
+        self.header_lines: list[str] = []
+        self.hunks: list[Hunk] = []
+
+    def __repr__(self) -> str:
+        return f"DiffFile({self.path!r}, {self.status.value}, hunks={len(self.hunks)})"
+
+    @property
+    def path(self) -> str:
+        """The path of the file after the change, or before it if the file was deleted."""
+        return self.new_path or self.old_path or "unknown_file"
+
+    def review_input(self) -> str:
+        """
+        Builds the input sent to the AI consumer: the diff of the file without its hunk headers.
+
+        :return: The file diff.
+        """
+        lines = [self.header, *self.header_lines]
+        for hunk in self.hunks:
+            lines.extend(hunk.lines)
+        return "\n".join(lines)
+
+    def patch(self) -> str:
+        """
+        Rebuilds the diff of the file as git wrote it, hunk headers included.
+
+        :return: The file diff.
+        """
+        lines = [self.header, *self.header_lines]
+        for hunk in self.hunks:
+            header = f" {hunk.header}" if hunk.header else ""
+            lines.append(f"@@ -{hunk.old_start},{hunk.old_count} +{hunk.new_start},{hunk.new_count} @@{header}")
+            lines.extend(hunk.lines)
+        return "\n".join(lines)
+
+
+def unquote_path(path: str) -> str:
+    """
+    Decodes a path quoted by git, which uses C-style escapes for special and non-ASCII characters.
+
+    :param path: The path, quoted or not.
+    :return: The decoded path.
+    """
+    if len(path) < 2 or not (path.startswith('"') and path.endswith('"')):
+        return path
+    decoded = bytearray()
+    index = 1
+    while index < len(path) - 1:
+        char = path[index]
+        if char == "\\" and index + 1 < len(path) - 1:
+            escaped = path[index + 1]
+            if escaped in "01234567":
+                decoded.append(int(path[index + 1 : index + 4], 8))
+                index += 4
+                continue
+            decoded.extend(C_ESCAPES.get(escaped, escaped).encode("utf-8"))
+            index += 2
+            continue
+        decoded.extend(char.encode("utf-8"))
+        index += 1
+    return decoded.decode("utf-8", errors="replace")
+
+
+def _strip_prefix(path: str) -> str | None:
+    if path == DEV_NULL:
+        return None
+    return PREFIX_PATTERN.sub("", unquote_path(path), count=1)
+
+
+def _split_quoted(text: str) -> tuple[str, str]:
+    """Splits the first quoted path of a header from the rest of it."""
+    index = 1
+    while index < len(text):
+        if text[index] == "\\":
+            index += 2
+            continue
+        if text[index] == '"':
+            break
+        index += 1
+    return text[: index + 1], text[index + 1 :].lstrip(" ")
+
+
+def parse_header_paths(header: str) -> tuple[str | None, str | None]:
+    """
+    Gets the old and new paths of a `diff --git` header.
+
+    Unquoted paths may contain spaces, so they are split where both halves name the same file. Renamed
+    files are ambiguous here, and their paths are fixed by the `---`, `+++` and `rename` lines that follow.
+
+    :param header: The `diff --git` line.
+    :return: The old and new paths.
+    """
+    rest = header[len("diff --git ") :]
+    if rest.startswith('"'):
+        old, new = _split_quoted(rest)
+        return _strip_prefix(old), _strip_prefix(new)
+    if rest.endswith('"'):
+        index = rest.rindex(' "')
+        return _strip_prefix(rest[:index]), _strip_prefix(rest[index + 1 :])
+
+    middle = len(rest) // 2
+    old, new = rest[:middle], rest[middle + 1 :]
+    if rest[middle : middle + 1] == " " and _strip_prefix(old) == _strip_prefix(new):
+        return _strip_prefix(old), _strip_prefix(new)
+    old, _, new = rest.partition(" b/")
+    return _strip_prefix(old), _strip_prefix(f"b/{new}") if new else None
+
+
+def _parse_header_line(diff_file: DiffFile, line: str) -> None:
+    """Updates the file with the information of an extended header line."""
+    diff_file.header_lines.append(line)
+    if line.startswith("new file mode"):
+        diff_file.status = FileStatus.ADDED
+        diff_file.old_path = None
+    elif line.startswith("deleted file mode"):
+        diff_file.status = FileStatus.DELETED
+        diff_file.new_path = None
+    elif line.startswith("rename from "):
+        diff_file.status = FileStatus.RENAMED
+        diff_file.old_path = unquote_path(line[len("rename from ") :])
+    elif line.startswith("rename to "):
+        diff_file.status = FileStatus.RENAMED
+        diff_file.new_path = unquote_path(line[len("rename to ") :])
+    elif line.startswith("copy from "):
+        diff_file.status = FileStatus.COPIED
+        diff_file.old_path = unquote_path(line[len("copy from ") :])
+    elif line.startswith("copy to "):
+        diff_file.status = FileStatus.COPIED
+        diff_file.new_path = unquote_path(line[len("copy to ") :])
+    elif line.startswith("--- "):
+        # git appends a tab to the names that contain spaces
+        diff_file.old_path = _strip_prefix(line[4:].rstrip("\t"))
+    elif line.startswith("+++ "):
+        diff_file.new_path = _strip_prefix(line[4:].rstrip("\t"))
+    elif line.startswith("Binary files ") or line == "GIT binary patch":
+        diff_file.is_binary = True
+
+
+def parse_diff(lines: Iterable[str]) -> Iterator[DiffFile]:
+    """
+    Incrementally parses `git diff` output.
+
+    Lines are consumed lazily, so every file is yielded as soon as the next one starts, before the whole
+    diff is read. Hunk bodies are delimited with their line counts, so their content is never mistaken
+    for a header, and a line that cannot belong to a hunk ends it early.
+
+    :param lines: The lines of the diff, with or without their line endings.
+    :return: An iterator of the diff of every file.
+    """
+    diff_file: DiffFile | None = None
+    hunk: Hunk | None = None
+    old_remaining = new_remaining = 0
+
+    for raw_line in lines:
+        line = raw_line.rstrip("\n")
+        if hunk is not None:
+            if line.startswith("\\"):
+                hunk.lines.append(line)
+                continue
+            # Hunk lines always start with a space, `+` or `-`, even when the line counts are wrong
+            if (old_remaining > 0 or new_remaining > 0) and (not line or line[0] in " +-"):
+                hunk.lines.append(line)
+                if line.startswith("+"):
+                    new_remaining -= 1
+                elif line.startswith("-"):
+                    old_remaining -= 1
+                else:
+                    old_remaining -= 1
+                    new_remaining -= 1
+                continue
+            hunk = None
+
+        if line.startswith("diff --git "):
+            if diff_file is not None:
+                yield diff_file
+            diff_file = DiffFile(line, *parse_header_paths(line))
+            continue
+        if diff_file is None:
+            # Anything before the first file, like the commit message of `git show`
+            continue
+        match = HUNK_PATTERN.match(line)
+        if match:
+            old_start, old_count, new_start, new_count, header = match.groups()
+            old_remaining = 1 if old_count is None else int(old_count)
+            new_remaining = 1 if new_count is None else int(new_count)
+            hunk = Hunk(int(old_start), old_remaining, int(new_start), new_remaining, header.strip())
+            diff_file.hunks.append(hunk)
+        else:
+            _parse_header_line(diff_file, line)
+
+    if diff_file is not None:
+        yield diff_file
@@ -0,0 +1,264 @@
+import itertools
+import threading
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from typing import TYPE_CHECKING, Any
+
+from utils.ai_feedback_filter import AIConsumerFeedbackResponse, FeedbackType
+from utils.packing import pack_files
+from utils.protocols import ReviewCancelled
+from utils.stats import call_context
+from utils.tokens import estimate_tokens
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future, ThreadPoolExecutor
+
+DEFAULT_MAX_WORKERS = 8
+
+# The partial feedback of a request, by the index of each file in its pack
+PartialFeedback = dict[int, dict[str, list[str]]]
+
+
+class Request:
+    """A call to make to review a pack of files, labelled like its `call_context` to predict its duration."""
+
+    __slots__ = ("function", "arguments", "file_name", "feedback_type", "input")
+
+    def __init__(
+        self,
+        function: Callable[..., PartialFeedback],
+        arguments: tuple[Any, ...],
+        file_name: str,
+        feedback_type: str,
+        input: str,
+    ):
+        self.function = function
+        self.arguments = arguments
+        self.file_name = file_name
+        self.feedback_type = feedback_type
+        self.input = input
+
+
+class ReviewDispatcher:
+    def __init__(
+        self,
+        feedback_response: AIConsumerFeedbackResponse,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        combined: bool = False,
+        pack_tokens: int = 0,
+        fail_fast: bool = False,
+        cancel_event: threading.Event | None = None,
+        predict_duration: Callable[[str, str, int], float] | None = None,
+    ):
+        """
+        Initializes the ReviewDispatcher.
+
+        :param feedback_response: The feedback response used to review each file.
+        :param max_workers: The maximum number of requests sent to the AI consumer at the same time.
+        :param combined: Whether to request all the feedback types of a file with a single call.
+        :param pack_tokens: The token budget used to pack several small files into a single request,
+            or 0 to send one request per file.
+        :param fail_fast: Whether to cancel every outstanding request once a request gets any feedback.
+        :param cancel_event: The event set to cancel the review, shared with the AI consumer so that it can
+            abort the calls in progress (default: a new event).
+        :param predict_duration: Predicts the duration of a request from its file name, feedback type and
+            estimated input tokens, like `ReviewHistory.predict`. When given, every file is read before
+            any request starts, and the longest requests start first, so that a slow file does not start
+            last and delay the whole review. Results are still yielded in file order.
+        """
+        if max_workers < 1:
+            raise ValueError(f"Invalid max workers: {max_workers}")
+        self.feedback_response = feedback_response
+        self.max_workers = max_workers
+        self.combined = combined
+        self.pack_tokens = pack_tokens
+        self.fail_fast = fail_fast
+        self.cancel_event = cancel_event or threading.Event()
+        self.predict_duration = predict_duration
+        # The files left without a complete review because the review was cancelled
+        self.unreviewed: list[str] = []
+
+    def review(
+        self,
+        files: Iterable[tuple[str, str | list[str]]],
+        feedback_types: list[FeedbackType],
+        file_feedback_types: Mapping[str, list[FeedbackType]] | None = None,
+    ) -> Iterator[tuple[str, dict[str, list[str]]]]:
+        """
+        Reviews every (file, feedback type) pair concurrently.
+
+        Each request is submitted as soon as its file is read from `files`, and the results are yielded
+        in the same order the files were given, no matter which request finishes first. The content of a
+        file may be split in several chunks, which are reviewed in parallel and whose feedback is merged.
+
+        Once the review is cancelled, the files without any feedback are not yielded but added to `unreviewed`.
+
+        :param files: The (file name, file content or chunks) pairs to review.
+        :param feedback_types: The types of feedback to request for each file.
+        :param file_feedback_types: The types of feedback to request for some files instead, by file name,
+            looked up when the file is read from `files`.
+        :return: An iterator of (file name, feedback) pairs, shaped like `get_all_feedback`.
+        """
+        # Imported here, as concurrent.futures is slow to import and not needed when there is nothing to review
+        from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        chunked_files = ((file_name, [input] if isinstance(input, str) else input) for file_name, input in files)
+        packs = pack_files(chunked_files, self.pack_tokens) if self.pack_tokens else ([file] for file in chunked_files)
+        try:
+            pending: list[tuple[list[tuple[str, list[str]]], list[Future[PartialFeedback]]]] = []
+            # The requests waiting for every file to be read, with the futures of their pack
+            scheduled: list[tuple[Request, list[Future[PartialFeedback]]]] = []
+            for pack in packs:
+                if self.cancel_event.is_set():
+                    self.unreviewed.extend(file_name for file_name, _ in pack)
+                    continue
+                pack_feedback_types = [
+                    (file_feedback_types or {}).get(file_name, feedback_types) for file_name, _ in pack
+                ]
+                requests = self._requests(pack, pack_feedback_types)
+                if self.predict_duration is None:
+                    futures = [self._start(executor, request) for request in requests]
+                else:
+                    futures = []
+                    scheduled.extend((request, futures) for request in requests)
+                pending.append((pack, futures))
+
+            if scheduled:
+                predict_duration = self.predict_duration
+                assert predict_duration is not None
+                durations = [
+                    predict_duration(request.file_name, request.feedback_type, estimate_tokens(request.input))
+                    for request, _ in scheduled
+                ]
+                # Longest first, the rest in file order
+                order = sorted(range(len(scheduled)), key=lambda index: -durations[index])
+                started: dict[int, Future[PartialFeedback]] = {}
+                for index in order:
+                    started[index] = self._start(executor, scheduled[index][0])
+                for index, (_, futures) in enumerate(scheduled):
+                    # Keep the futures of every pack in request order, so that chunks are merged in order
+                    futures.append(started[index])
+
+            for pack, futures in pending:
+                feedback: list[dict[str, list[str]]] = [
+                    {feedback_type.key: [] for feedback_type in FeedbackType} for _ in pack
+                ]
+                cancelled = False
+                for future in futures:
+                    try:
+                        partial_feedback = future.result()
+                    except (CancelledError, ReviewCancelled):
+                        cancelled = True
+                        continue
+                    for index, file_feedback in partial_feedback.items():
+                        self._merge(feedback[index], file_feedback)
+                for (file_name, _), file_feedback in zip(pack, feedback, strict=True):
+                    if cancelled and not any(file_feedback.values()):
+                        self.unreviewed.append(file_name)
+                    else:
+                        yield file_name, file_feedback
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _requests(self, pack: list[tuple[str, list[str]]], feedback_types: list[list[FeedbackType]]) -> list[Request]:
+        """
+        Lists the requests needed to review a pack of files.
+
+        Packs of several files get one request per feedback type, with the files that need it. Every chunk
+        of a single file gets one request per feedback type, or a single request in combined mode.
+
+        :param feedback_types: The types of feedback to request for each file of the pack.
+        :return: The requests, whose partial feedback is by the index of each file in the pack.
+        """
+        requests = []
+        if len(pack) > 1:
+            for feedback_type in dict.fromkeys(itertools.chain.from_iterable(feedback_types)):
+                indexes = [index for index, file_types in enumerate(feedback_types) if feedback_type in file_types]
+                files = [(pack[index][0], pack[index][1][0]) for index in indexes]
+                requests.append(
+                    Request(
+                        self._get_packed_feedback,
+                        (files, feedback_type, indexes),
+                        ", ".join(file_name for file_name, _ in files),
+                        feedback_type.value,
+                        "\n".join(input for _, input in files),
+                    )
+                )
+            return requests
+        file_name, chunks = pack[0]
+        file_feedback_types = feedback_types[0]
+        for input in chunks:
+            if self.combined and len(file_feedback_types) > 1:
+                label = "+".join(feedback_type.value for feedback_type in file_feedback_types)
+                requests.append(
+                    Request(
+                        self._get_combined_feedback, (file_name, input, file_feedback_types), file_name, label, input
+                    )
+                )
+            else:
+                requests.extend(
+                    Request(
+                        self._get_feedback, (file_name, input, feedback_type), file_name, feedback_type.value, input
+                    )
+                    for feedback_type in file_feedback_types
+                )
+        return requests
+
+    def _start(self, executor: "ThreadPoolExecutor", request: Request) -> "Future[PartialFeedback]":
+        future = executor.submit(request.function, *request.arguments)
+        if self.fail_fast:
+            future.add_done_callback(self._cancel_on_feedback)
+        return future
+
+    def _merge(self, feedback: dict[str, list[str]], partial_feedback: dict[str, list[str]]) -> None:
+        """
+        Merges the feedback of a request into the feedback of its file.
+
+        Lines already reported by another chunk of the same file are dropped.
+        """
+        for key, lines in partial_feedback.items():
+            reported = set(feedback[key])
+            feedback[key].extend(line for line in lines if line not in reported)
+
+    def _cancel_on_feedback(self, future: "Future[PartialFeedback]") -> None:
+        if future.cancelled() or future.exception() is not None:
+            return
+        if any(lines for file_feedback in future.result().values() for lines in file_feedback.values()):
+            self.cancel_event.set()
+
+    def _check_cancelled(self) -> None:
+        if self.cancel_event.is_set():
+            raise ReviewCancelled("Review cancelled")
+
+    def _get_feedback(
+        self,
+        file_name: str,
+        input: str,
+        feedback_type: FeedbackType,
+    ) -> PartialFeedback:
+        self._check_cancelled()
+        with call_context(file_name, feedback_type.value):
+            return {0: {feedback_type.key: self.feedback_response.get_feedback(input, feedback_type)}}
+
+    def _get_combined_feedback(
+        self,
+        file_name: str,
+        input: str,
+        feedback_types: list[FeedbackType],
+    ) -> PartialFeedback:
+        self._check_cancelled()
+        with call_context(file_name, "+".join(feedback_type.value for feedback_type in feedback_types)):
+            return {0: self.feedback_response.get_combined_feedback(input, feedback_types)}
+
+    def _get_packed_feedback(
+        self,
+        files: list[tuple[str, str]],
+        feedback_type: FeedbackType,
+        indexes: list[int],
+    ) -> PartialFeedback:
+        self._check_cancelled()
+        with call_context(", ".join(file_name for file_name, _ in files), feedback_type.value):
+            feedback = self.feedback_response.get_packed_feedback(files, feedback_type)
+        return {
+            index: {feedback_type.key: file_feedback} for index, file_feedback in zip(indexes, feedback, strict=True)
+        }
@@ -0,0 +1,297 @@
+import io
+import subprocess
+from collections.abc import Iterable, Iterator, Sequence
+from typing import TYPE_CHECKING
+
+from utils.diff_parser import DiffFile, parse_diff
+
+if TYPE_CHECKING:
+    from utils.stats import RunStats
+
+STAGED_DIFF_COMMAND = ["git", "diff", "--staged"]
+STAGED_NUMSTAT_COMMAND = ["git", "diff", "--staged", "--numstat", "-z"]
+CAT_FILE_COMMAND = ["git", "cat-file", "--batch"]
+# `--format=` drops the commit message, so that only the diff against the first parent is left
+COMMIT_DIFF_COMMAND = ["git", "show", "--format=", "--patch"]
+COMMIT_NUMSTAT_COMMAND = ["git", "show", "--format=", "--numstat", "-z"]
+PATCH_ID_COMMAND = ["git", "patch-id", "--stable"]
+TOPLEVEL_COMMAND = ["git", "rev-parse", "--show-toplevel"]
+
+
+class GitError(RuntimeError):
+    """Raised when a git command fails."""
+
+
+def pathspec(paths: Sequence[str]) -> list[str]:
+    """
+    Builds the arguments limiting a git command to the given paths, taken literally rather than as patterns.
+
+    :param paths: The paths, or none for the whole repository.
+    :return: The arguments to add at the end of the command.
+    """
+    return ["--", *(f":(literal){path}" for path in paths)] if paths else []
+
+
+def stream_diff(command: list[str], stats: "RunStats | None" = None) -> Iterator[DiffFile]:
+    """
+    Runs a git diff command and parses its output while git is still writing it.
+
+    :param command: The git command to run.
+    :param stats: Where the time spent waiting for git and parsing its output is recorded, if anywhere.
+    :return: An iterator of the diff of every file.
+    :raises GitError: If the command fails, once its output has been consumed.
+    """
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+        assert process.stdout is not None and process.stderr is not None
+        # Split on `\n` only, like git counts lines: a `\r` inside a line, or ending it, is part of the content
+        lines: Iterable[str] = io.TextIOWrapper(process.stdout, encoding="utf-8", errors="replace", newline="\n")
+        if stats is None:
+            yield from parse_diff(lines)
+        else:
+            yield from stats.timed(parse_diff(stats.timed(lines, "git diff")), "parsing")
+        stderr = process.stderr.read().decode("utf-8", errors="replace")
+        if process.wait() != 0:
+            raise GitError(stderr)
+
+
+def staged_diff(stats: "RunStats | None" = None, paths: Sequence[str] = ()) -> Iterator[DiffFile]:
+    """
+    Gets the changes that have been staged but not yet committed.
+
+    :param stats: Where the time spent waiting for git and parsing its output is recorded, if anywhere.
+    :param paths: The only files whose changes are wanted, or none for every file.
+    :return: An iterator of the diff of every staged file.
+    """
+    return stream_diff(STAGED_DIFF_COMMAND + pathspec(paths), stats)
+
+
+def range_diff(
+    from_ref: str, to_ref: str, stats: "RunStats | None" = None, paths: Sequence[str] = ()
+) -> Iterator[DiffFile]:
+    """
+    Gets the changes of a commit range, from the merge base of both refs like a merge request.
+
+    :param from_ref: The ref the range starts from, like the target branch.
+    :param to_ref: The ref the range ends at.
+    :param stats: Where the time spent waiting for git and parsing its output is recorded, if anywhere.
+    :param paths: The only files whose changes are wanted, or none for every file.
+    :return: An iterator of the diff of every changed file.
+    """
+    return stream_diff(["git", "diff", f"{from_ref}...{to_ref}", *pathspec(paths)], stats)
+
+
+def git_toplevel() -> str:
+    """
+    Gets the root of the working tree, which names the repository in the review history.
+
+    :return: The absolute path of the root.
+    :raises GitError: If the command fails, like outside a repository.
+    """
+    result = subprocess.run(TOPLEVEL_COMMAND, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise GitError(result.stderr)
+    return result.stdout.strip()
+
+
+def commit_diff(commit: str) -> Iterator[DiffFile]:
+    """
+    Gets the changes of a single commit, against its first parent.
+
+    :param commit: The commit.
+    :return: An iterator of the diff of every file changed by the commit.
+    """
+    return stream_diff([*COMMIT_DIFF_COMMAND, commit])
+
+
+def rev_list(from_ref: str, to_ref: str) -> list[str]:
+    """
+    Lists the commits reachable from a ref but not from another one, oldest first, merges excluded.
+
+    :param from_ref: The ref whose commits are excluded.
+    :param to_ref: The ref whose commits are listed.
+    :return: The commit hashes.
+    :raises GitError: If the command fails.
+    """
+    result = subprocess.run(
+        ["git", "rev-list", "--reverse", "--no-merges", f"{from_ref}..{to_ref}"], capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise GitError(result.stderr)
+    return result.stdout.split()
+
+
+def patch_ids(diff_files: list[DiffFile]) -> list[str | None]:
+    """
+    Computes the `git patch-id` of every file diff, which ignores line numbers and whitespace, so that the
+    same change applied in different places of the history gets the same id.
+
+    :param diff_files: The file diffs.
+    :return: The patch id of every file diff, or None for those without hunks, like binary files.
+    :raises GitError: If the command fails.
+    """
+    # Every file diff is passed as a separate commit, numbered by its index. Without hunks, git would only
+    # hash the file name, so every binary change of a file would get the same id
+    patches = [
+        f"commit {index:040x}\n{diff_file.patch()}\n"
+        for index, diff_file in enumerate(diff_files)
+        if diff_file.hunks and not diff_file.is_binary
+    ]
+    result = subprocess.run(PATCH_ID_COMMAND, input="".join(patches), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise GitError(result.stderr)
+    ids: list[str | None] = [None] * len(diff_files)
+    for line in result.stdout.splitlines():
+        patch_id, index = line.split()
+        ids[int(index, 16)] = patch_id
+    return ids
+
+
+def parse_numstat(output: str) -> dict[str, tuple[int | None, int | None]]:
+    """
+    Parses the output of `git diff --numstat -z`.
+
+    :param output: The NUL-separated numstat output.
+    :return: The added and deleted line counts of every path, or None for binary files.
+    """
+    stats: dict[str, tuple[int | None, int | None]] = {}
+    fields = output.split("\0")
+    index = 0
+    while index < len(fields) and fields[index]:
+        added, deleted, path = fields[index].split("\t", 2)
+        index += 1
+        if not path:
+            # Renames and copies are followed by their old and new paths
+            path = fields[index + 1]
+            index += 2
+        stats[path] = (
+            None if added == "-" else int(added),
+            None if deleted == "-" else int(deleted),
+        )
+    return stats
+
+
+def staged_numstat(
+    ignore_whitespace: bool = False, paths: Sequence[str] = ()
+) -> dict[str, tuple[int | None, int | None]]:
+    """
+    Gets the added and deleted line counts of every staged file.
+
+    :param ignore_whitespace: Whether to ignore whitespace changes, like `git diff -w`. Files whose only
+        changes are whitespace are then missing from the result.
+    :param paths: The only files whose line counts are wanted, or none for every file.
+    :return: The added and deleted line counts of every path, or None for binary files.
+    :raises GitError: If the command fails.
+    """
+    return _numstat(STAGED_NUMSTAT_COMMAND, ignore_whitespace, paths)
+
+
+def range_numstat(
+    from_ref: str, to_ref: str, ignore_whitespace: bool = False, paths: Sequence[str] = ()
+) -> dict[str, tuple[int | None, int | None]]:
+    """
+    Gets the added and deleted line counts of every file changed in a commit range, like `range_diff`.
+
+    :param from_ref: The ref the range starts from.
+    :param to_ref: The ref the range ends at.
+    :param ignore_whitespace: Whether to ignore whitespace changes, like `git diff -w`.
+    :param paths: The only files whose line counts are wanted, or none for every file.
+    :return: The added and deleted line counts of every path, or None for binary files.
+    :raises GitError: If the command fails.
+    """
+    return _numstat(["git", "diff", "--numstat", "-z", f"{from_ref}...{to_ref}"], ignore_whitespace, paths)
+
+
+def commit_numstat(commit: str, ignore_whitespace: bool = False) -> dict[str, tuple[int | None, int | None]]:
+    """
+    Gets the added and deleted line counts of every file changed by a commit, like `commit_diff`.
+
+    :param commit: The commit.
+    :param ignore_whitespace: Whether to ignore whitespace changes, like `git diff -w`.
+    :return: The added and deleted line counts of every path, or None for binary files.
+    :raises GitError: If the command fails.
+    """
+    return _numstat([*COMMIT_NUMSTAT_COMMAND, commit], ignore_whitespace)
+
+
+def _numstat(
+    command: list[str], ignore_whitespace: bool, paths: Sequence[str] = ()
+) -> dict[str, tuple[int | None, int | None]]:
+    result = subprocess.run(
+        command + (["-w"] if ignore_whitespace else []) + pathspec(paths),
+        capture_output=True,
+        text=True,
+        errors="replace",
+    )
+    if result.returncode != 0:
+        raise GitError(result.stderr)
+    return parse_numstat(result.stdout)
+
+
+def git_path(name: str) -> str:
+    """
+    Gets the path of a file in the git directory of the current repository, like `.git/index`.
+
+    :param name: The name of the file, relative to the git directory.
+    :return: The path of the file, which may not exist.
+    :raises GitError: If the current directory is not in a git repository.
+    """
+    result = subprocess.run(["git", "rev-parse", "--git-path", name], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise GitError(result.stderr)
+    return result.stdout.strip()
+
+
+class BlobReader:
+    """
+    Reads the content of files in the index or in a commit, all through a single `git cat-file --batch` process.
+    """
+
+    def __init__(self) -> None:
+        self.process: subprocess.Popen[bytes] | None = None
+
+    def __enter__(self) -> "BlobReader":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def read(self, path: str, revision: str = "") -> str | None:
+        """
+        Reads the content of a file.
+
+        :param path: The path of the file, relative to the repository root.
+        :param revision: The commit to read the file from, or an empty string to read its staged content.
+        :return: The content of the file, or None if it does not exist there.
+        :raises GitError: If git cannot be run.
+        """
+        if "\n" in path:
+            return None
+        if self.process is None:
+            try:
+                self.process = subprocess.Popen(
+                    CAT_FILE_COMMAND, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+                )
+            except OSError as e:
+                raise GitError(str(e)) from e
+        assert self.process.stdin is not None and self.process.stdout is not None
+        self.process.stdin.write(f"{revision}:{path}\n".encode())
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().decode("utf-8", errors="replace").split()
+        if len(header) != 3:
+            if not header:
+                raise GitError("git cat-file exited unexpectedly")
+            # `<object> missing`
+            return None
+        content = self.process.stdout.read(int(header[2]))
+        # Every object is followed by a newline
+        self.process.stdout.read(1)
+        return content.decode("utf-8", errors="replace")
+
+    def close(self) -> None:
+        if self.process is not None:
+            assert self.process.stdin is not None
+            self.process.stdin.close()
+            self.process.wait()
+            if self.process.stdout is not None:
+                self.process.stdout.close()
+            self.process = None
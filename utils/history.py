@@ -0,0 +1,198 @@
+import re
+import sqlite3
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from utils.review_cache import default_cache_dir
+
+if TYPE_CHECKING:
+    from utils.stats import CallRecord
+
+HISTORY_FILE = "history.sqlite3"
+# Past calls older than this are forgotten, in seconds
+DEFAULT_MAX_AGE = 90 * 24 * 3600
+# The number of recent calls of a request its predicted duration is averaged over
+RECENT_CALLS = 5
+# Seconds per estimated input token of the requests without any history, until some is recorded
+DEFAULT_SECONDS_PER_TOKEN = 0.001
+# The label `commit_files` puts before the path of the files of every commit
+COMMIT_PREFIX = re.compile(r"^[0-9a-f]{12}:")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    repo TEXT NOT NULL,
+    path TEXT NOT NULL,
+    feedback_type TEXT NOT NULL,
+    model TEXT NOT NULL,
+    latency REAL NOT NULL,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    cost REAL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS calls_by_request ON calls (repo, path, feedback_type, recorded_at);
+"""
+
+
+def history_path(file_name: str) -> str | None:
+    """
+    Gets the path of the file a call reviewed, from the file name it was labelled with.
+
+    :param file_name: The file name of the call, like `src/app.py` or `0123456789ab:src/app.py`.
+    :return: The path, or None for the calls reviewing several files at once.
+    """
+    if ", " in file_name:
+        return None
+    return COMMIT_PREFIX.sub("", file_name)
+
+
+class ReviewHistory:
+    """
+    Local SQLite database of the latency, token usage and cost of the past calls, by repository, path and
+    feedback type. It predicts how long a request will take, so that the longest ones can start first, and
+    tells which paths are the slowest and most expensive to review.
+
+    Every operation opens its own short-lived connection, so that several hooks can share the database.
+    Like the feedback cache, the history is best effort: a database that cannot be read or written is
+    treated as empty.
+    """
+
+    def __init__(self, repo: str, cache_dir: Path | str | None = None, max_age: float = DEFAULT_MAX_AGE):
+        """
+        Initializes the ReviewHistory. The database is only created on the first write.
+
+        :param repo: The repository the calls belong to, like the path of its working tree.
+        :param cache_dir: The directory of the database (default: `default_cache_dir()`).
+        :param max_age: The maximum age, in seconds, of the calls kept.
+        """
+        self.repo = repo
+        self.path = (Path(cache_dir) if cache_dir is not None else default_cache_dir()) / HISTORY_FILE
+        self.max_age = max_age
+        # Loaded on first use, by (path, feedback type)
+        self._latencies: dict[tuple[str, str], float] | None = None
+        self._seconds_per_token: dict[str, float] = {}
+
+    def record(self, calls: Iterable["CallRecord"]) -> int:
+        """
+        Records the successful calls of a run, and forgets the calls past the maximum age.
+
+        :param calls: The calls, like `RunStats.calls`.
+        :return: The number of calls recorded, 0 if the database cannot be written.
+        """
+        now = time.time()
+        rows = []
+        for call in calls:
+            path = history_path(call.file) if call.file is not None else None
+            if path is None or call.feedback_type is None or call.error is not None:
+                continue
+            rows.append(
+                (
+                    self.repo,
+                    path,
+                    call.feedback_type,
+                    call.model,
+                    call.latency,
+                    call.input_tokens,
+                    call.output_tokens,
+                    call.cost,
+                    now,
+                )
+            )
+        if not rows:
+            return 0
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self._connect() as connection:
+                connection.executemany("INSERT INTO calls VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                connection.execute("DELETE FROM calls WHERE recorded_at < ?", (now - self.max_age,))
+        except (OSError, sqlite3.Error):
+            return 0
+        self._latencies = None
+        return len(rows)
+
+    def predict(self, file_name: str, feedback_type: str, tokens: int) -> float:
+        """
+        Predicts the duration of a request: the average latency of the recent calls of the same path and
+        feedback type, or the latency per input token of the feedback type times the size of the request.
+
+        :param file_name: The name of the reviewed file.
+        :param feedback_type: The feedback type of the request, like `SECURITY` or `REVIEW+SECURITY`.
+        :param tokens: The estimated input tokens of the request.
+        :return: The predicted duration, in seconds.
+        """
+        if self._latencies is None:
+            self._load()
+            assert self._latencies is not None
+        path = history_path(file_name)
+        if path is not None and (path, feedback_type) in self._latencies:
+            return self._latencies[path, feedback_type]
+        return tokens * self._seconds_per_token.get(feedback_type, DEFAULT_SECONDS_PER_TOKEN)
+
+    def paths(self, order_by: str = "latency", limit: int = 10) -> list[dict[str, Any]]:
+        """
+        Sums up the calls of every path of the repository.
+
+        :param order_by: `latency` to list the slowest paths first, by average latency per call, or `cost`
+            to list the most expensive ones first, by total cost.
+        :param limit: The maximum number of paths listed.
+        :return: The calls, average and maximum latency, tokens and cost of every path, or none if the history
+            cannot be read.
+        """
+        if order_by not in ("latency", "cost"):
+            raise ValueError(f"Invalid order: {order_by}")
+        if not self.path.exists():
+            return []
+        order = "average_latency" if order_by == "latency" else "cost"
+        try:
+            with self._connect() as connection:
+                cursor = connection.execute(
+                    "SELECT path, COUNT(*) AS calls, AVG(latency) AS average_latency, MAX(latency) AS max_latency, "
+                    "SUM(COALESCE(input_tokens, 0)) AS input_tokens, "
+                    "SUM(COALESCE(output_tokens, 0)) AS output_tokens, SUM(COALESCE(cost, 0)) AS cost "
+                    f"FROM calls WHERE repo = ? GROUP BY path ORDER BY {order} DESC, path LIMIT ?",
+                    (self.repo, limit),
+                )
+                columns = [column[0] for column in cursor.description]
+                return [dict(zip(columns, row, strict=True)) for row in cursor]
+        except (OSError, sqlite3.Error):
+            return []
+
+    def _load(self) -> None:
+        """Loads the recent latencies of every request of the repository, and the latency per token."""
+        self._latencies = {}
+        if not self.path.exists():
+            return
+        recent: dict[tuple[str, str], list[float]] = {}
+        try:
+            with self._connect() as connection:
+                cursor = connection.execute(
+                    "SELECT path, feedback_type, latency FROM calls WHERE repo = ? ORDER BY recorded_at DESC",
+                    (self.repo,),
+                )
+                for path, feedback_type, latency in cursor:
+                    latencies = recent.setdefault((path, feedback_type), [])
+                    if len(latencies) < RECENT_CALLS:
+                        latencies.append(latency)
+                cursor = connection.execute(
+                    "SELECT feedback_type, SUM(latency) / SUM(input_tokens) FROM calls "
+                    "WHERE repo = ? AND input_tokens > 0 GROUP BY feedback_type",
+                    (self.repo,),
+                )
+                self._seconds_per_token = dict(cursor.fetchall())
+        except (OSError, sqlite3.Error):
+            return
+        self._latencies = {key: sum(latencies) / len(latencies) for key, latencies in recent.items()}
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Opens a connection to the database, whose changes are committed when the block succeeds."""
+        connection = sqlite3.connect(self.path, timeout=5)
+        try:
+            connection.executescript(SCHEMA)
+            with connection:
+                yield connection
+        finally:
+            connection.close()
@@ -0,0 +1,74 @@
+import io
+import sys
+from collections.abc import Iterator
+from contextlib import contextmanager, redirect_stdout
+from pathlib import Path
+from typing import TextIO
+
+
+@contextmanager
+def file_lock(path: Path | str) -> Iterator[TextIO]:
+    """
+    Holds an exclusive lock on a file, shared by every process locking the same file.
+
+    :param path: The path of the file, created if missing.
+    :return: The file, open for reading and appending while the lock is held.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+", encoding="utf-8") as file:
+        _lock(file)
+        try:
+            yield file
+        finally:
+            _unlock(file)
+
+
+def _lock(file: TextIO) -> None:
+    """Locks an open file, waiting for the other holders. Without file locks on the platform, does nothing."""
+    if sys.platform == "win32":
+        import msvcrt
+
+        # Locks the first byte, which every holder locks, whatever the size of the file
+        file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # Raised after 10 seconds of waiting
+                continue
+    try:
+        # Imported here, as fcntl is missing on Windows
+        import fcntl
+    except ImportError:
+        return
+    fcntl.flock(file, fcntl.LOCK_EX)
+
+
+def _unlock(file: TextIO) -> None:
+    """Unlocks a file locked by `_lock`."""
+    if sys.platform == "win32":
+        import msvcrt
+
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+    # fcntl locks are released when the file is closed
+
+
+@contextmanager
+def serialized_output(lock_path: Path | str) -> Iterator[None]:
+    """
+    Buffers everything printed in the block, then prints it at once while holding a lock, so that the
+    output of several processes writing to the same terminal is not interleaved.
+
+    :param lock_path: The lock file shared by the processes.
+    """
+    buffer = io.StringIO()
+    try:
+        with redirect_stdout(buffer):
+            yield
+    finally:
+        with file_lock(lock_path):
+            sys.stdout.write(buffer.getvalue())
+            sys.stdout.flush()
@@ -1,29 +1,247 @@
-from openai import OpenAI, OpenAIError
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, Any
+
+from utils.protocols import ReviewCancelled, ReviewTimedOut
+from utils.routing import DEFAULT_MODEL
+from utils.tokens import estimate_tokens
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_DEADLINE = 60.0
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+if TYPE_CHECKING:
+    from openai import OpenAI, OpenAIError
+
+    from utils.rate_limit import RateLimiter
+    from utils.stats import RunStats
+
+
+def retry_after(error: "OpenAIError") -> float | None:
+    """
+    Gets how long the API asked to wait before retrying, from the Retry-After headers of its response.
+
+    :param error: The error raised by the API call.
+    :return: The time to wait, in seconds, or None if the API did not say.
+    """
+    from openai import APIStatusError
+
+    if not isinstance(error, APIStatusError):
+        return None
+    headers = error.response.headers
+    try:
+        return max(0.0, float(headers["retry-after-ms"]) / 1000)
+    except (KeyError, ValueError):
+        pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # Retry-After may also be an HTTP date
+    import email.utils
+
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: "OpenAIError") -> bool:
+    """
+    Whether the error is transient: a connection error, a timeout, a rate limit or a server error.
+    """
+    from openai import APIConnectionError, APIStatusError
+
+    if isinstance(error, APIConnectionError):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code in RETRYABLE_STATUS_CODES
 
 
 class OpenAIConsumer:
-    def __init__(self):
+    def __init__(
+        self,
+        base_url: str | None = None,
+        api_key: str | None = None,
+        stats: "RunStats | None" = None,
+        rate_limiter: "RateLimiter | None" = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        retry_deadline: float = DEFAULT_RETRY_DEADLINE,
+        backoff_base: float = 0.5,
+        backoff_max: float = 20.0,
+        stream: bool = False,
+        cancel_event: threading.Event | None = None,
+        deadline: float | None = None,
+    ):
         """
         Initializes the OpenAIConsumer with the provided API key.
+
+        :param base_url: The URL of an OpenAI compatible API (default: OPENAI_BASE_URL or the OpenAI API).
+        :param api_key: The API key (default: OPENAI_API_KEY).
+        :param stats: Where the latency and token usage of every call are recorded, if anywhere.
+        :param rate_limiter: The limiter of requests and tokens per minute shared by every call, if any.
+        :param max_retries: The maximum number of retries of a call failing with a transient error.
+        :param retry_deadline: The maximum time, in seconds, spent retrying a call since its first attempt.
+        :param backoff_base: The delay before the first retry, doubled on every retry, in seconds.
+        :param backoff_max: The maximum delay between two retries, in seconds.
+        :param stream: Whether to stream the responses, so that a cancelled call stops as soon as possible
+            instead of waiting for its whole response.
+        :param cancel_event: Cancels the calls in progress and makes new calls fail when set, if given.
+        :param deadline: The `time.monotonic()` after which calls fail, if any. The timeout of every request
+            is the time left until then, and no retry is attempted past it.
         """
-        # OPENAI_API_KEY is set as an environment variable
-        self.client = OpenAI()
+        self.base_url = base_url
+        self.api_key = api_key
+        self._client: OpenAI | None = None
+        self.stats = stats
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.retry_deadline = retry_deadline
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stream = stream
+        self.cancel_event = cancel_event
+        self.deadline = deadline
+
+    @property
+    def client(self) -> "OpenAI":
+        """
+        The OpenAI client, built on first use: importing the SDK takes longer than most hook runs that
+        need no request at all.
+        """
+        if self._client is None:
+            from openai import OpenAI
+
+            # OPENAI_API_KEY is set as an environment variable. Retries are handled here, not by the SDK
+            self._client = OpenAI(base_url=self.base_url, api_key=self.api_key, max_retries=0)
+        return self._client
 
-    def generate_text(self, instructions: str, input: str, model: str = "gpt-4o-mini") -> str:
+    def generate_text(self, instructions: str, input: str, model: str = DEFAULT_MODEL) -> str:
         """
         Generates text using OpenAI's API.
 
-        :param prompt: The input prompt for the model.
-        :param model: The model to use for text generation (default: "text-davinci-003").
-        :param max_tokens: The maximum number of tokens to generate (default: 100).
+        Transient errors are retried with exponential backoff and full jitter, waiting at least as long as
+        the API asks with Retry-After, as long as the retry deadline allows it.
+
+        :param instructions: The system instructions for the model.
+        :param input: The input for the model.
+        :param model: The model to use for text generation (default: DEFAULT_MODEL).
         :return: The generated text.
+        :raises RuntimeError: If the call fails with a permanent error or runs out of retries.
+        :raises ReviewCancelled: If the cancel event is set before the call completes.
+        :raises ReviewTimedOut: If the deadline passes before the call completes.
+        """
+        from openai import APITimeoutError, OpenAIError
+
+        tokens = estimate_tokens(instructions) + estimate_tokens(input)
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.retry_deadline
+        if self.deadline is not None:
+            deadline = min(deadline, self.deadline)
+        retries = 0
+        while True:
+            try:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire(tokens, self.cancel_event)
+                self._check_cancelled()
+                text, usage = self._create(instructions, input, model, self._timeout())
+                break
+            except ReviewCancelled as e:
+                if self.stats is not None:
+                    error = "timed out" if isinstance(e, ReviewTimedOut) else "cancelled"
+                    self.stats.record_call(model, time.perf_counter() - start, retries=retries, error=error)
+                raise
+            except OpenAIError as e:
+                # A request cut short by the deadline fails with a timeout error, and is not worth retrying
+                timed_out = self.deadline is not None and (
+                    isinstance(e, APITimeoutError) or time.monotonic() >= self.deadline
+                )
+                delay = None if timed_out else self._retry_delay(e, retries, deadline)
+                if delay is None:
+                    if self.stats is not None:
+                        error = "timed out" if timed_out else str(e)
+                        self.stats.record_call(model, time.perf_counter() - start, retries=retries, error=error)
+                    if timed_out:
+                        raise ReviewTimedOut("Review deadline reached") from e
+                    raise RuntimeError(f"Error generating text: {e}") from e
+                retries += 1
+                if self.cancel_event is not None:
+                    # Stop waiting as soon as the review is cancelled
+                    self.cancel_event.wait(delay)
+                else:
+                    time.sleep(delay)
+        if self.stats is not None:
+            self.stats.record_call(model, time.perf_counter() - start, usage=usage, retries=retries)
+        return text
+
+    def _timeout(self) -> float | None:
+        """
+        Gets the timeout of the next request: the time left until the deadline, if any.
+
+        :raises ReviewTimedOut: If the deadline has passed.
+        """
+        if self.deadline is None:
+            return None
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise ReviewTimedOut("Review deadline reached")
+        return remaining
+
+    def _create(self, instructions: str, input: str, model: str, timeout: float | None = None) -> tuple[str, Any]:
         """
-        try:
+        Makes a single call to the Responses API.
+
+        :param timeout: The timeout of the request, in seconds (default: the timeout of the client).
+        :return: The generated text and the token usage of the response.
+        """
+        options: dict[str, Any] = {"timeout": timeout} if timeout is not None else {}
+        if not self.stream:
             response = self.client.responses.create(
                 model=model,
                 instructions=instructions,
                 input=input,
+                **options,
             )
-            return response.output_text
-        except OpenAIError as e:
-            raise RuntimeError(f"Error generating text: {e}") from e
+            return response.output_text, response.usage
+
+        deltas = []
+        with self.client.responses.create(
+            model=model, instructions=instructions, input=input, stream=True, **options
+        ) as events:
+            for event in events:
+                # Closing the stream drops the connection, so the API stops generating the response
+                self._check_cancelled()
+                if event.type == "response.output_text.delta":
+                    deltas.append(event.delta)
+                elif event.type == "response.completed":
+                    return "".join(deltas), event.response.usage
+                elif event.type == "error":
+                    raise RuntimeError(f"Error generating text: {event.message}")
+                elif event.type in ("response.failed", "response.incomplete"):
+                    raise RuntimeError(f"Error generating text: {event.type}")
+        raise RuntimeError("Error generating text: the response stream ended before completing")
+
+    def _check_cancelled(self) -> None:
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ReviewCancelled("Review cancelled")
+
+    def _retry_delay(self, error: "OpenAIError", retries: int, deadline: float) -> float | None:
+        """
+        Gets how long to wait before retrying a failed call.
+
+        :return: The delay in seconds, or None if the call should not be retried.
+        """
+        if retries >= self.max_retries or not is_retryable(error):
+            return None
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2**retries))
+        requested = retry_after(error)
+        if requested is not None:
+            delay = max(delay, requested)
+            if self.rate_limiter is not None:
+                self.rate_limiter.throttle(requested)
+        if time.monotonic() + delay > deadline:
+            return None
+        return delay
@@ -0,0 +1,33 @@
+from collections.abc import Iterable, Iterator
+
+from utils.tokens import estimate_tokens
+
+# Estimated tokens added by the delimiter line of every packed file
+FILE_HEADER_TOKENS = 16
+
+
+def pack_files(
+    files: Iterable[tuple[str, list[str]]],
+    token_budget: int,
+) -> Iterator[list[tuple[str, list[str]]]]:
+    """
+    Groups consecutive files into packs whose estimated size fits the token budget.
+
+    Files are read lazily and keep their order. A file that does not fit the budget, or that was
+    split in several chunks, is always yielded in a pack of its own.
+
+    :param files: The (file name, file chunks) pairs to pack.
+    :param token_budget: The maximum estimated number of input tokens of a pack.
+    :return: An iterator of packs of (file name, file chunks) pairs.
+    """
+    pack: list[tuple[str, list[str]]] = []
+    pack_tokens = 0
+    for file_name, chunks in files:
+        tokens = token_budget + 1 if len(chunks) > 1 else estimate_tokens(chunks[0]) + FILE_HEADER_TOKENS
+        if pack and pack_tokens + tokens > token_budget:
+            yield pack
+            pack, pack_tokens = [], 0
+        pack.append((file_name, chunks))
+        pack_tokens += tokens
+    if pack:
+        yield pack
@@ -0,0 +1,40 @@
+# USD per million (input, cached input, output) tokens
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "o4-mini": (1.10, 0.275, 4.40),
+    "o3-mini": (1.10, 0.55, 4.40),
+}
+
+
+def model_prices(model: str) -> tuple[float, float, float] | None:
+    """
+    Gets the prices of a model, matching dated snapshots like `gpt-4o-mini-2024-07-18` too.
+
+    :param model: The model name.
+    :return: The USD prices per million input, cached input and output tokens, or None if unknown.
+    """
+    matches = [name for name in MODEL_PRICES if model == name or model.startswith(f"{name}-")]
+    return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int, cached_tokens: int = 0) -> float | None:
+    """
+    Estimates the cost of a call.
+
+    :param model: The model name.
+    :param input_tokens: The input tokens, including the cached ones.
+    :param output_tokens: The output tokens.
+    :param cached_tokens: The input tokens served from the provider's prompt cache.
+    :return: The estimated cost in USD, or None if the model prices are unknown.
+    """
+    prices = model_prices(model)
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    return (
+        (input_tokens - cached_tokens) * input_price + cached_tokens * cached_price + output_tokens * output_price
+    ) / 1e6
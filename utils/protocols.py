@@ -4,3 +4,11 @@ from typing import Protocol
 class AIConsumerProtocol(Protocol):
     def generate_text(self, instructions: str, input: str, model: str):
         pass
+
+
+class ReviewCancelled(RuntimeError):
+    """Raised by an AI consumer when the review it is part of has been cancelled."""
+
+
+class ReviewTimedOut(ReviewCancelled):
+    """Raised by an AI consumer when the deadline of the review it is part of has passed."""
@@ -0,0 +1,147 @@
+import json
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+from utils.locking import file_lock
+from utils.protocols import ReviewCancelled
+
+ENV_RPM = "AI_REVIEW_RPM"
+ENV_TPM = "AI_REVIEW_TPM"
+# The file of the budgets shared by every process, in the cache directory
+STATE_FILE = "rate_limit.json"
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` units per minute, holding up to a minute worth of units.
+    """
+
+    def __init__(self, per_minute: float, now: float | None = None):
+        """
+        Initializes the TokenBucket, full.
+
+        :param per_minute: The number of units allowed per minute.
+        :param now: The current time of the clock the bucket is refilled with (default: `time.monotonic()`).
+        """
+        if per_minute <= 0:
+            raise ValueError(f"Invalid rate: {per_minute}")
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.available = self.capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def refill(self, now: float) -> None:
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Gets how long to wait until the given amount is available. Amounts over the capacity wait for a full bucket.
+        """
+        return max(0.0, min(amount, self.capacity) - self.available) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.available -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Client-side limiter of the requests and tokens sent per minute, shared by every thread of the hook.
+
+    Callers block in `acquire` until both budgets allow their request, so concurrent reviews throttle
+    themselves instead of being rejected by the API. With a state file, the budgets are also shared by
+    every process using the same file, like the hooks pre-commit runs in parallel: they are read from and
+    written to the file under a file lock, and refilled with the wall clock.
+    """
+
+    def __init__(
+        self, requests_per_minute: float = 0, tokens_per_minute: float = 0, state_path: Path | str | None = None
+    ):
+        """
+        Initializes the RateLimiter.
+
+        :param requests_per_minute: The maximum requests per minute, or 0 for no limit.
+        :param tokens_per_minute: The maximum estimated input tokens per minute, or 0 for no limit.
+        :param state_path: The file where the budgets are shared with other processes, if any.
+        """
+        self.state_path = Path(state_path) if state_path is not None else None
+        # Unlike monotonic time, wall clock time is the same in every process
+        self.clock = time.time if self.state_path is not None else time.monotonic
+        now = self.clock()
+        self.requests = TokenBucket(requests_per_minute, now) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute, now) if tokens_per_minute > 0 else None
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: int = 0, cancel_event: threading.Event | None = None) -> float:
+        """
+        Blocks until a request of the given size can be sent, then takes it from the budgets.
+
+        :param tokens: The estimated tokens of the request.
+        :param cancel_event: Stops the wait when set, if given.
+        :return: The time spent waiting, in seconds.
+        :raises ReviewCancelled: If the cancel event is set while waiting.
+        """
+        start = time.monotonic()
+        while True:
+            with self._budgets():
+                now = self.clock()
+                buckets = [(bucket, amount) for bucket, amount in ((self.requests, 1), (self.tokens, tokens)) if bucket]
+                for bucket, _ in buckets:
+                    bucket.refill(now)
+                wait = max((bucket.wait_time(amount) for bucket, amount in buckets), default=0.0)
+                if wait <= 0:
+                    for bucket, amount in buckets:
+                        bucket.take(amount)
+                    return time.monotonic() - start
+            if cancel_event is None:
+                time.sleep(wait)
+            elif cancel_event.wait(wait):
+                raise ReviewCancelled("Review cancelled")
+
+    def throttle(self, retry_after: float) -> None:
+        """
+        Empties the request budget after the API rejected a request, so other threads back off too.
+
+        :param retry_after: How long the API asked to wait, in seconds.
+        """
+        if self.requests is None:
+            return
+        with self._budgets():
+            self.requests.refill(self.clock())
+            # The next request is allowed once retry_after has elapsed
+            self.requests.available = min(self.requests.available, 1 - retry_after * self.requests.rate)
+
+    @contextmanager
+    def _budgets(self) -> Iterator[None]:
+        """Holds the budgets, loaded from the state file and saved back to it when they are shared."""
+        with self.lock:
+            if self.state_path is None:
+                yield
+                return
+            buckets = {"requests": self.requests, "tokens": self.tokens}
+            with file_lock(self.state_path) as file:
+                file.seek(0)
+                try:
+                    state = json.loads(file.read() or "{}")
+                except ValueError:
+                    # Left behind by a process that did not finish writing it
+                    state = {}
+                for name, bucket in buckets.items():
+                    if bucket is not None and isinstance(state.get(name), list):
+                        available, updated = state[name]
+                        # The other processes may have other limits
+                        bucket.available, bucket.updated = min(available, bucket.capacity), updated
+                yield
+                file.seek(0)
+                file.truncate()
+                json.dump(
+                    {
+                        name: [bucket.available, bucket.updated]
+                        for name, bucket in buckets.items()
+                        if bucket is not None
+                    },
+                    file,
+                )
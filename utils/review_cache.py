@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+DEFAULT_MAX_ENTRIES = 10_000
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+# The entries, sharded by the first two hexadecimal digits of their key, apart from the other state kept in the
+# cache directory, like the batches to resume
+ENTRY_PATTERN = "[0-9a-f][0-9a-f]/*.json"
+
+
+def default_cache_dir() -> Path:
+    """
+    Returns the default cache directory, following the XDG base directory specification.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "ai-review"
+
+
+def normalize_diff(input: str) -> str:
+    """
+    Normalizes a file diff so that equivalent diffs share the same cache key.
+
+    :param input: The file diff.
+    :return: The diff with unified line endings and without surrounding blank lines.
+    """
+    return input.replace("\r\n", "\n").strip("\n")
+
+
+class ReviewCache:
+    """
+    On-disk, content-addressed cache of AI feedback.
+
+    Every entry is a small JSON file named after its key. Writes go to a temporary file that is atomically
+    renamed into place, so several hooks can share the same directory. Reads refresh the file modification
+    time, which `prune` uses to evict the least recently used entries. `hits` and `misses` count the lookups.
+
+    Long-lived processes can also keep the most recently used entries in memory, in front of the disk.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path | str | None = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age: float = DEFAULT_MAX_AGE,
+        memory_entries: int = 0,
+        read_only: bool = False,
+    ):
+        """
+        Initializes the ReviewCache. The directory is only created on the first write.
+
+        :param cache_dir: The directory where entries are stored (default: `default_cache_dir()`).
+        :param max_entries: The maximum number of entries kept after pruning.
+        :param max_bytes: The maximum total size of the entries kept after pruning.
+        :param max_age: The maximum age, in seconds, of an entry before it is considered stale.
+        :param memory_entries: The number of entries also kept in memory, or 0 to always read the disk.
+        :param read_only: Whether to ignore `set`, to look feedback up without storing any.
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.memory_entries = memory_entries
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, tuple[float, list[str]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        """
+        Builds a cache key from the given parts.
+
+        :param parts: The values that identify a cached response.
+        :return: The hexadecimal SHA-256 digest of the parts.
+        """
+        return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> list[str] | None:
+        """
+        Gets the feedback stored for the given key.
+
+        :param key: The cache key.
+        :return: The cached feedback, or None if it is missing or stale.
+        """
+        feedback = self._read_memory(key)
+        if feedback is None:
+            entry = self._read(key)
+            if entry is not None:
+                self._remember(key, *entry)
+                feedback = entry[1]
+        with self._lock:
+            if feedback is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return list(feedback) if feedback is not None else None
+
+    def set(self, key: str, feedback: list[str]) -> None:
+        """
+        Stores the feedback for the given key.
+
+        The cache is only an optimization: if the entry cannot be written, like in a read-only or full
+        directory, it is not stored.
+
+        :param key: The cache key.
+        :param feedback: The feedback to store.
+        """
+        if self.read_only:
+            return
+        created = time.time()
+        self._remember(key, created, list(feedback))
+        path = self._path(key)
+        temporary_path = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=path.parent, suffix=".tmp", delete=False
+            ) as file:
+                temporary_path = file.name
+                json.dump({"created": created, "feedback": feedback}, file)
+            os.replace(temporary_path, path)
+        except OSError:
+            if temporary_path is not None:
+                Path(temporary_path).unlink(missing_ok=True)
+
+    def delete(self, key: str) -> None:
+        """
+        Removes the entry stored for the given key, if any.
+
+        :param key: The cache key.
+        """
+        with self._lock:
+            self._memory.pop(key, None)
+        self._path(key).unlink(missing_ok=True)
+
+    def prune(self) -> int:
+        """
+        Removes stale entries, then the least recently used ones until the size limits are met.
+
+        :return: The number of removed entries.
+        """
+        if not self.cache_dir.is_dir():
+            return 0
+        now = time.time()
+        entries = []
+        removed = 0
+        for path in self.cache_dir.glob(ENTRY_PATTERN):
+            try:
+                stat = path.stat()
+                if now - stat.st_mtime > self.max_age:
+                    path.unlink()
+                    removed += 1
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                # Another hook removed it first, or the directory is read-only
+                continue
+
+        entries.sort(reverse=True)
+        total_bytes = 0
+        for index, (_, size, path) in enumerate(entries):
+            total_bytes += size
+            if index >= self.max_entries or total_bytes > self.max_bytes:
+                try:
+                    path.unlink(missing_ok=True)
+                except OSError:
+                    continue
+                removed += 1
+        return removed
+
+    def _read_memory(self, key: str) -> list[str] | None:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.max_age:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return entry[1]
+
+    def _remember(self, key: str, created: float, feedback: list[str]) -> None:
+        if not self.memory_entries:
+            return
+        with self._lock:
+            self._memory[key] = (created, feedback)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _read(self, key: str) -> tuple[float, list[str]] | None:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as file:
+                entry = json.load(file)
+            if time.time() - entry["created"] > self.max_age:
+                path.unlink(missing_ok=True)
+                return None
+            # Mark the entry as recently used
+            os.utime(path)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return entry["created"], list(entry["feedback"])
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
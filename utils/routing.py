@@ -0,0 +1,163 @@
+from collections.abc import Iterable
+from typing import TYPE_CHECKING, Any
+
+from utils.diff_parser import parse_header_paths
+from utils.skip_rules import matches
+from utils.tokens import estimate_tokens
+
+if TYPE_CHECKING:
+    from utils.ai_feedback_filter import FeedbackType
+
+DEFAULT_MODEL = "gpt-4o-mini"
+# Separates the values of a route condition, like `types=FORMAT|REVIEW`
+VALUE_SEPARATOR = "|"
+
+
+class Route:
+    """A model, and the requests it reviews: by feedback type, file pattern and estimated input size."""
+
+    __slots__ = ("model", "feedback_types", "files", "min_tokens", "max_tokens")
+
+    def __init__(
+        self,
+        model: str,
+        feedback_types: Iterable[str] = (),
+        files: Iterable[str] = (),
+        min_tokens: int = 0,
+        max_tokens: int | None = None,
+    ):
+        """
+        Initializes the Route. Every condition left to its default matches any request.
+
+        :param model: The model of the matching requests.
+        :param feedback_types: The feedback type values the route applies to.
+        :param files: The glob patterns of the files the route applies to.
+        :param min_tokens: The minimum estimated tokens of the input.
+        :param max_tokens: The maximum estimated tokens of the input, if any.
+        """
+        self.model = model
+        self.feedback_types = frozenset(value.upper() for value in feedback_types)
+        self.files = tuple(files)
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+
+    def __repr__(self) -> str:
+        return f"Route({self.to_spec()!r})"
+
+    @classmethod
+    def parse(cls, spec: str) -> "Route":
+        """
+        Parses a route like `model=gpt-4.1,types=SECURITY,files=*.py|*.js,min-tokens=2000,max-tokens=8000`.
+
+        :param spec: The comma-separated `key=value` conditions of the route. Only the model is required.
+        :return: The route.
+        :raises ValueError: If the route is malformed.
+        """
+        fields: dict[str, str] = {}
+        for condition in spec.split(","):
+            key, separator, value = condition.partition("=")
+            if not separator or not value.strip():
+                raise ValueError(f"Invalid route condition: {condition!r}")
+            fields[key.strip()] = value.strip()
+        if "model" not in fields:
+            raise ValueError(f"Route without a model: {spec!r}")
+        unknown = set(fields) - {"model", "types", "files", "min-tokens", "max-tokens"}
+        if unknown:
+            raise ValueError(f"Unknown route conditions: {', '.join(sorted(unknown))}")
+        return cls(
+            fields["model"],
+            feedback_types=fields["types"].split(VALUE_SEPARATOR) if "types" in fields else (),
+            files=fields["files"].split(VALUE_SEPARATOR) if "files" in fields else (),
+            min_tokens=int(fields.get("min-tokens", 0)),
+            max_tokens=int(fields["max-tokens"]) if "max-tokens" in fields else None,
+        )
+
+    def to_spec(self) -> str:
+        """
+        Formats the route like `parse` expects it.
+        """
+        fields = [f"model={self.model}"]
+        if self.feedback_types:
+            fields.append(f"types={VALUE_SEPARATOR.join(sorted(self.feedback_types))}")
+        if self.files:
+            fields.append(f"files={VALUE_SEPARATOR.join(self.files)}")
+        if self.min_tokens:
+            fields.append(f"min-tokens={self.min_tokens}")
+        if self.max_tokens is not None:
+            fields.append(f"max-tokens={self.max_tokens}")
+        return ",".join(fields)
+
+    def matches(self, path: str | None, tokens: int, feedback_type: "FeedbackType") -> bool:
+        """
+        Whether the route applies to a request.
+
+        :param path: The path of the reviewed file, if known.
+        :param tokens: The estimated tokens of the input.
+        :param feedback_type: The requested feedback type.
+        :return: Whether every condition of the route holds.
+        """
+        if self.feedback_types and feedback_type.value not in self.feedback_types:
+            return False
+        if self.files and (path is None or not matches(path, self.files)):
+            return False
+        return self.min_tokens <= tokens and (self.max_tokens is None or tokens <= self.max_tokens)
+
+
+class ModelRouter:
+    """
+    Chooses the model of every request: the model of the first route that applies to it, or the default one.
+
+    The model only depends on the input and the feedback type, so the cache keys of a request can always
+    be computed again, whichever way it was sent.
+    """
+
+    def __init__(self, routes: Iterable[Route] = (), default_model: str = DEFAULT_MODEL):
+        """
+        Initializes the ModelRouter.
+
+        :param routes: The routes, by priority.
+        :param default_model: The model of the requests no route applies to.
+        """
+        self.routes = list(routes)
+        self.default_model = default_model
+
+    def model_for(self, input: str, feedback_type: "FeedbackType") -> str:
+        """
+        Chooses the model of a request.
+
+        :param input: The input of the request: a file diff, which starts with its `diff --git` header.
+        :param feedback_type: The requested feedback type.
+        :return: The model.
+        """
+        if not self.routes:
+            return self.default_model
+        tokens = estimate_tokens(input)
+        path = input_path(input)
+        for route in self.routes:
+            if route.matches(path, tokens, feedback_type):
+                return route.model
+        return self.default_model
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        Gets the router as a JSON serializable dict, for `from_dict`.
+        """
+        return {"model": self.default_model, "routes": [route.to_spec() for route in self.routes]}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "ModelRouter":
+        return cls([Route.parse(spec) for spec in data["routes"]], data["model"])
+
+
+def input_path(input: str) -> str | None:
+    """
+    Gets the path of the file reviewed by an input, from its `diff --git` header.
+
+    :param input: The input of a request.
+    :return: The path, or None if the input does not start with a header.
+    """
+    header = input.split("\n", 1)[0]
+    if not header.startswith("diff --git "):
+        return None
+    old_path, new_path = parse_header_paths(header)
+    return new_path or old_path
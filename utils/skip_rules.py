@@ -0,0 +1,133 @@
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from enum import Enum
+from fnmatch import fnmatchcase
+
+from utils.diff_parser import DiffFile, FileStatus
+
+DEFAULT_EXCLUDE = (
+    # Lockfiles
+    "*.lock",
+    "package-lock.json",
+    "npm-shrinkwrap.json",
+    "pnpm-lock.yaml",
+    "go.sum",
+    # Minified and bundled assets
+    "*.min.js",
+    "*.min.css",
+    "*.map",
+    # Generated code
+    "*_pb2.py",
+    "*_pb2_grpc.py",
+    "*.pb.go",
+    "*.generated.*",
+)
+
+
+class SkipReason(Enum):
+    EXCLUDED = "excluded by pattern"
+    NOT_INCLUDED = "not included by pattern"
+    BINARY = "binary"
+    DELETED = "deleted"
+    RENAMED = "pure rename or copy"
+    NO_CONTENT = "no content changes"
+    WHITESPACE = "whitespace-only"
+    TOO_LARGE = "diff too large"
+
+
+def matches(path: str, patterns: Iterable[str]) -> bool:
+    """
+    Checks whether a path matches any of the glob patterns.
+
+    Patterns without a `/` are matched against the file name, and the others against the whole path.
+
+    :param path: The path of the file.
+    :param patterns: The glob patterns.
+    :return: True if the path matches a pattern.
+    """
+    file_name = path.rsplit("/", 1)[-1]
+    return any(fnmatchcase(path if "/" in pattern else file_name, pattern) for pattern in patterns)
+
+
+class SkipRules:
+    def __init__(
+        self,
+        include: Iterable[str] = (),
+        exclude: Iterable[str] = DEFAULT_EXCLUDE,
+        max_diff_lines: int = 0,
+        skip_deleted: bool = True,
+        whitespace_changes: set[str] | None = None,
+    ):
+        """
+        Initializes the SkipRules.
+
+        :param include: If not empty, only the paths matching one of these glob patterns are reviewed.
+        :param exclude: The paths matching one of these glob patterns are never reviewed.
+        :param max_diff_lines: The maximum number of added and deleted lines of a reviewed file, or 0 for no limit.
+        :param skip_deleted: Whether to skip deleted files.
+        :param whitespace_changes: The paths that still have changes when whitespace is ignored, like the ones
+            listed by `git diff -w --numstat`. Files with hunks missing from it are whitespace-only changes.
+            None disables the whitespace check.
+        """
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self.max_diff_lines = max_diff_lines
+        self.skip_deleted = skip_deleted
+        self.whitespace_changes = whitespace_changes
+        self.skipped: Counter[SkipReason] = Counter()
+
+    def skip_reason(self, diff_file: DiffFile) -> SkipReason | None:
+        """
+        Gets the reason why a file should not be sent for review.
+
+        :param diff_file: The diff of the file.
+        :return: The reason to skip the file, or None if it should be reviewed.
+        """
+        path = diff_file.path
+        if self.include and not matches(path, self.include):
+            return SkipReason.NOT_INCLUDED
+        if matches(path, self.exclude):
+            return SkipReason.EXCLUDED
+        if diff_file.is_binary:
+            return SkipReason.BINARY
+        if diff_file.status == FileStatus.DELETED and self.skip_deleted:
+            return SkipReason.DELETED
+        if not diff_file.hunks:
+            if diff_file.status in (FileStatus.RENAMED, FileStatus.COPIED):
+                return SkipReason.RENAMED
+            return SkipReason.NO_CONTENT
+        if self.whitespace_changes is not None and path not in self.whitespace_changes:
+            return SkipReason.WHITESPACE
+        if self.max_diff_lines and self._changed_lines(diff_file) > self.max_diff_lines:
+            return SkipReason.TOO_LARGE
+        return None
+
+    def filter(self, diff_files: Iterable[DiffFile]) -> Iterator[DiffFile]:
+        """
+        Lazily drops the files that should not be reviewed, counting them in `skipped` by reason.
+
+        :param diff_files: The diffs of the files.
+        :return: An iterator of the diffs of the files to review.
+        """
+        for diff_file in diff_files:
+            reason = self.skip_reason(diff_file)
+            if reason is None:
+                yield diff_file
+            else:
+                self.skipped[reason] += 1
+
+    def summary(self, calls_per_file: int) -> str | None:
+        """
+        Describes the skipped files.
+
+        :param calls_per_file: The number of requests that reviewing a file takes.
+        :return: The summary, or None if no file was skipped.
+        """
+        total = sum(self.skipped.values())
+        if not total:
+            return None
+        reasons = ", ".join(f"{count} {reason.value}" for reason, count in self.skipped.most_common())
+        return f"Skipped {total} file(s) and {total * calls_per_file} API call(s): {reasons}."
+
+    def _changed_lines(self, diff_file: DiffFile) -> int:
+        return sum(1 for hunk in diff_file.hunks for line in hunk.lines if line[:1] in ("+", "-"))
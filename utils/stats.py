@@ -0,0 +1,305 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, TypeVar
+
+from utils.pricing import estimate_cost
+
+T = TypeVar("T")
+
+# The (file, feedback type) a worker thread is currently reviewing
+_CALL_CONTEXT: ContextVar[tuple[str | None, str | None]] = ContextVar("call_context", default=(None, None))
+
+
+@contextmanager
+def call_context(file_name: str | None, feedback_type: str | None) -> Iterator[None]:
+    """
+    Labels the calls made inside the block with the file and feedback type they review.
+
+    :param file_name: The reviewed file, or several comma-separated files for packed requests.
+    :param feedback_type: The requested feedback type, or several `+`-separated ones for combined requests.
+    """
+    token = _CALL_CONTEXT.set((file_name, feedback_type))
+    try:
+        yield
+    finally:
+        _CALL_CONTEXT.reset(token)
+
+
+class CallRecord:
+    """A single call to the AI consumer, with its retries."""
+
+    __slots__ = (
+        "file",
+        "feedback_type",
+        "model",
+        "latency",
+        "input_tokens",
+        "output_tokens",
+        "cached_tokens",
+        "retries",
+        "error",
+    )
+
+    def __init__(
+        self,
+        file: str | None,
+        feedback_type: str | None,
+        model: str,
+        latency: float,
+        input_tokens: int | None = None,
+        output_tokens: int | None = None,
+        cached_tokens: int | None = None,
+        retries: int = 0,
+        error: str | None = None,
+    ):
+        self.file = file
+        self.feedback_type = feedback_type
+        self.model = model
+        self.latency = latency
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cached_tokens = cached_tokens
+        self.retries = retries
+        self.error = error
+
+    def to_dict(self) -> dict[str, Any]:
+        return {**{name: getattr(self, name) for name in self.__slots__}, "cost": self.cost}
+
+    @property
+    def cost(self) -> float | None:
+        if self.input_tokens is None or self.output_tokens is None:
+            return None
+        return estimate_cost(self.model, self.input_tokens, self.output_tokens, self.cached_tokens or 0)
+
+
+def _usage_count(value: Any) -> int | None:
+    return value if isinstance(value, int) else None
+
+
+class RunStats:
+    """
+    Thread-safe collector of the calls made and the time spent in each phase of a run.
+
+    Phases can be nested, and the time of a phase never includes the time of the phases nested in it.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.calls: list[CallRecord] = []
+        self.phases: dict[str, float] = defaultdict(float)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # The estimated input tokens of every trimmed file, before and after trimming its context
+        self.context_tokens: dict[str, tuple[int, int]] = {}
+        # The passes triage requested for every file and why, like `Triage.to_dict` returns them
+        self.triage: dict[str, Any] = {}
+        self.lock = threading.Lock()
+        self._stack = threading.local()
+
+    def record_call(
+        self,
+        model: str,
+        latency: float,
+        usage: Any = None,
+        retries: int = 0,
+        error: str | None = None,
+    ) -> CallRecord:
+        """
+        Records a call, labelled with the current `call_context`.
+
+        :param model: The model used.
+        :param latency: The wall time of the call, in seconds.
+        :param usage: The `usage` of the API response, if any.
+        :param retries: The number of retries the call took.
+        :param error: The error that made the call fail, if any.
+        :return: The recorded call.
+        """
+        file_name, feedback_type = _CALL_CONTEXT.get()
+        input_details = getattr(usage, "input_tokens_details", None)
+        record = CallRecord(
+            file=file_name,
+            feedback_type=feedback_type,
+            model=model,
+            latency=latency,
+            input_tokens=_usage_count(getattr(usage, "input_tokens", None)),
+            output_tokens=_usage_count(getattr(usage, "output_tokens", None)),
+            cached_tokens=_usage_count(getattr(input_details, "cached_tokens", None)),
+            retries=retries,
+            error=error,
+        )
+        with self.lock:
+            self.calls.append(record)
+        return record
+
+    def record_context(self, file_name: str, before: int, after: int) -> None:
+        """
+        Records the estimated input tokens of a file before and after trimming its context.
+
+        :param file_name: The trimmed file.
+        :param before: The estimated tokens of the raw diff.
+        :param after: The estimated tokens of the trimmed diff.
+        """
+        with self.lock:
+            self.context_tokens[file_name] = (before, after)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Adds the time spent inside the block to the given phase.
+
+        :param name: The name of the phase.
+        """
+        stack = self._phase_stack()
+        stack.append([name, 0.0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            _, nested = stack.pop()
+            with self.lock:
+                self.phases[name] += elapsed - nested
+            if stack:
+                stack[-1][1] += elapsed
+
+    def timed(self, iterable: Iterable[T], name: str) -> Iterator[T]:
+        """
+        Lazily iterates, adding the time spent producing every item to the given phase.
+
+        :param iterable: The iterable to time.
+        :param name: The name of the phase.
+        :return: An iterator of the same items.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        Gets the stats as a JSON serializable dict.
+        """
+        with self.lock:
+            calls = list(self.calls)
+            phases = dict(self.phases)
+            context_tokens = dict(self.context_tokens)
+        return {
+            "wall": time.perf_counter() - self.started,
+            "phases": phases,
+            "cache": {"hits": self.cache_hits, "misses": self.cache_misses},
+            "totals": self._totals(calls),
+            "context": {
+                file_name: {"before": before, "after": after} for file_name, (before, after) in context_tokens.items()
+            },
+            "triage": self.triage,
+            "calls": [call.to_dict() for call in calls],
+        }
+
+    def write_json(self, path: str) -> None:
+        """
+        Writes the stats as JSON.
+
+        :param path: The path of the JSON file.
+        """
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    def summary(self, top: int = 5) -> str:
+        """
+        Describes the run: totals, phase timings, context savings, triage decisions, and the split by model,
+        feedback type and file.
+
+        :param top: The number of models, feedback types and files listed, slowest first.
+        :return: The summary.
+        """
+        stats = self.to_dict()
+        with self.lock:
+            calls = list(self.calls)
+        totals = stats["totals"]
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in stats["phases"].items())
+        lines = [
+            f"Review stats: {totals['calls']} call(s), {totals['errors']} error(s), {totals['retries']} retries "
+            f"in {stats['wall']:.2f}s" + (f" ({phases})" if phases else ""),
+            f"Tokens: {totals['input_tokens']:,} input ({totals['cached_tokens']:,} cached), "
+            f"{totals['output_tokens']:,} output, estimated cost ${totals['cost']:.4f}",
+        ]
+        if self.cache_hits or self.cache_misses:
+            lines.append(f"Cache: {self.cache_hits} hit(s), {self.cache_misses} miss(es)")
+        if totals["cached_tokens"]:
+            lines.append(self._prompt_cache_summary(calls, totals))
+        if stats["context"]:
+            before = sum(tokens["before"] for tokens in stats["context"].values())
+            after = sum(tokens["after"] for tokens in stats["context"].values())
+            lines.append(
+                f"Context trimming: {before:,} -> {after:,} estimated input tokens in {len(stats['context'])} file(s)"
+            )
+            ranked_files = sorted(stats["context"].items(), key=lambda item: item[1]["after"] - item[1]["before"])
+            for name, tokens in ranked_files[:top]:
+                lines.append(f"  {name}: {tokens['before']:,} -> {tokens['after']:,}")
+        triaged = [(name, decision) for name, decision in stats["triage"].items() if decision["reasons"]]
+        if triaged:
+            lines.append(f"Triage decisions: {len(triaged)} of {len(stats['triage'])} file(s) need more than REVIEW")
+            for name, decision in triaged[:top]:
+                reasons = ", ".join(
+                    f"{feedback_type} ({reason})" for feedback_type, reason in decision["reasons"].items()
+                )
+                lines.append(f"  {name}: {reasons}")
+        for group in ("model", "feedback_type", "file"):
+            grouped: dict[str, list[CallRecord]] = defaultdict(list)
+            for call in calls:
+                grouped[getattr(call, group) or "unknown"].append(call)
+            ranked = sorted(grouped.items(), key=lambda item: -sum(call.latency for call in item[1]))
+            lines.append(f"By {group.replace('_', ' ')}:")
+            for name, group_calls in ranked[:top]:
+                group_totals = self._totals(group_calls)
+                lines.append(
+                    f"  {name}: {group_totals['calls']} call(s), {group_totals['latency']:.2f}s, "
+                    f"{group_totals['input_tokens']:,} input"
+                    + (f" ({group_totals['cached_tokens']:,} cached)" if group_totals["cached_tokens"] else "")
+                    + f" / {group_totals['output_tokens']:,} output tokens, "
+                    f"${group_totals['cost']:.4f}"
+                )
+        return "\n".join(lines)
+
+    def _prompt_cache_summary(self, calls: list[CallRecord], totals: dict[str, Any]) -> str:
+        """
+        Describes how much of the input the provider served from its prompt cache, and the latency of the
+        calls that hit it compared to the others.
+        """
+        hits = [call.latency for call in calls if call.cached_tokens]
+        misses = [call.latency for call in calls if not call.cached_tokens and not call.error]
+        summary = (
+            f"Prompt cache: {len(hits)} of {totals['calls']} call(s) hit, "
+            f"{totals['cached_tokens'] / max(totals['input_tokens'], 1):.0%} of the input tokens cached, "
+            f"{sum(hits) / len(hits):.2f}s average latency"
+        )
+        if misses:
+            summary += f" ({sum(misses) / len(misses):.2f}s without)"
+        return summary
+
+    def _totals(self, calls: list[CallRecord]) -> dict[str, Any]:
+        return {
+            "calls": len(calls),
+            "errors": sum(1 for call in calls if call.error),
+            "retries": sum(call.retries for call in calls),
+            "latency": sum(call.latency for call in calls),
+            "input_tokens": sum(call.input_tokens or 0 for call in calls),
+            "cached_tokens": sum(call.cached_tokens or 0 for call in calls),
+            "output_tokens": sum(call.output_tokens or 0 for call in calls),
+            "cost": sum(call.cost or 0 for call in calls),
+        }
+
+    def _phase_stack(self) -> list[list[Any]]:
+        if not hasattr(self._stack, "phases"):
+            self._stack.phases = []
+        stack: list[list[Any]] = self._stack.phases
+        return stack
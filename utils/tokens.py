@@ -0,0 +1,18 @@
+import re
+
+# Words, numbers and single punctuation characters, the units a BPE tokenizer rarely merges across
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+# Average number of characters of a BPE token inside a long word
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of a text without downloading a tokenizer.
+
+    The estimate errs on the high side for code, so budgets based on it are rarely exceeded.
+
+    :param text: The text to measure.
+    :return: The estimated number of tokens.
+    """
+    return sum((len(match) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN for match in TOKEN_PATTERN.findall(text))
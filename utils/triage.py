@@ -0,0 +1,327 @@
+import ast
+import bisect
+import re
+from collections import Counter
+from collections.abc import Iterable
+from fnmatch import fnmatchcase
+from typing import Any
+
+from utils.ai_feedback_filter import FeedbackType
+from utils.context import changed_lines
+from utils.diff_parser import DiffFile
+from utils.skip_rules import matches
+
+# The passes triage can skip. REVIEW is always requested
+GATED_TYPES = (FeedbackType.SECURITY, FeedbackType.FORMAT)
+DEFAULT_MAX_LINE_LENGTH = 120
+# The files checked on their syntax tree
+PYTHON_SUFFIXES = (".py", ".pyi")
+
+# Files whose changes are security relevant whatever they contain: configuration, dependencies and CI
+SECURITY_PATHS = (
+    "*auth*",
+    "*login*",
+    "*password*",
+    "*secret*",
+    "*crypt*",
+    "*security*",
+    "*permission*",
+    "settings.py",
+    ".env*",
+    "*.env",
+    "Dockerfile*",
+    ".github/workflows/*",
+    ".gitlab-ci.yml",
+    "requirements*.txt",
+    "pyproject.toml",
+    "setup.py",
+    "package.json",
+)
+# Modules whose import makes a change security relevant: processes, deserialization, crypto, network, SQL
+SECURITY_MODULES = frozenset(
+    {
+        "subprocess",
+        "pickle",
+        "marshal",
+        "shelve",
+        "yaml",
+        "hashlib",
+        "hmac",
+        "ssl",
+        "secrets",
+        "crypt",
+        "cryptography",
+        "Crypto",
+        "jwt",
+        "requests",
+        "httpx",
+        "urllib",
+        "http",
+        "socket",
+        "sqlite3",
+        "psycopg2",
+        "pymysql",
+        "sqlalchemy",
+        "xml",
+        "lxml",
+        "tempfile",
+        "ctypes",
+        "flask",
+        "django",
+        "fastapi",
+        "paramiko",
+    }
+)
+# Calls that make a change security relevant, as glob patterns of their dotted names once imports are resolved
+SECURITY_CALLS = (
+    "eval",
+    "exec",
+    "compile",
+    "__import__",
+    "os.system",
+    "os.popen",
+    "os.exec*",
+    "os.spawn*",
+    "os.chmod",
+    "*.execute",
+    "*.executemany",
+    "*.executescript",
+    "*.raw",
+    "*.extractall",
+    "*.urlopen",
+    "*.mktemp",
+    *(f"{module}.*" for module in SECURITY_MODULES),
+)
+# Names of variables, attributes, arguments and keyword arguments that deal with authentication and secrets
+SENSITIVE_NAME = re.compile(
+    r"passw|secret|token|api_?key|credential|auth(?!or)|session|cookie|csrf|permission|private_?key|verify|shell",
+    re.IGNORECASE,
+)
+SQL = re.compile(
+    r"\b(SELECT\s.+\sFROM|INSERT\s+INTO|UPDATE\s.+\sSET|DELETE\s+FROM|DROP\s+TABLE|CREATE\s+TABLE)\b",
+    re.IGNORECASE,
+)
+# Security relevant tokens of the languages without a parser here, and of the removed lines
+SECURITY_TOKENS = re.compile(
+    r"\b(subprocess|os\.system|popen|child_process|spawn|eval|exec|pickle|marshal|unserialize|deserializ\w*"
+    r"|yaml\.load|shell\s*=\s*True|verify\s*=\s*False|md5|sha1|hashlib|crypto\w*|cipher|encrypt|decrypt|jwt"
+    r"|passw\w*|secret|token|api[_-]?key|credential|auth\w*|session|cookie|csrf|cors|sanitiz\w*|escape"
+    r"|innerHTML|dangerouslySetInnerHTML|urlopen|fetch|XMLHttpRequest|request|response)\b",
+    re.IGNORECASE,
+)
+# Files indented with tabs by convention
+TAB_INDENTED = ("Makefile", "*.mk", "*.go", "*.tsv")
+
+
+class Triage:
+    """
+    Decides locally which of the expensive passes every file needs, from its changed lines: SECURITY when
+    they touch processes, evaluation, deserialization, SQL, crypto, authentication, secrets or requests,
+    and FORMAT when a lint-only check finds formatting issues in the added lines. REVIEW is always requested.
+
+    Python files are checked on the syntax tree of their new content when it is available and parses,
+    with their imports resolved, and the other files on the tokens of their changed lines. Removed lines
+    are always checked on their tokens, as removing a check is a security relevant change too.
+    """
+
+    def __init__(self, feedback_types: list[FeedbackType], max_line_length: int = DEFAULT_MAX_LINE_LENGTH):
+        """
+        Initializes the Triage.
+
+        :param feedback_types: The requested feedback types. Only SECURITY and FORMAT are gated.
+        :param max_line_length: The length over which an added line needs a FORMAT pass.
+        """
+        self.feedback_types = feedback_types
+        self.max_line_length = max_line_length
+        # The feedback types of every triaged file, by file name
+        self.file_feedback_types: dict[str, list[FeedbackType]] = {}
+        # Why every triaged file got each gated pass, by file name and feedback type value
+        self.reasons: dict[str, dict[str, str]] = {}
+        self.skipped: Counter[FeedbackType] = Counter()
+
+    def triage(self, file_name: str, diff_file: DiffFile, source: str | None = None) -> list[FeedbackType]:
+        """
+        Decides which passes a file needs, and records the decision.
+
+        :param file_name: The name the file is reviewed under.
+        :param diff_file: The diff of the file.
+        :param source: The new content of the file, if known, to check Python files on their syntax tree.
+        :return: The feedback types to request for the file.
+        """
+        reasons = {}
+        if FeedbackType.SECURITY in self.feedback_types:
+            reason = self.security_reason(diff_file, source)
+            if reason is not None:
+                reasons[FeedbackType.SECURITY.value] = reason
+        if FeedbackType.FORMAT in self.feedback_types:
+            reason = self.format_reason(diff_file)
+            if reason is not None:
+                reasons[FeedbackType.FORMAT.value] = reason
+        feedback_types = [
+            feedback_type
+            for feedback_type in self.feedback_types
+            if feedback_type not in GATED_TYPES or feedback_type.value in reasons
+        ]
+        self.skipped.update(
+            feedback_type for feedback_type in self.feedback_types if feedback_type not in feedback_types
+        )
+        self.file_feedback_types[file_name] = feedback_types
+        self.reasons[file_name] = reasons
+        return feedback_types
+
+    def security_reason(self, diff_file: DiffFile, source: str | None = None) -> str | None:
+        """
+        Checks whether the change of a file is security relevant.
+
+        :param diff_file: The diff of the file.
+        :param source: The new content of the file, if known.
+        :return: Why the change is security relevant, or None if it is not.
+        """
+        if matches(diff_file.path, SECURITY_PATHS):
+            return "sensitive path"
+        added, removed = changed_lines(diff_file)
+        tree = _parse_python(diff_file.path, source)
+        if tree is not None:
+            reason = _python_security_reason(tree, added)
+        else:
+            reason = _token_reason(_lines(diff_file, "+"), "added")
+        if reason is None:
+            reason = _token_reason((line for lines in removed.values() for line in lines), "removed")
+        return reason
+
+    def format_reason(self, diff_file: DiffFile) -> str | None:
+        """
+        Lints the added lines of a file for formatting issues.
+
+        :param diff_file: The diff of the file.
+        :return: The first issue found, or None if there is none.
+        """
+        tab_indented = matches(diff_file.path, TAB_INDENTED)
+        previous = ""
+        for line in (line for hunk in diff_file.hunks for line in hunk.lines):
+            if line.startswith("\\") and previous.startswith("+"):
+                return "no newline at end of file"
+            previous = line
+            if not line.startswith("+"):
+                continue
+            content = line[1:]
+            if content.endswith("\r"):
+                return "carriage return"
+            if content != content.rstrip():
+                return "trailing whitespace"
+            if not tab_indented and content[: len(content) - len(content.lstrip())].count("\t"):
+                return "tab indentation"
+            if len(content) > self.max_line_length:
+                return f"line longer than {self.max_line_length} characters"
+        return None
+
+    def summary(self) -> str | None:
+        """
+        Describes the passes skipped by triage.
+
+        :return: The summary, or None if no file was triaged.
+        """
+        gated = [feedback_type for feedback_type in self.feedback_types if feedback_type in GATED_TYPES]
+        if not self.file_feedback_types or not gated:
+            return None
+        files = len(self.file_feedback_types)
+        passes = ", ".join(
+            f"{feedback_type.value} for {files - self.skipped[feedback_type]} of {files} file(s)"
+            for feedback_type in gated
+        )
+        return f"Triage: requested {passes}."
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        Gets the decisions as a JSON serializable dict: the passes of every file, and why it got them.
+        """
+        return {
+            file_name: {
+                "feedback_types": [feedback_type.value for feedback_type in feedback_types],
+                "reasons": self.reasons[file_name],
+            }
+            for file_name, feedback_types in self.file_feedback_types.items()
+        }
+
+
+def _lines(diff_file: DiffFile, prefix: str) -> Iterable[str]:
+    return (line for hunk in diff_file.hunks for line in hunk.lines if line.startswith(prefix))
+
+
+def _token_reason(lines: Iterable[str], kind: str) -> str | None:
+    for line in lines:
+        match = SECURITY_TOKENS.search(line[1:]) or SQL.search(line[1:])
+        if match:
+            return f"{match.group().strip()} in {kind} lines"
+    return None
+
+
+def _parse_python(path: str, source: str | None) -> ast.Module | None:
+    if source is None or not path.endswith(PYTHON_SUFFIXES):
+        return None
+    try:
+        return ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+
+
+def _dotted_name(node: ast.expr, aliases: dict[str, str]) -> str | None:
+    """Gets the dotted name of a call target like `subprocess.run`, resolving the imported names."""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(aliases.get(node.id, node.id))
+    return ".".join(reversed(parts))
+
+
+def _python_security_reason(tree: ast.Module, added: set[int]) -> str | None:
+    """Finds a security relevant construct on the added lines of a Python syntax tree."""
+    added_lines = sorted(added)
+    aliases = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            aliases.update({alias.asname: alias.name for alias in node.names if alias.asname})
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            for alias in node.names:
+                aliases[alias.asname or alias.name] = f"{node.module}.{alias.name}"
+
+    for node in ast.walk(tree):
+        lineno = getattr(node, "lineno", None)
+        if lineno is None:
+            continue
+        # Whether an added line is within the lines of the node
+        index = bisect.bisect_left(added_lines, lineno)
+        if index == len(added_lines) or added_lines[index] > (getattr(node, "end_lineno", None) or lineno):
+            continue
+        if isinstance(node, ast.Import | ast.ImportFrom):
+            modules = [alias.name for alias in node.names] if isinstance(node, ast.Import) else [node.module or ""]
+            for module in modules:
+                if module.split(".")[0] in SECURITY_MODULES:
+                    return f"import of {module} on line {lineno}"
+        elif isinstance(node, ast.Call):
+            name = _dotted_name(node.func, aliases)
+            if name is not None and any(fnmatchcase(name, pattern) for pattern in SECURITY_CALLS):
+                return f"call to {name} on line {lineno}"
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str) and SQL.search(node.value):
+            return f"SQL string on line {lineno}"
+        else:
+            name = _sensitive_name(node)
+            if name is not None:
+                return f"{name} on line {lineno}"
+    return None
+
+
+def _sensitive_name(node: ast.AST) -> str | None:
+    if isinstance(node, ast.Name):
+        name = node.id
+    elif isinstance(node, ast.Attribute):
+        name = node.attr
+    elif isinstance(node, ast.arg | ast.keyword):
+        # The keyword of `**kwargs` has no name
+        name = node.arg or ""
+    else:
+        return None
+    return name if SENSITIVE_NAME.search(name) else None
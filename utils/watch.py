@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+
+from utils.ai_feedback_filter import AIConsumerFeedbackResponse, FeedbackType
+from utils.dispatcher import DEFAULT_MAX_WORKERS, ReviewDispatcher
+
+DEFAULT_DEBOUNCE = 2.0
+DEFAULT_POLL_INTERVAL = 0.5
+
+
+class IndexWatcher:
+    """
+    Polls the modification time of the git index, which changes whenever files are staged or unstaged.
+    """
+
+    def __init__(self, index_path: str, debounce: float = DEFAULT_DEBOUNCE):
+        """
+        Initializes the IndexWatcher. The current index counts as a change, so it is reviewed too.
+
+        :param index_path: The path of the git index.
+        :param debounce: How long the index must stay unchanged before a change is reported, in seconds.
+        """
+        self.index_path = index_path
+        self.debounce = debounce
+        self._mtime = self._read_mtime()
+        self._changed_at: float | None = time.monotonic()
+
+    @property
+    def pending(self) -> bool:
+        """Whether the index changed and the change has not been reported yet."""
+        return self._changed_at is not None
+
+    def poll(self, now: float | None = None) -> bool:
+        """
+        Checks the index for changes.
+
+        :param now: The current `time.monotonic()`.
+        :return: Whether the index changed and then stayed unchanged for the debounce time.
+        """
+        now = time.monotonic() if now is None else now
+        mtime = self._read_mtime()
+        if mtime != self._mtime:
+            self._mtime = mtime
+            self._changed_at = now
+        if self._changed_at is not None and now - self._changed_at >= self.debounce:
+            self._changed_at = None
+            return True
+        return False
+
+    def _read_mtime(self) -> int | None:
+        try:
+            return os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+
+class SpeculativeReviewer:
+    """
+    Reviews the staged files before they are committed, so that the hook finds their feedback in the cache.
+
+    The feedback is cached by the same `AIConsumerFeedbackResponse` the hook uses, under keys derived from
+    the file diffs, so only diffs that are still staged when the hook runs can match.
+    """
+
+    def __init__(
+        self,
+        feedback_response: AIConsumerFeedbackResponse,
+        feedback_types: list[FeedbackType],
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        combined: bool = False,
+        pack_tokens: int = 0,
+    ):
+        """
+        Initializes the SpeculativeReviewer.
+
+        :param feedback_response: The feedback response used to review each file, with a cache.
+        :param feedback_types: The types of feedback to request for each file.
+        :param max_workers: The maximum number of requests sent at the same time.
+        :param combined: Whether to request all the feedback types of a file with a single call.
+        :param pack_tokens: The token budget used to pack several small files into a single request.
+        """
+        if feedback_response.cache is None:
+            raise ValueError("Reviewing ahead of the commit needs a cache")
+        self.feedback_response = feedback_response
+        self.feedback_types = feedback_types
+        self.max_workers = max_workers
+        self.combined = combined
+        self.pack_tokens = pack_tokens
+
+    def review(
+        self,
+        files: list[tuple[str, list[str]]],
+        cancel_event: threading.Event | None = None,
+    ) -> tuple[list[str], list[str]]:
+        """
+        Reviews the files, caching their feedback.
+
+        :param files: The (file name, chunks) pairs to review.
+        :param cancel_event: Cancels the review when set, if given.
+        :return: The names of the reviewed files and of those that got feedback.
+        """
+        dispatcher = ReviewDispatcher(
+            self.feedback_response,
+            max_workers=self.max_workers,
+            combined=self.combined,
+            pack_tokens=self.pack_tokens,
+            cancel_event=cancel_event,
+        )
+        reviewed = []
+        with_feedback = []
+        for file_name, feedback in dispatcher.review(files, self.feedback_types):
+            reviewed.append(file_name)
+            if any(feedback.values()):
+                with_feedback.append(file_name)
+        return reviewed, with_feedback
+
+    def discard_stale(
+        self,
+        reviewed: list[tuple[str, list[str]]],
+        staged: list[tuple[str, list[str]]],
+    ) -> list[str]:
+        """
+        Removes the cached feedback of the reviewed files whose diff is no longer staged.
+
+        :param reviewed: The (file name, chunks) pairs that were reviewed.
+        :param staged: The (file name, chunks) pairs staged now.
+        :return: The names of the files whose feedback was discarded.
+        """
+        cache = self.feedback_response.cache
+        assert cache is not None
+        staged_chunks = dict(staged)
+        discarded = []
+        for file_name, chunks in reviewed:
+            if staged_chunks.get(file_name) == chunks:
+                continue
+            discarded.append(file_name)
+            for input in chunks:
+                for feedback_type in self.feedback_types:
+                    # A combined review caches the feedback types it requested on their own apart from the others
+                    cache.delete(self.feedback_response.cache_key(input, feedback_type))
+                    cache.delete(self.feedback_response.cache_key(input, feedback_type, combined=True))
+        return discarded